@@ -0,0 +1,102 @@
+"""
+Exercise the Apple Music client in sql_app.routes.apple_music_utils against the local mock server.
+
+  retries     GET and POST against scripted 429 / 503 / slow replies: 429 is always retried, 5xx
+              and timeouts only for idempotent methods, so a playlist is never created twice; and a
+              stalled GET under a deadline, which gives up at the deadline rather than the read timeout
+  rate limit  a burst of GETs from many threads against a mock that throttles above --server-rate,
+              with the client's token bucket at --rate and with it disabled
+  pages       one 100-track recently-played fetch, sequential vs parallel pages (--page-delay)
+  users       the preference refresh's fan-out: --users users paged one at a time each, run
+              sequentially and PREFERENCE_REFRESH_CONCURRENCY at a time under the token bucket
+
+    cd fastapi && python benchmarks/apple_music_client.py --page-delay 0.1 --users 40
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from apple_music_mock_server import RECENTLY_PLAYED_PATH, MockAppleHandler, start_mock_server
+
+def throttled_burst(apple_music_utils, calls, threads):
+    MockAppleHandler.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        responses = list(executor.map(lambda _: apple_music_utils.apple_music_request('GET', '/v1/me/library/songs', headers={}), range(calls)))
+    elapsed = time.perf_counter() - start
+    failed = sum(response.status_code != 200 for response in responses)
+    throttled = MockAppleHandler.statuses[('GET', 429)]
+    return f"{calls} calls in {elapsed:5.2f} s ({calls / elapsed:5.1f}/s), {throttled:3d} throttled by the server, {failed} failed"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-delay', type=float, default=0.1, help='mock seconds per reply for the pages/users runs')
+    parser.add_argument('--rate', type=float, default=20, help='client token bucket, requests/second')
+    parser.add_argument('--server-rate', type=float, default=25, help='mock throttles above this many requests/second')
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    server = start_mock_server()
+    os.environ.update(APPLE_MUSIC_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}")
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import apple_music_utils
+    from sql_app.routes._utils import _get_apple_music_recently_played_tracks
+
+    print("retries (attempts seen by the server -> final result):")
+    for method, path in [('GET', RECENTLY_PLAYED_PATH), ('POST', '/v1/me/library/playlists')]:
+        for label, headers, kwargs in [('429, 429', {'X-Mock-Status': '429,429'}, {}),
+                                       ('503', {'X-Mock-Status': '503'}, {}),
+                                       ('stall 2 s', {'X-Mock-Delay': '2'}, {'timeout': (1, 0.5)})]:
+            request_id = f'{method} {label}'
+            try:
+                response = apple_music_utils.apple_music_request(method, path, headers=dict(headers, **{'X-Mock-Request-Id': request_id}), json={}, **kwargs)
+                result = response.status_code
+            except requests.Timeout:
+                result = 'read timeout raised'
+            print(f"  {method:4} {label:10} {MockAppleHandler.attempts[request_id]} attempt(s) -> {result}")
+
+    # A per-user deadline bounds the attempt's read timeout and the retries, not just the gap between pages
+    start = time.perf_counter()
+    try:
+        apple_music_utils.apple_music_request('GET', RECENTLY_PLAYED_PATH, headers={'X-Mock-Request-Id': 'deadline', 'X-Mock-Delay': '5'},
+                                              deadline=time.monotonic() + 1.5)
+    except TimeoutError:
+        pass
+    print(f"  GET  stall 5 s, 1.5 s deadline -> TimeoutError after {time.perf_counter() - start:.2f} s")
+
+    MockAppleHandler.rate_limit = args.server_rate
+    print(f"rate limit (mock throttles above {args.server_rate:g}/s, {args.calls} GETs from 16 threads):")
+    apple_music_utils._process_rate_limiter = apple_music_utils.TokenBucket(args.rate, apple_music_utils.APPLE_MUSIC_PROCESS_RATE_LIMIT_BURST)
+    print(f"  token bucket {args.rate:g}/s: {throttled_burst(apple_music_utils, args.calls, 16)}")
+    apple_music_utils._process_rate_limiter = apple_music_utils.TokenBucket(0, 1)
+    print(f"  no bucket:       {throttled_burst(apple_music_utils, args.calls, 16)}")
+    MockAppleHandler.rate_limit = 0.0
+
+    MockAppleHandler.page_delay = args.page_delay
+    headers = {'Authorization': 'Bearer mock', 'Music-User-Token': 'mock'}
+    print(f"pages (100 tracks, {args.page_delay * 1000:.0f} ms per page):")
+    for parallel in (False, True):
+        start = time.perf_counter()
+        tracks = _get_apple_music_recently_played_tracks(headers, track_limit=100, parallel=parallel)
+        print(f"  {'parallel' if parallel else 'sequential':10} {time.perf_counter() - start:5.2f} s, {len(tracks)} tracks")
+
+    apple_music_utils._process_rate_limiter = apple_music_utils.TokenBucket(args.rate, apple_music_utils.APPLE_MUSIC_PROCESS_RATE_LIMIT_BURST)
+    print(f"users ({args.users} users x 100 tracks, token bucket {args.rate:g}/s):")
+    fetch = lambda _: _get_apple_music_recently_played_tracks(headers, track_limit=100, parallel=False)  # noqa: E731
+    for workers in (1, args.concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch, range(args.users)))
+        print(f"  {workers} at a time: {time.perf_counter() - start:5.2f} s")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
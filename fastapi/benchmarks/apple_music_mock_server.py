@@ -0,0 +1,154 @@
+"""
+Local stand-in for the Apple Music API endpoints the app calls: recently played tracks (paged,
+GET /v1/me/recent/played/tracks), library songs (GET /v1/me/library/songs) and playlist creation
+(POST /v1/me/library/playlists). Point APPLE_MUSIC_BASE_URL at it to exercise the client's
+pooling, rate limit and retry policy without an Apple developer account.
+
+Failure modes:
+  --page-delay   seconds before every reply (a slow upstream)
+  --rate-limit   server-side token bucket (requests/second, --burst); excess requests get 429
+                 with Retry-After, like Apple's own throttling
+  X-Mock-Status  request header, e.g. "503,429": the first attempts of the request named by
+                 X-Mock-Request-Id get these statuses, later attempts succeed
+  X-Mock-Delay   request header: seconds to stall the first attempt of that request (read timeouts)
+
+    cd fastapi && python benchmarks/apple_music_mock_server.py --port 8999 --page-delay 0.1
+    APPLE_MUSIC_BASE_URL=http://127.0.0.1:8999 uvicorn sql_app.main:app
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RECENTLY_PLAYED_PATH = '/v1/me/recent/played/tracks'
+
+class MockAppleHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    page_delay = 0.0
+    total_tracks = 100
+    rate_limit = 0.0
+    burst = 20
+    attempts = Counter()        # X-Mock-Request-Id -> attempts seen
+    statuses = Counter()        # (method, status) -> responses sent
+    _tokens = 0.0
+    _updated_at = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.attempts = Counter()
+            cls.statuses = Counter()
+            cls._tokens = float(cls.burst)
+            cls._updated_at = time.monotonic()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        with MockAppleHandler._lock:
+            MockAppleHandler.statuses[(self.command, status)] += 1
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out and hung up
+
+    def _throttled(self) -> bool:
+        if self.rate_limit <= 0:
+            return False
+        with MockAppleHandler._lock:
+            now = time.monotonic()
+            MockAppleHandler._tokens = min(self.burst, MockAppleHandler._tokens + (now - MockAppleHandler._updated_at) * self.rate_limit)
+            MockAppleHandler._updated_at = now
+            if MockAppleHandler._tokens < 1:
+                return True
+            MockAppleHandler._tokens -= 1
+            return False
+
+    def _injected_fault(self):
+        """
+        (status, delay) scripted by the X-Mock-* headers for this attempt of the request
+        """
+        request_id = self.headers.get('X-Mock-Request-Id')
+        if not request_id:
+            return None, 0.0
+        with MockAppleHandler._lock:
+            MockAppleHandler.attempts[request_id] += 1
+            attempt = MockAppleHandler.attempts[request_id]
+        statuses = [int(i) for i in self.headers.get('X-Mock-Status', '').split(',') if i.strip()]
+        status = statuses[attempt - 1] if attempt <= len(statuses) else None
+        delay = float(self.headers.get('X-Mock-Delay', 0)) if attempt == 1 else 0.0
+        return status, delay
+
+    def _handle(self):
+        # Always drain the body, so a GET sent with one does not corrupt the next request on the connection
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        if self._throttled():
+            return self._send(429, {'errors': [{'status': '429', 'title': 'Too Many Requests'}]}, {'Retry-After': '1'})
+        status, delay = self._injected_fault()
+        time.sleep(self.page_delay + delay)
+        if status:
+            return self._send(status, {'errors': [{'status': str(status)}]}, {'Retry-After': '0'} if status == 429 else None)
+        url = urlparse(self.path)
+        if self.command == 'GET' and url.path == RECENTLY_PLAYED_PATH:
+            query = parse_qs(url.query)
+            offset, limit = int(query.get('offset', ['0'])[0]), int(query.get('limit', ['30'])[0])
+            end = min(offset + limit, self.total_tracks)
+            page = {'data': [{'id': f'mock.{i}', 'type': 'songs', 'attributes': {'name': f'Track {i}'}} for i in range(offset, end)]}
+            if end < self.total_tracks:
+                page['next'] = f'{RECENTLY_PLAYED_PATH}?offset={end}'
+            return self._send(200, page)
+        if self.command == 'GET' and url.path == '/v1/me/library/songs':
+            return self._send(200, {'data': [{'id': 'i.mock', 'type': 'library-songs'}]})
+        if self.command == 'POST' and url.path == '/v1/me/library/playlists':
+            return self._send(201, {'data': [{'id': 'p.mock', 'type': 'library-playlists', 'attributes': body.get('attributes', {})}]})
+        self._send(404, {'errors': [{'status': '404'}]})
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+def start_mock_server(port: int = 0, page_delay: float = 0.0, total_tracks: int = 100, rate_limit: float = 0.0, burst: int = 20) -> ThreadingHTTPServer:
+    """
+    Start the mock on a background thread (port 0 picks a free port) and return the server
+    """
+    MockAppleHandler.page_delay = page_delay
+    MockAppleHandler.total_tracks = total_tracks
+    MockAppleHandler.rate_limit = rate_limit
+    MockAppleHandler.burst = burst
+    MockAppleHandler.reset()
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockAppleHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--page-delay', type=float, default=0.0, help='seconds to wait before each reply')
+    parser.add_argument('--tracks', type=int, default=100, help='length of the recently played history')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='requests/second before 429s (0 = unlimited)')
+    parser.add_argument('--burst', type=int, default=20)
+    args = parser.parse_args()
+    server = start_mock_server(args.port, args.page_delay, args.tracks, args.rate_limit, args.burst)
+    print(f"Apple Music mock listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
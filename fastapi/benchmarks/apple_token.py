@@ -0,0 +1,55 @@
+"""
+Measure the Apple Music developer token cost under concurrent load.
+
+Generates a throwaway ES256 key, then calls _get_apple_music_auth_header from many threads
+and compares it with signing a fresh JWT on every call (the previous behaviour).
+
+    cd fastapi && python benchmarks/apple_token.py --calls 5000 --threads 16
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+def configure_test_key():
+    key = ec.generate_private_key(ec.SECP256R1())
+    os.environ['APPLE_SECRET'] = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode('utf-8')
+    os.environ['APPLE_ALG'] = 'ES256'
+    os.environ.setdefault('APPLE_KEY_ID', 'BENCHKEY01')
+    os.environ.setdefault('APPLE_TEAM_ID', 'BENCHTEAM1')
+
+def run(func, calls, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: func(), range(calls)))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    configure_test_key()
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import _utils
+
+    uncached = run(_utils._sign_apple_music_developer_token, args.calls, args.threads)
+    stats_before = _utils.get_apple_token_stats()
+    cached = run(lambda: _utils._get_apple_music_auth_header(None), args.calls, args.threads)
+    stats = _utils.get_apple_token_stats()
+
+    print(f"{args.calls} calls on {args.threads} threads")
+    print(f"sign every call: {uncached * 1000:.0f} ms total, {uncached / args.calls * 1e6:.1f} us/call")
+    print(f"cached token:    {cached * 1000:.0f} ms total, {cached / args.calls * 1e6:.1f} us/call")
+    print(f"signatures during cached run: {stats['signed'] - stats_before['signed']}, "
+          f"wall time saved: {(uncached - cached) * 1000:.0f} ms ({uncached / cached:.1f}x)")
+
+if __name__ == '__main__':
+    main()
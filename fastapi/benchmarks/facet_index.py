@@ -0,0 +1,119 @@
+"""
+Compare filter-spec counting on the facet bitmap index against a SQL scan of the same rows.
+
+Builds a synthetic catalog shaped like dbt.fct_tracks / fct_album_descriptors, loads it into an
+in-memory SQLite table (indexed on the filter columns) and into
+sql_app.routes.facet_index_utils.FacetIndex, checks both agree on every spec, and reports build
+time, bitmap memory and per-spec count latency.
+
+    cd fastapi && python benchmarks/facet_index.py --tracks 300000 --specs 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+from sql_app.routes.facet_index_utils import FacetIndex  # noqa: E402
+
+GENRES = {f'Genre{i}': [f'Genre{i} Sub{j}' for j in range(15)] for i in range(20)}
+MOODS = [f'Mood{i}' for i in range(24)]
+LEVELS = {
+    'energy_levels': ['calm/relaxing', 'moderate energy', 'high energy'],
+    'valence_levels': ['sad/depressing', 'neutral/mellow', 'happy/upbeat'],
+    'danceability_levels': ['not danceable', 'somewhat danceable', 'very danceable'],
+    'instrumentalness_levels': ['vocal', 'instrumental'],
+}
+COLUMNS = {'genres': 'genre', 'subgenres': 'subgenre', 'energy_levels': 'energy_level', 'valence_levels': 'valence_level',
+           'danceability_levels': 'danceability_level', 'instrumentalness_levels': 'instrumentalness_level'}
+
+def catalog(n_tracks):
+    tracks, moods = [], []
+    n_albums = max(n_tracks // 10, 1)
+    for album_key in range(n_albums):
+        genre = random.choice(list(GENRES))
+        subgenre = random.choice(GENRES[genre])
+        year = random.randint(1960, 2024) if random.random() > 0.02 else None
+        for mood in random.sample(MOODS, random.randint(0, 3)):
+            moods.append((album_key, mood))
+        for t in range(10):
+            tracks.append((f'{album_key}_{t}', album_key, genre, subgenre,
+                           *(random.choice(scale + [None]) for scale in LEVELS.values()), year))
+    return tracks, moods
+
+def random_spec():
+    spec = {}
+    genre = random.choice(list(GENRES))
+    spec['genres'] = [genre]
+    if random.random() < 0.5:
+        spec['subgenres'] = random.sample(GENRES[genre], 2)
+    if random.random() < 0.6:
+        spec['moods'] = random.sample(MOODS, random.randint(1, 2))
+    for key, scale in LEVELS.items():
+        if random.random() < 0.3:
+            spec[key] = random.sample(scale, 1)
+    if random.random() < 0.5:
+        spec['year_min'] = random.randint(1960, 2010)
+        spec['year_max'] = spec['year_min'] + random.randint(0, 15)
+    return spec
+
+def sql_count(conn, spec):
+    where, params = ['1 = 1'], []
+    if spec.get('moods'):
+        where.append(f"EXISTS (SELECT 1 FROM descriptors d WHERE d.album_key = t.album_key AND d.mood IN ({','.join('?' * len(spec['moods']))}))")
+        params += spec['moods']
+    for key, column in COLUMNS.items():
+        if spec.get(key):
+            where.append(f"{column} IN ({','.join('?' * len(spec[key]))})")
+            params += spec[key]
+    for key, op in [('year_min', '>='), ('year_max', '<=')]:
+        if spec.get(key) is not None:
+            where.append(f"year {op} ?")
+            params.append(spec[key])
+    return conn.execute(f"SELECT COUNT(*) FROM tracks t WHERE {' AND '.join(where)}", params).fetchone()[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=300000)
+    parser.add_argument('--specs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    tracks, moods = catalog(args.tracks)
+    specs = [random_spec() for _ in range(args.specs)]
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE tracks (track_id TEXT PRIMARY KEY, album_key INTEGER, genre TEXT, subgenre TEXT, energy_level TEXT, "
+                 "valence_level TEXT, danceability_level TEXT, instrumentalness_level TEXT, year INTEGER)")
+    conn.execute("CREATE TABLE descriptors (album_key INTEGER, mood TEXT)")
+    conn.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", tracks)
+    conn.executemany("INSERT INTO descriptors VALUES (?, ?)", moods)
+    for column in ['genre', 'subgenre', 'year']:
+        conn.execute(f"CREATE INDEX ix_tracks_{column} ON tracks ({column})")
+    conn.execute("CREATE INDEX ix_descriptors ON descriptors (album_key, mood)")
+
+    start = time.perf_counter()
+    index = FacetIndex(tracks, moods)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sql_counts = [sql_count(conn, spec) for spec in specs]
+    sql_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index_counts = index.count_many(specs)
+    index_elapsed = time.perf_counter() - start
+
+    assert sql_counts == index_counts, "facet index and SQL counts disagree"
+    print(f"{len(tracks)} tracks, {len(moods)} album moods, {len(specs)} specs (mean {sum(sql_counts) / len(specs):.0f} matches)")
+    print(f"facet index build: {build * 1000:.0f} ms, {index.nbytes / 1e6:.1f} MB of bitmaps")
+    print(f"SQL count:   {sql_elapsed / len(specs) * 1e6:8.0f} us/spec")
+    print(f"facet count: {index_elapsed / len(specs) * 1e6:8.0f} us/spec ({sql_elapsed / index_elapsed:.0f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Measure the cold-start import cost of the API, in the style of `python -X importtime`.
+
+Runs `python -X importtime -c "import sql_app.main"` in fresh interpreters, reports the
+median wall-clock time and the slowest modules by cumulative import time, and flags any
+heavy modules (pandas, scikit-learn, anthropic) that were imported eagerly.
+
+    cd fastapi && python benchmarks/import_time.py --runs 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+FASTAPI_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy', 'anthropic']
+
+def run_once(target: str):
+    env = dict(os.environ)
+    # create_engine needs a URL at import time; nothing connects during import
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+                            cwd=FASTAPI_DIR, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return elapsed, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', default='sql_app.main')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    timings = []
+    modules = []
+    for _ in range(args.runs):
+        elapsed, modules = run_once(args.target)
+        timings.append(elapsed)
+
+    print(f"import {args.target}: median {statistics.median(timings) * 1000:.0f} ms over {args.runs} runs (min {min(timings) * 1000:.0f} ms)")
+    total_us = sum(self_us for _, self_us, _ in modules)
+    print(f"modules imported: {len(modules)}, summed self time {total_us / 1000:.0f} ms")
+    print(f"\n{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+
+    imported = {name.split('.')[0] for name, _, _ in modules}
+    eager = [m for m in HEAVY_MODULES if m in imported]
+    print(f"\nheavy modules imported eagerly: {', '.join(eager) if eager else 'none'}")
+
+if __name__ == '__main__':
+    main()
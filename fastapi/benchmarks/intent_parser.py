@@ -0,0 +1,108 @@
+"""
+Measure how many playlist prompts the local intent parser answers and what that saves.
+
+Runs a prompt corpus (built in, or one prompt per line from --corpus) through
+sql_app.routes.intent_utils.IntentVocabulary and through the filter-spec LLM call against the
+local stub server (--delay approximates model latency). Reports the share of prompts answered
+locally, per-path latency, and mean latency with and without the fast path.
+
+    cd fastapi && python benchmarks/intent_parser.py --delay 0.3
+    cd fastapi && python benchmarks/intent_parser.py --corpus prompts.txt --show
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from llm_stub_server import start_stub_server
+
+HIERARCHY = {
+    'Rock': ['Indie Rock', 'Shoegaze', 'Punk', 'Post-Punk', 'Grunge', 'Classic Rock', 'Psychedelic Rock'],
+    'Electronic': ['House', 'Techno', 'Ambient', 'Drum and Bass', 'IDM'],
+    'Pop': ['Synthpop', 'Dream Pop', 'Indie Pop', 'Art Pop'],
+    'Hip-Hop': ['Boom Bap', 'Trap', 'Conscious Hip-Hop'],
+    'Jazz': ['Bebop', 'Jazz Fusion', 'Spiritual Jazz'],
+    'R&B': ['Neo-Soul', 'Contemporary R&B'],
+    'Folk': ['Indie Folk', 'Singer-Songwriter'],
+    'Metal': ['Black Metal', 'Doom Metal'],
+    'Country': [],
+    'Disco': [],
+}
+
+CORPUS = [
+    "70s disco", "early 90s shoegaze", "chill electronic", "sad indie folk", "jazz", "hip hop from the 90s",
+    "90's hip-hop", "ambient music for sleep", "high energy techno", "instrumental hip hop", "happy pop songs",
+    "some grunge please", "house music", "the best of the eighties", "dream pop", "post-punk from 1979 to 1984",
+    "metal", "r&b since 2015", "spiritual jazz", "late 60s psychedelic rock", "upbeat synthpop", "punk songs",
+    "2000s indie rock", "ethereal ambient", "lush dream pop", "gritty punk", "country music", "mellow jazz",
+    "workout playlist", "party tracks",
+    "songs that sound like a rainy sunday morning", "music for a road trip with my dad",
+    "something like radiohead but more upbeat", "not too sad breakup songs", "songs for cooking dinner",
+    "a playlist for a 1920s speakeasy party", "music my grandmother would love", "underrated gems from 2012",
+    "moody late night drive", "songs with great basslines", "happy sad songs", "rock and house",
+    "songs to study to without distractions", "tracks that build slowly to a huge climax",
+    "the soundtrack to a coming of age movie", "bands that sound like early pink floyd",
+    "focus music", "summer bbq classics", "songs about the ocean", "female fronted punk bands",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='file with one prompt per line (defaults to the built-in corpus)')
+    parser.add_argument('--delay', type=float, default=0.3, help='stub seconds before each LLM reply')
+    parser.add_argument('--show', action='store_true', help='print each prompt and how it was answered')
+    args = parser.parse_args()
+
+    prompts = CORPUS
+    if args.corpus:
+        prompts = [line.strip() for line in Path(args.corpus).read_text().splitlines() if line.strip()]
+
+    server = start_stub_server(delay=args.delay)
+    os.environ.update(ANTHROPIC_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}", ANTHROPIC_API_KEY='stub')
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import llm_utils
+    from sql_app.routes.intent_utils import IntentVocabulary
+
+    start = time.perf_counter()
+    vocabulary = IntentVocabulary(HIERARCHY)
+    build = time.perf_counter() - start
+    cache_prefix = llm_utils._filter_spec_static_prompt(llm_utils._format_genre_hierarchy(HIERARCHY))
+
+    def llm_spec(prompt):
+        # What generate_playlist_filter_spec sends, minus the catalog lookup
+        return llm_utils.test_llm_claude_json(f'User request: "{prompt}"\n\nJSON:', cache_prefix=cache_prefix)
+
+    llm_spec('warm up')  # client construction and connection setup are not per-prompt costs
+    local_times, llm_times, pipeline_times = [], [], []
+    answered = 0
+    for prompt in prompts:
+        start = time.perf_counter()
+        spec = vocabulary.parse(prompt)
+        local = time.perf_counter() - start
+        local_times.append(local)
+
+        start = time.perf_counter()
+        llm_spec(prompt)
+        llm = time.perf_counter() - start
+        llm_times.append(llm)
+
+        if spec is not None:
+            answered += 1
+            pipeline_times.append(local)
+        else:
+            pipeline_times.append(local + llm)
+        if args.show:
+            print(f"{'local' if spec else 'LLM  '}  {prompt!r:55} {spec or ''}")
+
+    print(f"{len(prompts)} prompts, vocabulary of {len(vocabulary.phrases)} phrases built in {build * 1000:.1f} ms")
+    print(f"answered locally: {answered}/{len(prompts)} ({answered / len(prompts):.0%})")
+    print(f"local parse:  {statistics.mean(local_times) * 1e6:8.0f} us mean")
+    print(f"always LLM:   {statistics.mean(llm_times) * 1000:8.1f} ms mean per prompt")
+    print(f"fast path:    {statistics.mean(pipeline_times) * 1000:8.1f} ms mean per prompt "
+          f"({statistics.mean(llm_times) / statistics.mean(pipeline_times):.1f}x)")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare a new anthropic client per call (the previous behaviour) with the pooled LLM gateway,
+against the local stub server, with the per-backend concurrency limit set to the thread count.
+
+    cd fastapi && python benchmarks/llm_gateway.py --calls 200 --threads 8 --delay 0.05
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from llm_stub_server import StubHandler, start_stub_server
+
+def run(func, calls, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: func(), range(calls)))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.05)
+    args = parser.parse_args()
+
+    # No per-token delay: this measures connection set-up, not generation
+    server = start_stub_server(delay=args.delay, token_delay=0)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update(ANTHROPIC_BASE_URL=base_url, ANTHROPIC_API_KEY='stub', LLM_ENDPOINT=base_url)
+    os.environ.setdefault('ANTHROPIC_MAX_CONCURRENCY', str(args.threads))
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import anthropic
+    from sql_app.routes import llm_client_utils
+
+    prompt = 'Make me a chill rock playlist'
+
+    def client_per_call():
+        client = anthropic.Anthropic(api_key='stub', base_url=base_url)
+        client.messages.create(model='claude-haiku-4-5', max_tokens=1024, messages=[{'role': 'user', 'content': prompt}])
+        client.close()
+
+    connections = StubHandler.connections
+    fresh = run(client_per_call, args.calls, args.threads)
+    fresh_connections = StubHandler.connections - connections
+
+    connections = StubHandler.connections
+    pooled = run(lambda: llm_client_utils.complete(prompt), args.calls, args.threads)
+    pooled_connections = StubHandler.connections - connections
+
+    print(f"{args.calls} calls on {args.threads} threads, stub delay {args.delay * 1000:.0f} ms")
+    print(f"client per call: {fresh * 1000:.0f} ms total, {fresh_connections} connections opened")
+    print(f"pooled client:   {pooled * 1000:.0f} ms total, {pooled_connections} connections opened ({fresh / pooled:.1f}x)")
+    print(llm_client_utils.get_llm_stats()['anthropic'])
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compare waiting for the full completion (then regex-searching for the JSON) with streaming it
+through the gateway and hanging up when the top-level object closes, against the local stub
+server. The stub follows its JSON with a paragraph of prose, like a chatty model.
+
+    cd fastapi && python benchmarks/llm_streaming.py --calls 20 --token-delay 0.005
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+from llm_stub_server import StubHandler, start_stub_server
+
+def measure(func, calls):
+    tokens = StubHandler.tokens_sent
+    start = time.perf_counter()
+    for _ in range(calls):
+        spec = func()
+        assert spec.get('genres') == ['Rock'], spec
+    elapsed = time.perf_counter() - start
+    # Give the stub a moment to notice hung-up connections before reading its counter
+    time.sleep(0.2)
+    return elapsed, StubHandler.tokens_sent - tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    args = parser.parse_args()
+
+    server = start_stub_server(token_delay=args.token_delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update(ANTHROPIC_BASE_URL=base_url, ANTHROPIC_API_KEY='stub', LLM_ENDPOINT=base_url)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import llm_client_utils
+
+    prompt = 'Make me a chill rock playlist'
+
+    print(f"{args.calls} calls, {args.token_delay * 1000:.0f} ms per token")
+    for backend in ('anthropic', 'ollama'):
+        # Previous behaviour: wait for everything, then regex out the object
+        full, full_tokens = measure(lambda: json.loads(re.search(r'\{.*\}', llm_client_utils.complete(prompt, backend=backend).text, re.DOTALL).group(), strict=False), args.calls)
+        streamed, streamed_tokens = measure(lambda: llm_client_utils.stream_json(prompt, backend=backend).parsed(), args.calls)
+        print(f"{backend:9}  full completion: {full / args.calls * 1000:.0f} ms/call, {full_tokens / args.calls:.0f} tokens/call")
+        print(f"{'':9}  streamed:        {streamed / args.calls * 1000:.0f} ms/call, {streamed_tokens / args.calls:.0f} tokens/call "
+              f"({1 - streamed_tokens / full_tokens:.0%} fewer tokens)")
+    stats = llm_client_utils.get_llm_stats()
+    print({backend: (values['streams'], values['streams_stopped_early'], round(values['estimated_output_tokens'] / max(values['streams_stopped_early'], 1)))
+           for backend, values in stats.items()}, '(streams, stopped early, output tokens counted per early stop)')
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""
+Local stand-in for both LLM backends: the Anthropic Messages API (POST /v1/messages) and
+Ollama (POST /api/generate). Replies with a fixed filter-spec JSON (an audio-descriptor JSON for
+descriptor prompts) after an optional delay and reports whitespace-split token counts, so the
+gateway's pooling, limits and metrics can be exercised without network access or API keys. Streaming requests ("stream": true) get the
+reply one token at a time followed by a paragraph of trailing prose, like a chatty model, and
+tokens_sent counts how many were generated before the client hung up.
+
+    cd fastapi && python benchmarks/llm_stub_server.py --port 8998 --delay 0.2
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8998 ANTHROPIC_API_KEY=stub LLM_ENDPOINT=http://127.0.0.1:8998 uvicorn sql_app.main:app
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = json.dumps({'genres': ['Rock'], 'moods': ['Chill'], 'explanation': 'Stub response', 'playlist_name': 'Stub Playlist'}, indent=2)
+DESCRIPTOR_REPLY = json.dumps({'audio_descriptors': ['Chill', 'Wistful'], 'explanation': 'Stub response'}, indent=2)
+TRAILER = ("\n\nThis spec keeps the request broad: rock covers most of the catalog and the chill mood narrows it "
+           "to relaxed albums without adding audio-feature constraints that could empty the result. ") * 3
+
+def tokenize(text: str) -> list:
+    """
+    Split text into whitespace-preserving pieces so streamed chunks join back into the exact text
+    """
+    return re.findall(r'\s*\S+|\s+$', text)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    token_delay = 0.005
+    reply = DEFAULT_REPLY
+    requests_served = 0
+    tokens_sent = 0
+    cached_prefixes = set()
+    connections = 0
+    # Streams still being written, including ones whose client has hung up but not yet been noticed
+    open_streams = 0
+    # Statuses to answer the next requests with instead of a reply (e.g. [529, 429]), for retry tests
+    fail_statuses = []
+    _lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler._lock:
+            StubHandler.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except BrokenPipeError:
+            pass  # the client gave up (deadline tests)
+
+    def _stream(self, events):
+        """
+        Write each event as soon as it is produced; stops quietly when the client disconnects
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream' if self.path.startswith('/v1/messages') else 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        with StubHandler._lock:
+            StubHandler.open_streams += 1
+        try:
+            for event in events:
+                self.wfile.write(event.encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with StubHandler._lock:
+                StubHandler.open_streams -= 1
+
+    def _tokens(self, offset: int = 0, limit: int = None):
+        tokens = tokenize(self.reply + TRAILER)[offset:]
+        for token in tokens[:limit]:
+            time.sleep(self.token_delay)
+            with StubHandler._lock:
+                StubHandler.tokens_sent += 1
+            yield token
+
+    def _generate(self) -> str:
+        return ''.join(self._tokens())
+
+    def _anthropic_usage(self, request: dict, prompt: str) -> dict:
+        """
+        Mimics prompt caching: a system block marked with cache_control is written to the cache on
+        first sight and read from it afterwards; neither counts towards input_tokens
+        """
+        usage = {'input_tokens': len(prompt.split()), 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        system = request.get('system') or []
+        if isinstance(system, str):
+            system = [{'type': 'text', 'text': system}]
+        for block in system:
+            words = len(block.get('text', '').split())
+            if not block.get('cache_control'):
+                usage['input_tokens'] += words
+                continue
+            with StubHandler._lock:
+                cached = block['text'] in StubHandler.cached_prefixes
+                StubHandler.cached_prefixes.add(block['text'])
+            usage['cache_read_input_tokens' if cached else 'cache_creation_input_tokens'] += words
+        return usage
+
+    def _anthropic_events(self, request: dict, usage: dict):
+        def sse(event_type, data):
+            data['type'] = event_type
+            return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+        yield sse('message_start', {'message': {'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'model': request.get('model', 'stub'),
+                                                'content': [], 'stop_reason': None, 'stop_sequence': None,
+                                                'usage': dict(usage, output_tokens=1)}})
+        yield sse('content_block_start', {'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        count = 0
+        for token in self._tokens():
+            count += 1
+            yield sse('content_block_delta', {'index': 0, 'delta': {'type': 'text_delta', 'text': token}})
+        yield sse('content_block_stop', {'index': 0})
+        yield sse('message_delta', {'delta': {'stop_reason': 'end_turn', 'stop_sequence': None}, 'usage': {'output_tokens': count}})
+        yield sse('message_stop', {})
+
+    def _ollama_events(self, request: dict, input_tokens: int):
+        """
+        Honours num_predict, stop and context like Ollama. The final chunk's context is an opaque
+        token list, here one entry per prompt token seen followed by the number of reply tokens
+        generated, so passing it back continues
+        the same generation; prompt_eval_count only covers the new prompt, as with a warm KV cache.
+        """
+        options = request.get('options', {})
+        context = request.get('context') or [0]
+        offset = context[-1]
+        stops = options.get('stop') or []
+        generated = ''
+        count = 0
+        done_reason = 'length'
+        for token in self._tokens(offset, options.get('num_predict')):
+            count += 1
+            hit = next((stop for stop in stops if stop in generated + token), None)
+            if hit:
+                # Ollama drops the stop sequence itself from the output
+                piece = (generated + token).split(hit)[0][len(generated):]
+                if piece:
+                    yield json.dumps({'model': request.get('model', 'stub'), 'response': piece, 'done': False}) + '\n'
+                done_reason = 'stop'
+                break
+            generated += token
+            yield json.dumps({'model': request.get('model', 'stub'), 'response': token, 'done': False}) + '\n'
+        else:
+            if offset + count >= len(tokenize(self.reply + TRAILER)):
+                done_reason = 'stop'
+        yield json.dumps({'model': request.get('model', 'stub'), 'response': '', 'done': True, 'done_reason': done_reason,
+                          'context': context[:-1] + [0] * input_tokens + [offset + count], 'prompt_eval_count': input_tokens, 'eval_count': count}) + '\n'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        with StubHandler._lock:
+            StubHandler.requests_served += 1
+            status = StubHandler.fail_statuses.pop(0) if StubHandler.fail_statuses else None
+        if status:
+            return self._send(status, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Stub failure'}})
+        time.sleep(self.delay)
+        prompt = request.get('prompt') or ' '.join(str(message.get('content', '')) for message in request.get('messages', []))
+        if 'audio descriptors' in prompt:
+            self.reply = DESCRIPTOR_REPLY
+        if self.path.startswith('/v1/messages'):
+            usage = self._anthropic_usage(request, prompt)
+            if request.get('stream'):
+                return self._stream(self._anthropic_events(request, usage))
+            text = self._generate()
+            return self._send(200, {
+                'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'model': request.get('model', 'stub'),
+                'content': [{'type': 'text', 'text': text}], 'stop_reason': 'end_turn', 'stop_sequence': None,
+                'usage': dict(usage, output_tokens=len(tokenize(text))),
+            })
+        if self.path.startswith('/api/generate'):
+            if request.get('stream'):
+                return self._stream(self._ollama_events(request, len(request.get('prompt', '').split())))
+            input_tokens = len(request.get('prompt', '').split())
+            context = request.get('context') or [0]
+            text = self._generate()
+            return self._send(200, {
+                'model': request.get('model', 'stub'), 'response': text, 'done': True,
+                'context': context[:-1] + [0] * input_tokens + [len(tokenize(text))],
+                'prompt_eval_count': input_tokens, 'eval_count': len(tokenize(text)),
+            })
+        self._send(404, {'error': 'not found'})
+
+def start_stub_server(port: int = 0, delay: float = 0.0, token_delay: float = 0.005) -> ThreadingHTTPServer:
+    """
+    Start the stub on a background thread (port 0 picks a free port) and return the server
+    """
+    StubHandler.delay = delay
+    StubHandler.token_delay = token_delay
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8998)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each reply')
+    parser.add_argument('--token-delay', type=float, default=0.005, help='seconds between streamed tokens')
+    args = parser.parse_args()
+    server = start_stub_server(args.port, args.delay, args.token_delay)
+    print(f"LLM stub listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
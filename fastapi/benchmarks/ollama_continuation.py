@@ -0,0 +1,62 @@
+"""
+Tokens generated per successful spec when an Ollama answer is truncated: restarting with a
+bigger num_predict (the previous behaviour) versus continuing the same generation from its
+returned context with a stop sequence on the closing brace. Runs test_llm against the local
+stub server, which honours num_predict, stop and context.
+
+    cd fastapi && python benchmarks/ollama_continuation.py --calls 10 --budget 8
+"""
+import argparse
+import builtins
+import os
+import sys
+import time
+from pathlib import Path
+
+from llm_stub_server import StubHandler, start_stub_server
+
+def measure(func, calls):
+    tokens = StubHandler.tokens_sent
+    successes = 0
+    start = time.perf_counter()
+    for _ in range(calls):
+        if func():
+            successes += 1
+    elapsed = time.perf_counter() - start
+    # Let the stub notice hung-up connections before reading its counter
+    time.sleep(0.2)
+    return successes, elapsed, StubHandler.tokens_sent - tokens
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=10)
+    parser.add_argument('--budget', type=int, default=8, help='initial num_predict; smaller than the answer so it truncates')
+    parser.add_argument('--token-delay', type=float, default=0.002)
+    args = parser.parse_args()
+
+    server = start_stub_server(token_delay=args.token_delay)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update(LLM_ENDPOINT=base_url)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import llm_utils
+    from sql_app.routes.json_stream_utils import extract_json_object
+
+    def spec(continuation):
+        print_ = builtins.print
+        builtins.print = lambda *a, **k: None
+        try:
+            text = llm_utils.test_llm('Make me a chill rock playlist', initial_max_tokens=args.budget, continuation=continuation)
+        finally:
+            builtins.print = print_
+        return extract_json_object(text) is not None
+
+    print(f"{args.calls} calls, initial budget {args.budget} tokens")
+    for name, continuation in (('restart', False), ('continuation', True)):
+        successes, elapsed, tokens = measure(lambda: spec(continuation), args.calls)
+        per_spec = tokens / successes if successes else float('nan')
+        print(f"{name:12}  {successes}/{args.calls} specs, {per_spec:.1f} tokens generated per spec, {elapsed / args.calls * 1000:.0f} ms/call")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compare the previous step-by-step DataFrame filtering of LLM WHERE conditions with the compiled
+mask in sql_app.routes.predicate_utils, on a synthetic catalog shaped like llm_utils.get_all_tracks.
+
+The previous behaviour is reproduced inline (re-parse every condition, rebuild the column map,
+filter a copy per condition) without its prints, so the timing is the filtering alone. Both must
+select the same rows for every condition set.
+
+    cd fastapi && python benchmarks/predicate_engine.py --tracks 200000 --queries 200
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sql_app.routes.predicate_utils import ColumnarTrackStore, parse_condition_string  # noqa: E402
+
+GENRES = {f'Genre{i}': [f'Genre{i} Sub{j}' for j in range(12)] for i in range(15)}
+
+def catalog(n):
+    genres = np.random.choice(list(GENRES), n)
+    return pd.DataFrame({
+        'track_id': [f't{i}' for i in range(n)],
+        'genre': genres,
+        'subgenre': [random.choice(GENRES[genre]) for genre in genres],
+        'year': np.random.randint(1960, 2025, n),
+        'energy': np.random.rand(n),
+        'valence': np.random.rand(n),
+        'danceability': np.random.rand(n),
+        'instrumentalness': np.random.rand(n),
+        'tempo_mapped': np.random.uniform(60, 180, n),
+        'popularity': np.random.randint(0, 100, n),
+    })
+
+def random_conditions():
+    genre = random.choice(list(GENRES))
+    low = round(random.uniform(0, 0.6), 1)
+    conditions = [f"Energy BETWEEN {low} AND {low + 0.4:.1f}",
+                  f"Valence {random.choice(['>', '<', '>=', '<='])} {random.uniform(0.2, 0.8):.2f}",
+                  f"Genre IN ('{genre}', '{random.choice(list(GENRES))}')"]
+    if random.random() < 0.5:
+        conditions.append(f"Subgenre LIKE 'Sub{random.randint(0, 11)}'")
+    if random.random() < 0.5:
+        conditions.append(f"Year BETWEEN {random.randint(1960, 2000)} AND {random.randint(2000, 2024)}")
+    if random.random() < 0.3:
+        conditions.append(f"Danceability > {random.uniform(0.3, 0.7):.1f}")
+    return conditions
+
+def legacy_filter(df, where_conditions):
+    df = df.copy()
+    for condition in where_conditions:
+        parse_condition_string.cache_clear()
+        operator, column, value = parse_condition_string(condition)
+        column_mapping = {}
+        for col in df.columns:
+            if col not in column_mapping:
+                column_mapping[col.lower()] = col
+        df_column = column_mapping.get(column.lower())
+        if operator == 'IN':
+            df = df[df[df_column].isin(value)]
+        elif operator == 'BETWEEN':
+            df = df[(df[df_column] >= value[0]) & (df[df_column] <= value[1])]
+        elif operator == '>':
+            df = df[df[df_column] > value]
+        elif operator == '<':
+            df = df[df[df_column] < value]
+        elif operator == '>=':
+            df = df[df[df_column] >= value]
+        elif operator == '<=':
+            df = df[df[df_column] <= value]
+        elif operator == 'LIKE':
+            df = df[df[df_column].str.contains(value, case=False, na=False)]
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    random.seed(5)
+    np.random.seed(5)
+
+    df = catalog(args.tracks)
+    queries = [random_conditions() for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    legacy = [legacy_filter(df, conditions).index for conditions in queries]
+    legacy_elapsed = time.perf_counter() - start
+
+    parse_condition_string.cache_clear()
+    start = time.perf_counter()
+    # A store per query, as query_songs_with_features builds one per call
+    compiled = [df.index[ColumnarTrackStore(df).mask(conditions)] for conditions in queries]
+    compiled_elapsed = time.perf_counter() - start
+
+    assert all(a.equals(b) for a, b in zip(legacy, compiled)), "compiled mask and legacy filtering disagree"
+    info = parse_condition_string.cache_info()
+    print(f"{args.tracks} tracks, {args.queries} condition sets (mean {np.mean([len(i) for i in compiled]):.0f} matches)")
+    print(f"step-by-step DataFrame: {legacy_elapsed / args.queries * 1000:7.2f} ms/query")
+    print(f"compiled mask:          {compiled_elapsed / args.queries * 1000:7.2f} ms/query ({legacy_elapsed / compiled_elapsed:.1f}x)")
+    print(f"parse cache: {info.hits} hits, {info.misses} misses")
+
+if __name__ == '__main__':
+    main()
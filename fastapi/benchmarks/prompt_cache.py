@@ -0,0 +1,49 @@
+"""
+Input tokens processed per Anthropic playlist-spec call with the static instructions (moods,
+genre hierarchy, levels, rules) sent as a cached system block versus inlined in every prompt,
+against the local stub server, which mimics Anthropic prompt caching.
+
+    cd fastapi && python benchmarks/prompt_cache.py --calls 20
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from llm_stub_server import start_stub_server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    args = parser.parse_args()
+
+    server = start_stub_server(token_delay=0)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update(ANTHROPIC_BASE_URL=base_url, ANTHROPIC_API_KEY='stub', LLM_ENDPOINT=base_url)
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from sql_app.routes import llm_client_utils, llm_utils
+
+    # A catalog-sized hierarchy: ~20 genres with ~15 subgenres each
+    hierarchy = {f"Genre {g}": [f"Subgenre {g}-{s}" for s in range(15)] for g in range(20)}
+    static = llm_utils._filter_spec_static_prompt(llm_utils._format_genre_hierarchy(hierarchy))
+    requests = [f'User request: "playlist idea number {i}"\n\nJSON:' for i in range(args.calls)]
+
+    print(f"{args.calls} calls, static prefix of {len(static.split())} words")
+    for name, use_cache in (('inlined', False), ('cached prefix', True)):
+        before = llm_client_utils.get_llm_stats()['anthropic']
+        for prompt in requests:
+            if use_cache:
+                llm_client_utils.stream_json(prompt, backend='anthropic', cache_prefix=static)
+            else:
+                llm_client_utils.stream_json(static + prompt, backend='anthropic')
+        after = llm_client_utils.get_llm_stats()['anthropic']
+        uncached = after['input_tokens'] - before['input_tokens']
+        cached = after['cached_input_tokens'] - before['cached_input_tokens']
+        written = after['cache_write_input_tokens'] - before['cache_write_input_tokens']
+        print(f"{name:13}  uncached {uncached / args.calls:7.1f}  cached {cached / args.calls:7.1f}  "
+              f"cache writes {written / args.calls:6.1f}  (input tokens per call)")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
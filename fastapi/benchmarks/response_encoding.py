@@ -0,0 +1,94 @@
+"""
+Compare response encoding cost and payload size for the largest endpoint shapes.
+
+For synthetic payloads shaped like /web/artists/, /web/get_relevant_albums/ and
+/web/get_similar_tracks/, measures the default FastAPI path (pydantic response_model
+validation + jsonable_encoder + json.dumps) against sql_app.routes.response_utils.encode_json,
+and reports raw, gzip and brotli sizes of the encoded body.
+
+    cd fastapi && python benchmarks/response_encoding.py --artists 20000 --albums 500 --tracks 200
+"""
+import argparse
+import gzip
+import json
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sql_app import schemas  # noqa: E402
+from sql_app.routes.response_utils import encode_json, orjson  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def _word(n=10):
+    return ''.join(random.choices(string.ascii_letters, k=n))
+
+def artists_payload(n):
+    return {'artists': {f"{_word(8)} {_word(6)}": str(random.randint(10**8, 10**9)) for _ in range(n)}}
+
+def albums_payload(n):
+    albums = {}
+    for i in range(n):
+        albums[str(i)] = {'album_key': i, 'album_id': str(random.randint(10**8, 10**9)), 'artist_id': str(random.randint(10**8, 10**9)),
+                          'album': _word(14), 'artist': _word(10), 'genre': _word(6), 'subgenre': _word(8),
+                          'year': random.randint(1955, 2026), 'weighted_rank': float(np.float64(random.random() * 100)),
+                          'image_url': f"https://is1-ssl.mzstatic.com/image/{_word(40)}.jpg",
+                          'moods': [_word(6) for _ in range(5)], 'publications': [_word(12) for _ in range(4)]}
+    return {'albums': albums}
+
+def tracks_payload(n):
+    features = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo']
+    tracks = []
+    for _ in range(n):
+        track = {'track_id': str(random.randint(10**8, 10**9)), 'artist_name': _word(10), 'track_name': _word(14), 'album_name': _word(12)}
+        track.update({feature: np.float64(random.random()) for feature in features})
+        track['distance'] = np.float64(random.random() * 10)
+        tracks.append(track)
+    return {'tracks': tracks}
+
+def baseline_encode(payload, model):
+    validated = model(**jsonable_encoder(payload))
+    return json.dumps(jsonable_encoder(validated)).encode('utf-8')
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func()
+        timings.append(time.perf_counter() - start)
+    return body, min(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--artists', type=int, default=20000)
+    parser.add_argument('--albums', type=int, default=500)
+    parser.add_argument('--tracks', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    random.seed(0)
+
+    cases = [('/web/artists/', artists_payload(args.artists), schemas.Artists),
+             ('/web/get_relevant_albums/', albums_payload(args.albums), schemas.Albums),
+             ('/web/get_similar_tracks/', tracks_payload(args.tracks), schemas.TracksList)]
+
+    print(f"fast encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'endpoint':<28} {'baseline ms':>11} {'fast ms':>8} {'raw KB':>8} {'gzip KB':>8} {'br KB':>8}")
+    for name, payload, model in cases:
+        baseline_body, baseline_ms = timed(lambda: baseline_encode(payload, model), args.repeat)
+        fast_body, fast_ms = timed(lambda: encode_json(payload), args.repeat)
+        gzip_kb = len(gzip.compress(fast_body, compresslevel=6)) / 1024
+        br_kb = len(brotli.compress(fast_body, quality=4)) / 1024 if brotli is not None else float('nan')
+        print(f"{name:<28} {baseline_ms:>11.1f} {fast_ms:>8.1f} {len(fast_body) / 1024:>8.1f} {gzip_kb:>8.1f} {br_kb:>8.1f}")
+        assert json.loads(baseline_body) == json.loads(fast_body), f"{name}: encoders disagree"
+
+if __name__ == '__main__':
+    main()
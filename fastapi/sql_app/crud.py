@@ -1,5 +1,7 @@
-from sqlalchemy import func, text, cast, String, Integer, exists
+from sqlalchemy import func, text, cast, String, Integer, exists, case, and_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import datetime
 
 from . import models, schemas
@@ -13,6 +15,14 @@ def get_unique_publications(db: Session):
 def get_unique_moods(db: Session):
     return db.query(models.AlbumDescriptors.mood).distinct().order_by(models.AlbumDescriptors.mood).all()
 
+def get_catalog_fingerprint(db: Session):
+    albums = db.query(func.count(models.FctAlbums.album_key), func.max(models.FctAlbums.album_key), func.sum(models.FctAlbums.weighted_rank)).one()
+    music_lists = db.query(func.count(models.RelevantAlbums.album_key), func.sum(models.RelevantAlbums.points)).one()
+    # Descriptors are written outside dbt (generate_descriptors), and tracks feed the facet index
+    descriptors = db.query(func.count(models.AlbumDescriptors.album_key), func.max(models.AlbumDescriptors.album_key)).one()
+    tracks = db.query(func.count(models.FctTracks.apple_music_track_id), func.max(models.FctTracks.apple_music_track_id)).one()
+    return tuple(albums) + tuple(music_lists) + tuple(descriptors) + tuple(tracks)
+
 def get_unique_artists_albums(db: Session):
     return db.query(models.TrackFeatures.artist, models.TrackFeatures.artist_id, models.TrackFeatures.album_name, models.TrackFeatures.album_id).distinct().all()
 
@@ -191,6 +201,9 @@ def get_album_accolades(db: Session, album_id: str):
 def get_album_accolades_multiple_albums(db: Session, album_ids: list):
     return db.query(models.RelevantAlbums.album_key, models.RelevantAlbums.rank, models.RelevantAlbums.points, models.RelevantAlbums.publication, models.RelevantAlbums.list).filter(models.RelevantAlbums.album_key.in_(album_ids)).all()
 
+def get_all_album_accolades(db: Session):
+    return db.query(models.RelevantAlbums.album_key, models.RelevantAlbums.rank, models.RelevantAlbums.points, models.RelevantAlbums.publication, models.RelevantAlbums.list).all()
+
 def get_similar_artists_by_publication(db: Session):
     return db.query(models.ArtistPublications).all()
 
@@ -372,6 +385,30 @@ def get_album_info_new_albums_table(db: Session, album_key: str):
 def get_mean_standard_deviation_of_audio_features(db: Session):
     return db.query(func.avg(models.FctAlbums.spotify_danceability_clean), func.stddev(models.FctAlbums.spotify_danceability_clean), func.avg(models.FctAlbums.spotify_energy_clean), func.stddev(models.FctAlbums.spotify_energy_clean), func.avg(models.FctAlbums.spotify_instrumentalness_clean), func.stddev(models.FctAlbums.spotify_instrumentalness_clean), func.avg(models.FctAlbums.spotify_valence_clean), func.stddev(models.FctAlbums.spotify_valence_clean), func.avg(models.FctAlbums.spotify_tempo_clean), func.stddev(models.FctAlbums.spotify_tempo_clean)).filter(models.FctAlbums.spotify_danceability_clean.isnot(None), models.FctAlbums.spotify_energy_clean.isnot(None), models.FctAlbums.spotify_instrumentalness_clean.isnot(None), models.FctAlbums.spotify_valence_clean.isnot(None), models.FctAlbums.spotify_tempo_clean.isnot(None)).all()
 
+def get_albums_missing_descriptors(db: Session, limit: int = None, after_album_key: int = None):
+    """
+    Albums with no fct_album_descriptors rows, ordered by album_key; pass limit/after_album_key to page through them
+    """
+    has_descriptors = exists().where(models.AlbumDescriptors.album_key == models.FctAlbums.album_key)
+    query = db.query(models.FctAlbums).filter(~has_descriptors)
+    if after_album_key is not None:
+        query = query.filter(models.FctAlbums.album_key > after_album_key)
+    query = query.order_by(models.FctAlbums.album_key)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def bulk_insert_album_descriptors(db: Session, rows: list):
+    """
+    Insert (album_key, mood, explanation) rows in one multi-row INSERT, skipping rows that already exist
+    """
+    if not rows:
+        return
+    stmt = pg_insert(models.AlbumDescriptors).values(rows)
+    stmt = stmt.on_conflict_do_nothing(index_elements=[models.AlbumDescriptors.album_key, models.AlbumDescriptors.mood])
+    db.execute(stmt)
+    db.commit()
+
 def get_all_tracks_new(db: Session, genres: list = []):
     print('Genres', genres)
     base_query = db.query(models.FctTracks).filter(models.FctTracks.apple_music_track_id.isnot(None))
@@ -424,6 +461,73 @@ def get_tracks_by_filter_spec(db: Session, filter_spec: dict, song_limit: int =
 
     return query.limit(song_limit).all()
 
+def _filter_spec_conditions(filter_spec: dict) -> list:
+    """
+    The WHERE clauses get_tracks_by_filter_spec applies, with the mood join expressed as an EXISTS so tracks are counted once
+    """
+    conditions = []
+    moods = filter_spec.get('moods', [])
+    if moods:
+        conditions.append(exists().where(
+            models.AlbumDescriptors.album_key == models.FctTracks.album_key,
+            models.AlbumDescriptors.mood.in_(moods),
+        ))
+    for key, column in [('genres', models.FctTracks.genre),
+                        ('subgenres', models.FctTracks.subgenre),
+                        ('energy_levels', models.FctTracks.energy_level),
+                        ('valence_levels', models.FctTracks.valence_level),
+                        ('danceability_levels', models.FctTracks.danceability_level),
+                        ('instrumentalness_levels', models.FctTracks.instrumentalness_level)]:
+        values = filter_spec.get(key, [])
+        if values:
+            conditions.append(column.in_(values))
+    if filter_spec.get('year_min') is not None:
+        conditions.append(models.FctTracks.year >= filter_spec['year_min'])
+    if filter_spec.get('year_max') is not None:
+        conditions.append(models.FctTracks.year <= filter_spec['year_max'])
+    return conditions
+
+def count_tracks_for_filter_specs(db: Session, filter_specs: list) -> list:
+    """
+    Count matching tracks for several filter specs in one scan, using a conditional SUM per spec
+    """
+    if not filter_specs:
+        return []
+    columns = []
+    for filter_spec in filter_specs:
+        conditions = _filter_spec_conditions(filter_spec)
+        columns.append(func.sum(case((and_(*conditions), 1), else_=0)) if conditions else func.count())
+    row = db.query(*columns).filter(models.FctTracks.apple_music_track_id.isnot(None)).one()
+    return [int(count or 0) for count in row]
+
+def get_facet_index_rows(db: Session):
+    """
+    The filterable columns of every playable track, in a stable order, for the in-memory facet index
+    """
+    return db.query(
+        models.FctTracks.apple_music_track_id,
+        models.FctTracks.album_key,
+        models.FctTracks.genre,
+        models.FctTracks.subgenre,
+        models.FctTracks.energy_level,
+        models.FctTracks.valence_level,
+        models.FctTracks.danceability_level,
+        models.FctTracks.instrumentalness_level,
+        models.FctTracks.year,
+    ).filter(models.FctTracks.apple_music_track_id.isnot(None)).order_by(models.FctTracks.apple_music_track_id).all()
+
+def get_album_mood_rows(db: Session):
+    return db.query(models.AlbumDescriptors.album_key, models.AlbumDescriptors.mood).distinct().all()
+
+def get_tracks_by_ids(db: Session, track_ids: list):
+    """
+    Tracks (with album moods loaded) for ids resolved elsewhere, e.g. by the facet index
+    """
+    if not track_ids:
+        return []
+    query = db.query(models.FctTracks).filter(models.FctTracks.apple_music_track_id.in_(track_ids))
+    return query.options(selectinload(models.FctTracks.album_info).selectinload(models.FctAlbums.moods)).all()
+
 def get_albums_from_search_string(db: Session, search_term: str, num_results: int):
     search_words = search_term.split(' ')
     ts_query = ' & '.join([f"{word}:*" for word in search_words])
@@ -436,20 +540,104 @@ def get_albums_from_search_string(db: Session, search_term: str, num_results: in
     """)
     return db.execute(query).fetchall()
 
+def create_user_session(db: Session, session_id: str, user_token: str, created_at: datetime.datetime, expires_at: datetime.datetime):
+    db.add(models.UserSession(session_id=session_id, user_token=user_token, created_at=created_at, expires_at=expires_at))
+    db.commit()
+
+def get_user_session(db: Session, session_id: str):
+    return db.query(models.UserSession).filter(
+        models.UserSession.session_id == session_id,
+        models.UserSession.expires_at > datetime.datetime.utcnow(),
+    ).first()
+
+def create_user_api_key(db: Session, api_key: str, session_id: str, created_at: datetime.datetime, expires_at: datetime.datetime):
+    db.add(models.UserApiKey(api_key=api_key, session_id=session_id, created_at=created_at, expires_at=expires_at))
+    db.commit()
+
+def get_user_api_key(db: Session, api_key: str):
+    return db.query(models.UserApiKey).filter(
+        models.UserApiKey.api_key == api_key,
+        models.UserApiKey.expires_at > datetime.datetime.utcnow(),
+    ).first()
+
+def get_all_user_sessions_api_keys(db: Session):
+    now = datetime.datetime.utcnow()
+    sessions = db.query(models.UserSession).filter(models.UserSession.expires_at > now).all()
+    api_keys = db.query(models.UserApiKey).filter(models.UserApiKey.expires_at > now).all()
+    return sessions, api_keys
+
+def delete_expired_sessions(db: Session):
+    """
+    Delete expired sessions and API keys; returns (sessions deleted, api keys deleted)
+    """
+    now = datetime.datetime.utcnow()
+    sessions_deleted = db.query(models.UserSession).filter(models.UserSession.expires_at <= now).delete(synchronize_session=False)
+    api_keys_deleted = db.query(models.UserApiKey).filter(models.UserApiKey.expires_at <= now).delete(synchronize_session=False)
+    db.commit()
+    return sessions_deleted, api_keys_deleted
+
+def try_acquire_job_lease(db: Session, job_name: str, holder: str, ttl_seconds: float) -> bool:
+    """
+    Take the named lease if nobody holds it or the current holder's lease has expired; returns whether holder now has it.
+
+    The lease row lives on the primary, so it is shared by every worker process and host.
+    """
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=ttl_seconds)
+    taken_over = db.query(models.JobLease).filter(
+        models.JobLease.job_name == job_name,
+        models.JobLease.expires_at <= now,
+    ).update({'holder': holder, 'expires_at': expires_at}, synchronize_session=False)
+    if not taken_over:
+        db.add(models.JobLease(job_name=job_name, holder=holder, expires_at=expires_at))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another worker inserted the row first
+        db.rollback()
+        return False
+    return True
+
+def renew_job_lease(db: Session, job_name: str, holder: str, ttl_seconds: float) -> bool:
+    """
+    Push out the expiry of a lease holder still has; returns False if it was lost (expired and taken over)
+    """
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl_seconds)
+    renewed = db.query(models.JobLease).filter(
+        models.JobLease.job_name == job_name,
+        models.JobLease.holder == holder,
+    ).update({'expires_at': expires_at}, synchronize_session=False)
+    db.commit()
+    return bool(renewed)
+
+def release_job_lease(db: Session, job_name: str, holder: str):
+    db.query(models.JobLease).filter(
+        models.JobLease.job_name == job_name,
+        models.JobLease.holder == holder,
+    ).delete(synchronize_session=False)
+    db.commit()
+
 def upsert_user_token(db: Session, api_key: str, music_user_token: str):
+    bulk_upsert_user_tokens(db, tokens={api_key: music_user_token})
+
+def bulk_upsert_user_tokens(db: Session, tokens: dict):
+    """
+    Upsert {api_key: music_user_token} pairs in a single INSERT ... ON CONFLICT DO UPDATE
+    """
+    if not tokens:
+        return
     now = datetime.datetime.utcnow()
-    existing = db.query(models.UserToken).filter(models.UserToken.api_key == api_key).first()
-    if existing:
-        existing.music_user_token = music_user_token
-        existing.last_seen_at = now
-        existing.updated_at = now
-    else:
-        db.add(models.UserToken(
-            api_key=api_key,
-            music_user_token=music_user_token,
-            last_seen_at=now,
-            updated_at=now,
-        ))
+    rows = [{'api_key': api_key, 'music_user_token': music_user_token, 'last_seen_at': now, 'updated_at': now} for api_key, music_user_token in tokens.items()]
+    stmt = pg_insert(models.UserToken).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UserToken.api_key],
+        set_={
+            'music_user_token': stmt.excluded.music_user_token,
+            'last_seen_at': stmt.excluded.last_seen_at,
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.execute(stmt)
     db.commit()
 
 def get_fresh_user_listening_preferences(db: Session, api_key: str, max_age_hours: int = 24):
@@ -461,42 +649,77 @@ def get_fresh_user_listening_preferences(db: Session, api_key: str, max_age_hour
     return rows
 
 def upsert_user_listening_preferences(db: Session, api_key: str, results: list):
+    bulk_upsert_user_listening_preferences(db, results_by_user={api_key: results})
+
+def bulk_upsert_user_listening_preferences(db: Session, results_by_user: dict):
+    """
+    Upsert listening preferences for one or many users in a single multi-row INSERT ... ON CONFLICT DO UPDATE
+
+    results_by_user maps api_key -> list of topic results
+    """
     now = datetime.datetime.utcnow()
-    for item in results:
-        existing = db.query(models.UserListeningPreference).filter(
-            models.UserListeningPreference.api_key == api_key,
-            models.UserListeningPreference.topic == item['topic'],
-        ).first()
-        if existing:
-            existing.type = item['type']
-            existing.count = item['count']
-            existing.rate = item['rate']
-            existing.album_keys = item['album_keys']
-            existing.computed_at = now
-        else:
-            db.add(models.UserListeningPreference(
-                api_key=api_key,
-                topic=item['topic'],
-                type=item['type'],
-                count=item['count'],
-                rate=item['rate'],
-                album_keys=item['album_keys'],
-                computed_at=now,
-            ))
+    rows = {}
+    for api_key, results in results_by_user.items():
+        for item in results:
+            # Postgres rejects a statement that touches the same row twice, so the last value per key wins
+            rows[(api_key, item['topic'])] = {
+                'api_key': api_key,
+                'topic': item['topic'],
+                'type': item['type'],
+                'count': item['count'],
+                'rate': item['rate'],
+                'album_keys': item['album_keys'],
+                'computed_at': now,
+            }
+    if not rows:
+        return
+    stmt = pg_insert(models.UserListeningPreference).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.UserListeningPreference.api_key, models.UserListeningPreference.topic],
+        set_={
+            'type': stmt.excluded.type,
+            'count': stmt.excluded.count,
+            'rate': stmt.excluded.rate,
+            'album_keys': stmt.excluded.album_keys,
+            'computed_at': stmt.excluded.computed_at,
+        }
+    )
+    db.execute(stmt)
     db.commit()
 
-def get_active_stale_users(db: Session, max_age_hours: int = 24, active_days: int = 7):
+def get_active_stale_users(db: Session, max_age_hours: int = 24, active_days: int = 7, limit: int = None, after_api_key: str = None):
+    """
+    Return active users with no listening preferences computed since the stale cutoff.
+
+    Uses a single NOT EXISTS anti-join ordered by api_key; pass limit/after_api_key to page through results.
+    """
     active_cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=active_days)
     stale_cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=max_age_hours)
-    active_users = db.query(models.UserToken).filter(
-        models.UserToken.last_seen_at > active_cutoff
-    ).all()
-    stale_users = []
-    for user in active_users:
-        latest_pref = db.query(models.UserListeningPreference).filter(
-            models.UserListeningPreference.api_key == user.api_key,
-            models.UserListeningPreference.computed_at > stale_cutoff,
-        ).first()
-        if not latest_pref:
-            stale_users.append(user)
-    return stale_users
+    fresh_preference = exists().where(
+        models.UserListeningPreference.api_key == models.UserToken.api_key,
+        models.UserListeningPreference.computed_at > stale_cutoff,
+    )
+    query = db.query(models.UserToken).filter(
+        models.UserToken.last_seen_at > active_cutoff,
+        ~fresh_preference,
+    )
+    if after_api_key is not None:
+        query = query.filter(models.UserToken.api_key > after_api_key)
+    query = query.order_by(models.UserToken.api_key)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def iter_active_stale_user_batches(db: Session, batch_size: int = 100, max_age_hours: int = 24, active_days: int = 7):
+    """
+    Yield pages of stale users using keyset pagination on api_key, so the whole set is never held in memory
+    """
+    after_api_key = None
+    while True:
+        batch = get_active_stale_users(db, max_age_hours=max_age_hours, active_days=active_days, limit=batch_size, after_api_key=after_api_key)
+        if not batch:
+            return
+        after_api_key = batch[-1].api_key
+        yield batch
+        if len(batch) < batch_size:
+            return
@@ -1,15 +1,87 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import UpdateBase
 # from dotenv import load_dotenv
+import logging
 import os
+import threading
+import time
 
 # load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SQLALCHEMY_DATABASE_URL = os.getenv('DATABASE_URL')
+# Optional read replica for catalog (dbt schema) reads; unset to send everything to the primary
+READ_REPLICA_DATABASE_URL = os.getenv('READ_REPLICA_DATABASE_URL')
+REPLICA_HEALTH_CHECK_SECONDS = int(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', 30))
+# Tables in these schemas are read-after-write user data and always go to the primary
+PRIMARY_ONLY_SCHEMAS = {'user_data'}
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+replica_engine = create_engine(READ_REPLICA_DATABASE_URL, pool_pre_ping=True) if READ_REPLICA_DATABASE_URL else None
+
+_replica_status = {'available': replica_engine is not None, 'checked_at': 0.0}
+_replica_status_lock = threading.Lock()
+
+def replica_available() -> bool:
+    """
+    Return whether the read replica is reachable, re-checking at most every REPLICA_HEALTH_CHECK_SECONDS
+    """
+    if replica_engine is None:
+        return False
+    if time.monotonic() - _replica_status['checked_at'] < REPLICA_HEALTH_CHECK_SECONDS:
+        return _replica_status['available']
+    with _replica_status_lock:
+        if time.monotonic() - _replica_status['checked_at'] < REPLICA_HEALTH_CHECK_SECONDS:
+            return _replica_status['available']
+        try:
+            with replica_engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            available = True
+        except Exception as e:
+            logger.warning(f"Read replica unavailable, falling back to primary: {e}")
+            available = False
+        _replica_status['available'] = available
+        _replica_status['checked_at'] = time.monotonic()
+    return available
+
+def mark_replica_unavailable(error: Exception):
+    """
+    Record a failed replica connection so reads go to the primary until the next health check
+    """
+    logger.warning(f"Read replica connection failed, falling back to primary: {error}")
+    with _replica_status_lock:
+        _replica_status['available'] = False
+        _replica_status['checked_at'] = time.monotonic()
+
+class RoutingSession(Session):
+    """
+    Session that sends read-only catalog queries to the read replica and everything else to the primary.
+
+    Writes (flushes and INSERT/UPDATE/DELETE statements) and any query against a user_data table always
+    use the primary, as does every query when the replica is not configured or not reachable. The replica
+    connection is checked out here, so a replica that went down since the last health check sends this
+    query to the primary instead of failing it.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase):
+            return engine
+        if mapper is not None and mapper.local_table.schema in PRIMARY_ONLY_SCHEMAS:
+            return engine
+        if not replica_available():
+            return engine
+        try:
+            # Returns the session's existing replica connection, if it has one
+            self.connection(bind_arguments={'bind': replica_engine})
+        except OperationalError as e:
+            mark_replica_unavailable(e)
+            return engine
+        return replica_engine
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
 Base = declarative_base()
 
 # Dependency
@@ -0,0 +1,143 @@
+"""
+Generate audio descriptors (moods) for every album that has no fct_album_descriptors rows.
+
+Albums are classified by generate_audio_descriptors_using_features with bounded concurrency,
+against dataset baselines computed once per run. Pending albums are read a keyset page at a
+time and results are written in multi-row inserts, so an interrupted run resumes by finding
+the albums still missing descriptors. Albums the model could not classify are recorded in a
+JSON checkpoint and skipped unless --retry-failed.
+
+    python -m sql_app.generate_descriptors --concurrency 4 --batch-size 50
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8998 ANTHROPIC_API_KEY=stub python -m sql_app.generate_descriptors --limit 20
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import crud
+from .database import SessionLocal
+from .routes.catalog_utils import refresh_catalog_snapshot
+from .routes.descriptor_utils import clean_descriptors, get_album_features, load_audio_feature_baselines
+from .routes.llm_utils import generate_audio_descriptors_using_features
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.getenv('DESCRIPTOR_CHECKPOINT_PATH', '.descriptor_checkpoint.json')
+PAGE_SIZE = 500
+
+def load_checkpoint(path: str) -> dict:
+    """
+    Albums the model could not classify, with attempt counts. Finished albums need no record:
+    their descriptor rows keep them out of get_albums_missing_descriptors.
+    """
+    if not os.path.exists(path):
+        return {'failed': {}}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return {'failed': checkpoint.get('failed', {})}
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Write-then-rename so a crash mid-write never leaves a truncated checkpoint
+    checkpoint['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def _classify(album_key: int, album_features: dict, baselines: dict):
+    audio_descriptors, explanation = generate_audio_descriptors_using_features(album_features, baselines)
+    return album_key, clean_descriptors(audio_descriptors), explanation
+
+def pending_album_pages(db, checkpoint: dict, retry_failed: bool):
+    """
+    Pages of albums still lacking descriptors (keyset-paginated on album_key), minus previous failures unless retry_failed
+    """
+    skip = set() if retry_failed else {int(album_key) for album_key in checkpoint['failed']}
+    after_album_key = None
+    while True:
+        page = crud.get_albums_missing_descriptors(db, limit=PAGE_SIZE, after_album_key=after_album_key)
+        if not page:
+            return
+        after_album_key = page[-1].album_key
+        albums = [album for album in page if album.album_key not in skip]
+        if albums:
+            yield albums
+
+def run(concurrency: int = 4, batch_size: int = 50, checkpoint_path: str = DEFAULT_CHECKPOINT_PATH, limit: int = None, retry_failed: bool = False) -> dict:
+    """
+    Classify pending albums one page at a time, so the first inserts land without loading the whole backlog.
+
+    When rows were written the catalog snapshot is refreshed, since its version covers descriptors; running
+    servers pick the new version up on their next scheduled refresh or POST /web/refresh_catalog/.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    stats = {'albums': 0, 'classified': 0, 'failed': 0, 'rows_written': 0}
+    db = SessionLocal()
+    try:
+        baselines = load_audio_feature_baselines(db)
+        if baselines is None:
+            raise RuntimeError("No audio features found to compute baselines from")
+        logger.info(f"Classifying albums without descriptors (concurrency {concurrency}, batch size {batch_size})")
+
+        pending_rows = []
+        pending_keys = []
+
+        def flush():
+            if not pending_keys:
+                return
+            crud.bulk_insert_album_descriptors(db, rows=pending_rows)
+            stats['rows_written'] += len(pending_rows)
+            # Written albums drop out of the pending query; only forget their failures once the rows are committed
+            for album_key in pending_keys:
+                checkpoint['failed'].pop(str(album_key), None)
+            save_checkpoint(checkpoint_path, checkpoint)
+            pending_rows.clear()
+            pending_keys.clear()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for albums in pending_album_pages(db, checkpoint, retry_failed):
+                if limit:
+                    albums = albums[:limit - stats['albums']]
+                stats['albums'] += len(albums)
+                futures = {executor.submit(_classify, album.album_key, get_album_features(album), baselines): album.album_key for album in albums}
+                for future in as_completed(futures):
+                    album_key = futures[future]
+                    try:
+                        _, descriptors, explanation = future.result()
+                    except Exception as e:
+                        descriptors, explanation = [], None
+                        logger.warning(f"Album {album_key} failed: {e}")
+                    if not descriptors:
+                        stats['failed'] += 1
+                        checkpoint['failed'][str(album_key)] = checkpoint['failed'].get(str(album_key), 0) + 1
+                        continue
+                    stats['classified'] += 1
+                    pending_keys.append(album_key)
+                    pending_rows.extend({'album_key': album_key, 'mood': mood, 'explanation': explanation} for mood in descriptors)
+                    if len(pending_keys) >= batch_size:
+                        flush()
+                        logger.info(f"{stats['classified'] + stats['failed']} albums processed")
+                if limit and stats['albums'] >= limit:
+                    break
+        flush()
+        save_checkpoint(checkpoint_path, checkpoint)
+        if stats['rows_written']:
+            stats['catalog_version'] = refresh_catalog_snapshot(db).version
+    finally:
+        db.close()
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('DESCRIPTOR_CONCURRENCY', 4)), help='albums classified at once')
+    parser.add_argument('--batch-size', type=int, default=50, help='albums per bulk insert and checkpoint')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH, help='progress file used to resume')
+    parser.add_argument('--limit', type=int, default=None, help='stop after this many albums')
+    parser.add_argument('--retry-failed', action='store_true', help='retry albums the model previously could not classify')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stats = run(args.concurrency, args.batch_size, args.checkpoint, args.limit, args.retry_failed)
+    logger.info(f"Done: {stats}")
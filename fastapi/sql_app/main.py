@@ -2,70 +2,198 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.background import BackgroundScheduler
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
 import logging
+import os
+import secrets
+import socket
+import threading
+import time
 
-from . import models, crud
-from .database import engine, SessionLocal
-from .routes import mobile_app, web
-from .routes._utils import _get_apple_music_auth_header, _get_apple_music_recently_played_tracks
+from . import crud
+from .database import SessionLocal
+from .routes import mobile_app, session_utils, web
+from .routes.apple_music_utils import close_apple_music_clients
+from .routes.llm_client_utils import close_llm_clients
+from .routes._utils import _get_apple_music_auth_header, _get_apple_music_recently_played_tracks, summarize_listening_preferences
+from .routes.catalog_utils import refresh_catalog_snapshot
+from .routes.metrics_utils import register_metrics
+from .routes.response_utils import add_compression_middleware
 
 logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+PREFERENCE_REFRESH_BATCH_SIZE = int(os.getenv('PREFERENCE_REFRESH_BATCH_SIZE', 100))
+PREFERENCE_REFRESH_CONCURRENCY = int(os.getenv('PREFERENCE_REFRESH_CONCURRENCY', 8))
+PREFERENCE_REFRESH_USER_TIMEOUT_SECONDS = float(os.getenv('PREFERENCE_REFRESH_USER_TIMEOUT_SECONDS', 30))
+
+# Every uvicorn worker runs the scheduler, so a lease row on the primary makes the refresh run once per deployment;
+# the holder renews it after each batch, and a crashed holder's lease lapses after this long
+PREFERENCE_REFRESH_LEASE_SECONDS = float(os.getenv('PREFERENCE_REFRESH_LEASE_SECONDS', 900))
+PREFERENCE_REFRESH_JOB = 'refresh_stale_user_preferences'
+_preference_refresh_stats = {
+    'running': False,
+    'runs': 0,
+    'skipped_runs': 0,
+    'last_started_at': None,
+    'last_finished_at': None,
+    'last_duration_seconds': None,
+    'users_seen': 0,
+    'users_refreshed': 0,
+    'users_without_tracks': 0,
+    'users_failed': 0,
+    'users_timed_out': 0,
+}
+_preference_refresh_stats_lock = threading.Lock()
+
+def _count_preference_refresh(name: str):
+    with _preference_refresh_stats_lock:
+        _preference_refresh_stats[name] += 1
+
+def get_preference_refresh_stats() -> dict:
+    with _preference_refresh_stats_lock:
+        return dict(_preference_refresh_stats)
+
+register_metrics('preference_refresh', get_preference_refresh_stats)
+
+def _flush_user_preferences(db, pending_results: dict):
+    if not pending_results:
+        return
+    try:
+        crud.bulk_upsert_user_listening_preferences(db, results_by_user=pending_results)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to write preferences for {len(pending_results)} users: {e}")
+    pending_results.clear()
+
+def _compute_user_preferences(api_key: str, music_user_token: str):
+    """
+    Fetch one user's recently played tracks and summarise them; runs on a worker thread with its own DB session.
+
+    The user's deadline is passed down to every Apple request, so their timeouts, retries and rate-limit
+    waits all fit inside PREFERENCE_REFRESH_USER_TIMEOUT_SECONDS rather than being checked between pages.
+    """
+    deadline = time.monotonic() + PREFERENCE_REFRESH_USER_TIMEOUT_SECONDS
+    encoded_heading = _get_apple_music_auth_header(api_key)
+    developer_token = encoded_heading['developer_token']
+    headers = {
+        'Authorization': f'Bearer {developer_token}',
+        'Music-User-Token': music_user_token,
+    }
+    # Users are already fetched concurrently, so each user's pages are requested one at a time
+    tracks = _get_apple_music_recently_played_tracks(headers, track_limit=100, deadline=deadline, parallel=False)
+    track_ids = list(set([i['id'] for i in tracks]))
+    db = SessionLocal()
+    try:
+        db_tracks = crud.get_track_data_multiple_tracks(db, track_ids=track_ids)
+    finally:
+        db.close()
+    if len(db_tracks) == 0:
+        return None
+    track_dicts = [
+        {feature: getattr(t, feature) for feature in ['apple_music_track_id', 'album_key', 'artist', 'genre']}
+        for t in db_tracks
+    ]
+    return summarize_listening_preferences(track_dicts)
 
 def refresh_stale_user_preferences():
+    """
+    Recompute listening preferences for active users whose preferences are stale.
+
+    Only one run happens at a time across all workers: a run that cannot take the job lease is skipped.
+    Users are processed PREFERENCE_REFRESH_CONCURRENCY at a time; calls to Apple share the client's
+    per-process token-bucket rate limit, and each user gets PREFERENCE_REFRESH_USER_TIMEOUT_SECONDS.
+    """
+    lease_holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+    db = SessionLocal()
+    try:
+        try:
+            acquired = crud.try_acquire_job_lease(db, PREFERENCE_REFRESH_JOB, lease_holder, PREFERENCE_REFRESH_LEASE_SECONDS)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Skipping preference refresh: could not take the job lease: {e}")
+            acquired = False
+        if not acquired:
+            _count_preference_refresh('skipped_runs')
+            logger.info("Skipping preference refresh: another run holds the job lease")
+            return
+        try:
+            _run_preference_refresh(db, lease_holder)
+        finally:
+            crud.release_job_lease(db, PREFERENCE_REFRESH_JOB, lease_holder)
+    finally:
+        db.close()
+
+def _run_preference_refresh(db, lease_holder: str):
+    started = time.monotonic()
+    with _preference_refresh_stats_lock:
+        _preference_refresh_stats.update({'running': True, 'last_started_at': datetime.datetime.utcnow(), 'users_seen': 0, 'users_refreshed': 0,
+                                          'users_without_tracks': 0, 'users_failed': 0, 'users_timed_out': 0})
+    pending_results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=PREFERENCE_REFRESH_CONCURRENCY, thread_name_prefix='preference-refresh') as executor:
+            for stale_users in crud.iter_active_stale_user_batches(db, batch_size=PREFERENCE_REFRESH_BATCH_SIZE):
+                futures = {executor.submit(_compute_user_preferences, user.api_key, user.music_user_token): user.api_key for user in stale_users}
+                for future in as_completed(futures):
+                    api_key = futures[future]
+                    _count_preference_refresh('users_seen')
+                    try:
+                        all_results = future.result()
+                    except TimeoutError:
+                        _count_preference_refresh('users_timed_out')
+                        logger.warning(f"Timed out refreshing preferences for user {api_key}")
+                        continue
+                    except Exception as e:
+                        _count_preference_refresh('users_failed')
+                        logger.warning(f"Failed to refresh preferences for user {api_key}: {e}")
+                        continue
+                    if all_results is None:
+                        _count_preference_refresh('users_without_tracks')
+                        continue
+                    pending_results[api_key] = all_results
+                    _count_preference_refresh('users_refreshed')
+                _flush_user_preferences(db, pending_results)
+                logger.info(f"Preference refresh progress: {get_preference_refresh_stats()['users_seen']} users processed")
+                if not crud.renew_job_lease(db, PREFERENCE_REFRESH_JOB, lease_holder, PREFERENCE_REFRESH_LEASE_SECONDS):
+                    logger.warning("Stopping preference refresh: the job lease expired and was taken over")
+                    break
+    finally:
+        with _preference_refresh_stats_lock:
+            _preference_refresh_stats.update({'running': False, 'runs': _preference_refresh_stats['runs'] + 1,
+                                              'last_finished_at': datetime.datetime.utcnow(), 'last_duration_seconds': time.monotonic() - started})
+
+def refresh_catalog():
+    db = SessionLocal()
+    try:
+        snapshot = refresh_catalog_snapshot(db)
+        logger.info(f"Refreshed catalog snapshot, version {snapshot.version}")
+    except Exception as e:
+        logger.warning(f"Failed to refresh catalog snapshot: {e}")
+    finally:
+        db.close()
+
+def sweep_expired_sessions():
     db = SessionLocal()
     try:
-        stale_users = crud.get_active_stale_users(db)
-        for user in stale_users:
-            try:
-                encoded_heading = _get_apple_music_auth_header(user.api_key)
-                developer_token = encoded_heading['developer_token']
-                headers = {
-                    'Authorization': f'Bearer {developer_token}',
-                    'Music-User-Token': user.music_user_token,
-                }
-                tracks = _get_apple_music_recently_played_tracks(headers, track_limit=100)
-                track_ids = list(set([i['id'] for i in tracks]))
-                db_tracks = crud.get_track_data_multiple_tracks(db, track_ids=track_ids)
-                if len(db_tracks) == 0:
-                    continue
-                track_dicts = [
-                    {feature: getattr(t, feature) for feature in ['apple_music_track_id', 'album_key', 'artist', 'genre']}
-                    for t in db_tracks
-                ]
-                total = len(track_dicts)
-                all_results = []
-                for artist, count in Counter(t['artist'] for t in track_dicts).most_common(1):
-                    all_results.append({
-                        'topic': artist,
-                        'type': 'artist',
-                        'count': count,
-                        'rate': count / total,
-                        'album_keys': list(set(str(t['album_key']) for t in track_dicts if t['artist'] == artist)),
-                    })
-                for genre, count in Counter(t['genre'] for t in track_dicts).most_common(2):
-                    all_results.append({
-                        'topic': genre,
-                        'type': 'genre',
-                        'count': count,
-                        'rate': count / total,
-                        'album_keys': list(set(str(t['album_key']) for t in track_dicts if t['genre'] == genre)),
-                    })
-                crud.upsert_user_listening_preferences(db, api_key=user.api_key, results=all_results)
-            except Exception as e:
-                logger.warning(f"Failed to refresh preferences for user {user.api_key}: {e}")
+        sessions_deleted, api_keys_deleted = session_utils.sweep_expired_sessions(db)
+        logger.info(f"Deleted {sessions_deleted} expired sessions and {api_keys_deleted} expired API keys")
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to sweep expired sessions: {e}")
     finally:
         db.close()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     scheduler = BackgroundScheduler()
-    scheduler.add_job(refresh_stale_user_preferences, 'interval', hours=1)
+    scheduler.add_job(refresh_stale_user_preferences, 'interval', hours=1, max_instances=1, coalesce=True)
+    scheduler.add_job(refresh_catalog, 'interval', minutes=int(os.getenv('CATALOG_REFRESH_MINUTES', 60)))
+    scheduler.add_job(sweep_expired_sessions, 'interval', hours=int(os.getenv('SESSION_SWEEP_HOURS', 6)))
     scheduler.start()
     yield
     scheduler.shutdown()
+    await close_apple_music_clients()
+    close_llm_clients()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -79,6 +207,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+add_compression_middleware(app)
 
 app.include_router(mobile_app.router)
 app.include_router(web.router)
\ No newline at end of file
@@ -0,0 +1,22 @@
+"""
+Create any missing tables on the primary database.
+
+Run explicitly before starting the API (the Docker image does this on container start)
+rather than at import time, so uvicorn workers and --reload cycles start fast:
+
+    python -m sql_app.migrate
+"""
+import logging
+
+from . import models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+def migrate():
+    models.Base.metadata.create_all(bind=engine)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+    logger.info("Schema is up to date")
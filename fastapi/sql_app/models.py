@@ -204,6 +204,32 @@ class UserListeningPreference(Base):
     album_keys = Column(JSON, nullable=False)
     computed_at = Column(DateTime, nullable=False)
 
+class UserSession(Base):
+    __tablename__ = 'user_sessions'
+    __table_args__ = {"schema": "user_data"}
+
+    session_id = Column(String, primary_key=True)
+    user_token = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class UserApiKey(Base):
+    __tablename__ = 'user_api_keys'
+    __table_args__ = {"schema": "user_data"}
+
+    api_key = Column(String, primary_key=True)
+    session_id = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class JobLease(Base):
+    __tablename__ = 'job_leases'
+    __table_args__ = {"schema": "user_data"}
+
+    job_name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
 class RelevantAlbums(Base):
     __tablename__ = "dim_music_lists"
     __table_args__ = {"schema": "dbt"}
@@ -2,16 +2,20 @@ from .. import crud
 from ..database import get_db
 from fastapi import HTTPException, Query, Depends, Header
 import numpy as np
-import pandas as pd
-from sklearn.metrics import pairwise
+from .lazy_utils import pd, pairwise
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from decimal import Decimal
 from typing import List, Optional
 from sqlalchemy.orm import Session
+from .apple_music_utils import apple_music_request
+from .cache_utils import get_cache
+from .metrics_utils import register_metrics
 import datetime
-import json
 import os
+import threading
+import time
 import jwt
-import requests
 
 def normalize_weights(weights):
     """
@@ -181,7 +185,7 @@ def unpack_artists(db_artists, features):
     artist_df = pd.DataFrame.from_dict(x['artists'], orient='index')
     return artist_df
 
-def generic_unpack(db, features, dictionary_name, id_column) -> pd.DataFrame:
+def generic_unpack(db, features, dictionary_name, id_column) -> 'pd.DataFrame':
     x = {dictionary_name: {}}
     for position, value in enumerate(db):
         x[dictionary_name][getattr(value, id_column)] = {}
@@ -738,7 +742,8 @@ def _get_similar_tracks(track_id: str,
     df = df.reset_index()
     df = df.rename(columns={'index': 'track_id'})
     final_x = {}
-    final_x['tracks'] = json.loads(df.to_json(orient='records'))
+    # Box numpy scalars into Python values and NaN into None directly, rather than a to_json/json.loads round trip
+    final_x['tracks'] = df.astype(object).where(df.notna(), None).to_dict(orient='records')
     print('Finish Job', datetime.datetime.now())
     return final_x
 
@@ -752,13 +757,22 @@ def verify_api_key(x_api_key: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return x_api_key
 
-def _get_apple_music_auth_header(api_key: str):
+APPLE_TOKEN_TTL_HOURS = float(os.getenv('APPLE_TOKEN_TTL_HOURS', 12))
+# Stop handing out a cached token this long before it expires, so clients never receive a nearly-expired one
+APPLE_TOKEN_REFRESH_MARGIN_MINUTES = float(os.getenv('APPLE_TOKEN_REFRESH_MARGIN_MINUTES', 30))
+
+_apple_token_cache = get_cache('apple_developer_token', max_size=1, shared=False)
+_apple_token_stats = {'requests': 0, 'served_from_cache': 0, 'signed': 0, 'signing_seconds': 0.0}
+_apple_token_stats_lock = threading.Lock()
+
+def _sign_apple_music_developer_token():
     ALG = os.getenv('APPLE_ALG')
     KEY_ID = os.getenv('APPLE_KEY_ID')
     TEAM_ID = os.getenv('APPLE_TEAM_ID')
     SECRET = os.getenv('APPLE_SECRET')
-    time_now = datetime.datetime.now()
-    time_expired = datetime.datetime.now() + datetime.timedelta(hours=12)
+    start = time.perf_counter()
+    time_now = int(time.time())
+    time_expired = time_now + int(APPLE_TOKEN_TTL_HOURS * 3600)
 
     headers = {
         "alg": ALG,
@@ -767,31 +781,112 @@ def _get_apple_music_auth_header(api_key: str):
 
     payload = {
         'iss': TEAM_ID,
-        'exp': int(time_expired.strftime("%s")),
-        'iat': int(time_now.strftime("%s"))
+        'exp': time_expired,
+        'iat': time_now
     }
 
     encoded_heading = jwt.encode(payload, SECRET, algorithm=ALG, headers=headers)
+    with _apple_token_stats_lock:
+        _apple_token_stats['signed'] += 1
+        _apple_token_stats['signing_seconds'] += time.perf_counter() - start
+    return encoded_heading
+
+def _get_apple_music_auth_header(api_key: str):
+    """
+    Return the Apple Music developer token, re-signing it only when the cached one is within the refresh margin of expiry
+    """
+    cache_seconds = max(APPLE_TOKEN_TTL_HOURS * 3600 - APPLE_TOKEN_REFRESH_MARGIN_MINUTES * 60, 1)
+    signed = False
+
+    def sign():
+        # Only runs on a cache miss, which is how a served-from-cache request is told apart
+        nonlocal signed
+        signed = True
+        return _sign_apple_music_developer_token()
+
+    encoded_heading = _apple_token_cache.get_or_set('developer_token', sign, ttl=cache_seconds)
+    with _apple_token_stats_lock:
+        _apple_token_stats['requests'] += 1
+        if not signed:
+            _apple_token_stats['served_from_cache'] += 1
     return {'developer_token': encoded_heading}
 
-def _get_apple_music_recently_played_tracks(headers: dict, track_limit: int):
-    BASE_URL = "https://api.music.apple.com/v1/me/recent/played/tracks"
-    PAGE_SIZE = 30  # API max per request
+def get_apple_token_stats() -> dict:
+    with _apple_token_stats_lock:
+        stats = dict(_apple_token_stats)
+    average_signing_seconds = stats['signing_seconds'] / stats['signed'] if stats['signed'] else 0.0
+    stats['average_signing_ms'] = average_signing_seconds * 1000
+    stats['estimated_signing_ms_saved'] = stats['served_from_cache'] * average_signing_seconds * 1000
+    return stats
+
+register_metrics('apple_developer_token', get_apple_token_stats)
+
+def summarize_listening_preferences(track_dicts: list) -> list:
+    """
+    Summarise a user's tracks into their top artist and top two genres, with the share of plays and album_keys for each
+    """
+    all_results = []
+    total_track_length = len(track_dicts)
+    top_artist = Counter(i['artist'] for i in track_dicts).most_common(1)
+    for i in top_artist:
+        artist_album_keys = list(set(
+            str(t['album_key']) for t in track_dicts if t['artist'] == i[0]
+        ))
+        all_results.append({
+            'topic': i[0],
+            'type': 'artist',
+            'count': i[1],
+            'rate': i[1] / total_track_length,
+            'album_keys': artist_album_keys
+        })
+    top_genres = Counter(i['genre'] for i in track_dicts).most_common(2)
+    for i in top_genres:
+        genre_album_keys = list(set(
+            str(t['album_key']) for t in track_dicts if t['genre'] == i[0]
+        ))
+        all_results.append({
+            'topic': i[0],
+            'type': 'genre',
+            'count': i[1],
+            'rate': i[1] / total_track_length,
+            'album_keys': genre_album_keys
+        })
+    return all_results
+
+RECENTLY_PLAYED_PATH = "/v1/me/recent/played/tracks"
+RECENTLY_PLAYED_PAGE_SIZE = 30  # API max per request
+# Fetch the expected recently-played pages concurrently rather than one after another
+APPLE_MUSIC_PARALLEL_PAGES = os.getenv('APPLE_MUSIC_PARALLEL_PAGES', 'true').lower() == 'true'
+_page_executor = ThreadPoolExecutor(max_workers=int(os.getenv('APPLE_MUSIC_PAGE_CONCURRENCY', 8)), thread_name_prefix='apple-music-pages')
+
+def _get_recently_played_page(headers: dict, offset: int, page_limit: int, deadline: float = None) -> dict:
+    response = apple_music_request('GET', RECENTLY_PLAYED_PATH, headers=headers, deadline=deadline, params={"limit": page_limit, "offset": offset})
+    response.raise_for_status()
+    return response.json()
+
+def _get_apple_music_recently_played_tracks(headers: dict, track_limit: int, deadline: float = None, parallel: bool = None):
+    """
+    Return up to track_limit of the user's recently played tracks.
+
+    In parallel mode all expected pages (offsets 0, 30, 60, ...) are requested at once; results are
+    trimmed at the first short or final page and deduplicated by track id. Sequential mode pages one
+    request at a time. deadline is a time.monotonic() value after which the fetch gives up; it also
+    bounds each request's timeouts and retries, so a slow or throttled page cannot overrun it.
+    """
+    if parallel is None:
+        parallel = APPLE_MUSIC_PARALLEL_PAGES
+    if parallel:
+        return _get_recently_played_tracks_parallel(headers, track_limit, deadline)
     all_tracks = []
     offset = 0
     while len(all_tracks) < track_limit:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out after {len(all_tracks)} recently played tracks")
         # Calculate how many tracks to request this page
         remaining = track_limit - len(all_tracks)
-        page_limit = min(PAGE_SIZE, remaining)
+        page_limit = min(RECENTLY_PLAYED_PAGE_SIZE, remaining)
 
-        params = {
-            "limit": page_limit,
-            "offset": offset,
-        }
-
-        response = requests.get(BASE_URL, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = _get_recently_played_page(headers, offset, page_limit, deadline)
 
         tracks = data.get("data", [])
         if not tracks:
@@ -806,4 +901,31 @@ def _get_apple_music_recently_played_tracks(headers: dict, track_limit: int):
         # Advance offset for next page
         offset += len(tracks)
 
+    return all_tracks[:track_limit]
+
+def _get_recently_played_tracks_parallel(headers: dict, track_limit: int, deadline: float = None):
+    pages = [(offset, min(RECENTLY_PLAYED_PAGE_SIZE, track_limit - offset)) for offset in range(0, track_limit, RECENTLY_PLAYED_PAGE_SIZE)]
+    futures = [_page_executor.submit(_get_recently_played_page, headers, offset, page_limit, deadline) for offset, page_limit in pages]
+    timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+    all_tracks = []
+    seen_ids = set()
+    try:
+        # Consume pages in offset order; the history is contiguous, so nothing after a short page is valid
+        for (offset, page_limit), future in zip(pages, futures):
+            if timeout is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                data = future.result(timeout=timeout)
+            except FuturesTimeoutError:
+                raise TimeoutError(f"Timed out after {len(all_tracks)} recently played tracks")
+            tracks = data.get("data", [])
+            for track in tracks:
+                if track.get('id') not in seen_ids:
+                    seen_ids.add(track.get('id'))
+                    all_tracks.append(track)
+            if len(tracks) < page_limit or not data.get("next"):
+                break
+    finally:
+        for future in futures:
+            future.cancel()
     return all_tracks[:track_limit]
\ No newline at end of file
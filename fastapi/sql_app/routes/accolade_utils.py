@@ -0,0 +1,47 @@
+from .. import crud
+from .cache_utils import get_cache
+from .catalog_utils import get_catalog_snapshot
+from sqlalchemy.orm import Session
+
+class AccoladeIndex:
+    """
+    album_key -> accolades from dim_music_lists, presorted by points (highest first).
+
+    Each album keeps two presorted lists, all accolades and those without 1-point entries,
+    so a request is a dictionary lookup plus a slice.
+    """
+    def __init__(self, rows):
+        grouped = {}
+        for album_key, rank, points, publication, list_name in rows:
+            grouped.setdefault(str(album_key), []).append({'rank': rank, 'points': points, 'publication': publication, 'list': list_name})
+        self.accolades = {}
+        self.accolades_excluding_one_point = {}
+        for album_key, accolades in grouped.items():
+            # Ties on points were previously in arbitrary row order; break them by publication and list
+            accolades.sort(key=lambda x: (-(x['points'] or 0), x['publication'] or '', x['list'] or ''))
+            self.accolades[album_key] = accolades
+            self.accolades_excluding_one_point[album_key] = [i for i in accolades if i['points'] != 1]
+
+    def __contains__(self, album_key) -> bool:
+        return str(album_key) in self.accolades
+
+    def lookup(self, album_key, n_accolades: int = 10, exclude_accolades_only_one_point: bool = True) -> list:
+        """
+        Top n_accolades for an album; 1-point accolades are only dropped when the album has more than one accolade
+        """
+        album_key = str(album_key)
+        accolades = self.accolades.get(album_key, [])
+        if exclude_accolades_only_one_point and len(accolades) > 1:
+            accolades = self.accolades_excluding_one_point[album_key]
+        return accolades[:max(n_accolades, 1)]
+
+    @classmethod
+    def load(cls, db: Session):
+        return cls(crud.get_all_album_accolades(db))
+
+# Keyed by catalog version, whose fingerprint covers dim_music_lists, so the index is rebuilt after a dbt run
+_ACCOLADE_CACHE = get_cache('accolades', max_size=1, shared=False)
+
+def get_accolade_index(db: Session) -> AccoladeIndex:
+    version = get_catalog_snapshot(db).version
+    return _ACCOLADE_CACHE.get_or_set(version, lambda: AccoladeIndex.load(db))
@@ -0,0 +1,225 @@
+from .metrics_utils import register_metrics
+from requests.adapters import HTTPAdapter
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import httpx
+import requests
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Point at a local mock server in development/tests, e.g. http://localhost:8999
+APPLE_MUSIC_BASE_URL = os.getenv('APPLE_MUSIC_BASE_URL', 'https://api.music.apple.com').rstrip('/')
+APPLE_MUSIC_CONNECT_TIMEOUT = float(os.getenv('APPLE_MUSIC_CONNECT_TIMEOUT', 3.05))
+APPLE_MUSIC_READ_TIMEOUT = float(os.getenv('APPLE_MUSIC_READ_TIMEOUT', 10))
+APPLE_MUSIC_MAX_RETRIES = int(os.getenv('APPLE_MUSIC_MAX_RETRIES', 3))
+APPLE_MUSIC_BACKOFF_SECONDS = float(os.getenv('APPLE_MUSIC_BACKOFF_SECONDS', 0.5))
+APPLE_MUSIC_POOL_SIZE = int(os.getenv('APPLE_MUSIC_POOL_SIZE', 20))
+# 429 means the request was not processed, so it is always safe to retry; 5xx only for idempotent methods
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+MAX_BACKOFF_SECONDS = 30
+# Budget for calls to Apple (interactive and background) per process, not per deployment: every
+# uvicorn worker has its own bucket, so set this to Apple's allowance divided by the worker count.
+# 0 disables the limit
+APPLE_MUSIC_PROCESS_RATE_LIMIT_PER_SECOND = float(os.getenv('APPLE_MUSIC_PROCESS_RATE_LIMIT_PER_SECOND', 20))
+APPLE_MUSIC_PROCESS_RATE_LIMIT_BURST = int(os.getenv('APPLE_MUSIC_PROCESS_RATE_LIMIT_BURST', 20))
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter shared by the threads and coroutines of one process.
+
+    reserve() takes a token immediately and returns how long the caller must wait before using it,
+    so sync callers can time.sleep() and async callers can asyncio.sleep() on the same bucket.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += wait
+            return wait
+
+_process_rate_limiter = TokenBucket(APPLE_MUSIC_PROCESS_RATE_LIMIT_PER_SECOND, APPLE_MUSIC_PROCESS_RATE_LIMIT_BURST)
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = {}
+_stats = {'requests': 0, 'retries': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def get_apple_music_session() -> requests.Session:
+    """
+    Shared requests.Session so calls reuse pooled keep-alive TLS connections to Apple
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=APPLE_MUSIC_POOL_SIZE, pool_maxsize=APPLE_MUSIC_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def get_async_apple_music_client() -> httpx.AsyncClient:
+    """
+    Shared httpx.AsyncClient for async routes; one per event loop, since a client cannot be shared across loops
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=httpx.Timeout(APPLE_MUSIC_READ_TIMEOUT, connect=APPLE_MUSIC_CONNECT_TIMEOUT),
+                                   limits=httpx.Limits(max_connections=APPLE_MUSIC_POOL_SIZE, max_keepalive_connections=APPLE_MUSIC_POOL_SIZE))
+        _async_clients[loop] = client
+    return client
+
+async def close_apple_music_clients():
+    global _session
+    for loop, client in list(_async_clients.items()):
+        if loop is asyncio.get_running_loop():
+            await client.aclose()
+        _async_clients.pop(loop, None)
+    if _session is not None:
+        _session.close()
+        _session = None
+
+def _url(path: str) -> str:
+    return path if path.startswith('http') else f"{APPLE_MUSIC_BASE_URL}{path}"
+
+def _should_retry(method: str, status_code: int = None) -> bool:
+    if status_code is None:
+        # Connection error or timeout: only safe to resend if the method is idempotent
+        return method in IDEMPOTENT_METHODS
+    return status_code == 429 or (status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS)
+
+def _backoff_seconds(attempt: int, retry_after: str = None) -> float:
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_BACKOFF_SECONDS)
+    return min(APPLE_MUSIC_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random()), MAX_BACKOFF_SECONDS)
+
+def _time_left(deadline: Optional[float], method: str, path: str) -> Optional[float]:
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"Apple Music {method} {path} exceeded its deadline")
+    return remaining
+
+def _reserve_slot(deadline: Optional[float], method: str, path: str) -> float:
+    """
+    Seconds to wait for a rate-limit slot; TimeoutError if the slot comes after the deadline
+    """
+    wait = _process_rate_limiter.reserve()
+    remaining = _time_left(deadline, method, path)
+    if remaining is not None and wait >= remaining:
+        raise TimeoutError(f"Apple Music {method} {path} would wait past its deadline for a rate-limit slot")
+    return wait
+
+def _retry_fits(backoff: float, deadline: Optional[float]) -> bool:
+    return deadline is None or time.monotonic() + backoff < deadline
+
+def apple_music_request(method: str, path: str, headers: dict, deadline: float = None, **kwargs) -> requests.Response:
+    """
+    Send a request to the Apple Music API over the pooled session, retrying 429/5xx with exponential backoff.
+
+    path is relative to APPLE_MUSIC_BASE_URL (e.g. '/v1/me/recent/played/tracks'). Returns the final response;
+    callers decide how to handle non-2xx statuses. deadline is a time.monotonic() value covering the whole call:
+    each attempt's timeouts are cut to the time left, a retry whose backoff would overrun it is not made, and
+    TimeoutError is raised once it has passed.
+    """
+    method = method.upper()
+    timeout = kwargs.pop('timeout', (APPLE_MUSIC_CONNECT_TIMEOUT, APPLE_MUSIC_READ_TIMEOUT))
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    session = get_apple_music_session()
+    for attempt in range(APPLE_MUSIC_MAX_RETRIES + 1):
+        wait = _reserve_slot(deadline, method, path)
+        if wait:
+            time.sleep(wait)
+        remaining = _time_left(deadline, method, path)
+        timeout = (connect_timeout, read_timeout) if remaining is None else (min(connect_timeout, remaining), min(read_timeout, remaining))
+        _count('requests')
+        try:
+            response = session.request(method, _url(path), headers=headers, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            backoff = _backoff_seconds(attempt)
+            if attempt == APPLE_MUSIC_MAX_RETRIES or not _should_retry(method) or not _retry_fits(backoff, deadline):
+                _count('errors')
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Apple Music {method} {path} exceeded its deadline") from e
+                raise
+            logger.warning(f"Apple Music {method} {path} failed ({e}), retrying")
+            _count('retries')
+            time.sleep(backoff)
+            continue
+        backoff = _backoff_seconds(attempt, response.headers.get('Retry-After'))
+        if attempt == APPLE_MUSIC_MAX_RETRIES or not _should_retry(method, response.status_code) or not _retry_fits(backoff, deadline):
+            if response.status_code >= 400:
+                _count('errors')
+            return response
+        _count('retries')
+        time.sleep(backoff)
+
+async def async_apple_music_request(method: str, path: str, headers: dict, deadline: float = None, **kwargs) -> httpx.Response:
+    """
+    Async version of apple_music_request for async routes, so they don't block the event loop
+    """
+    method = method.upper()
+    client = get_async_apple_music_client()
+    for attempt in range(APPLE_MUSIC_MAX_RETRIES + 1):
+        wait = _reserve_slot(deadline, method, path)
+        if wait:
+            await asyncio.sleep(wait)
+        remaining = _time_left(deadline, method, path)
+        if remaining is not None:
+            kwargs['timeout'] = httpx.Timeout(min(APPLE_MUSIC_READ_TIMEOUT, remaining), connect=min(APPLE_MUSIC_CONNECT_TIMEOUT, remaining))
+        _count('requests')
+        try:
+            response = await client.request(method, _url(path), headers=headers, **kwargs)
+        except httpx.TransportError as e:
+            backoff = _backoff_seconds(attempt)
+            if attempt == APPLE_MUSIC_MAX_RETRIES or not _should_retry(method) or not _retry_fits(backoff, deadline):
+                _count('errors')
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Apple Music {method} {path} exceeded its deadline") from e
+                raise
+            logger.warning(f"Apple Music {method} {path} failed ({e}), retrying")
+            _count('retries')
+            await asyncio.sleep(backoff)
+            continue
+        backoff = _backoff_seconds(attempt, response.headers.get('Retry-After'))
+        if attempt == APPLE_MUSIC_MAX_RETRIES or not _should_retry(method, response.status_code) or not _retry_fits(backoff, deadline):
+            if response.status_code >= 400:
+                _count('errors')
+            return response
+        _count('retries')
+        await asyncio.sleep(backoff)
+
+def get_apple_music_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['rate_limit_wait_seconds'] = _process_rate_limiter.waited_seconds
+    return stats
+
+register_metrics('apple_music_api', get_apple_music_stats)
@@ -0,0 +1,293 @@
+from .metrics_utils import register_metrics
+from .response_utils import decode_json, encode_json
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import logging
+import os
+import secrets
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# e.g. redis://localhost:6379/0; unset to keep every cache in-process
+CACHE_URL = os.getenv('CACHE_URL')
+CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'topmusic')
+# How long a worker may hold the recompute lock for a key before others stop waiting for it
+CACHE_LOCK_TIMEOUT_SECONDS = float(os.getenv('CACHE_LOCK_TIMEOUT_SECONDS', 30))
+
+_MISSING = object()
+
+class _KeyLocks:
+    """
+    One lock per key, dropped again once no caller holds it
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def acquire(self, key):
+        with self._lock:
+            key_lock, waiters = self._locks.get(key, (None, 0))
+            key_lock = key_lock or threading.Lock()
+            self._locks[key] = (key_lock, waiters + 1)
+        key_lock.acquire()
+
+    def release(self, key):
+        with self._lock:
+            key_lock, waiters = self._locks[key]
+            if waiters == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (key_lock, waiters - 1)
+        key_lock.release()
+
+class MemoryCache:
+    """
+    In-process LRU cache with per-entry TTL and a maximum number of entries.
+
+    Local to one worker; used when no CACHE_URL is configured or for values that are cheap to
+    rebuild per worker.
+    """
+    def __init__(self, namespace: str, max_size: Optional[int] = 1024, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = _KeyLocks()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while self.max_size and len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items() if expires_at is None or expires_at > now]
+
+    def get_or_set(self, key, factory: Callable[[], Any], ttl: Optional[float] = None):
+        """
+        Return the cached value for key, computing it with factory on a miss.
+
+        Concurrent misses for the same key wait for the first caller instead of all running factory.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        self._key_locks.acquire(key)
+        try:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                value = factory()
+                self.set(key, value, ttl)
+            return value
+        finally:
+            self._key_locks.release(key)
+
+    def stats(self) -> dict:
+        return {'backend': 'memory', 'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+class RedisCache:
+    """
+    Cache shared by every worker through a Redis-protocol server (CACHE_URL).
+
+    Values are stored as JSON (dicts, lists, strings, numbers; tuples come back as lists), never pickled,
+    so whoever can write to the server cannot run code in the workers. Entries expire through Redis TTLs; the overall size limit is the server's
+    maxmemory / eviction policy rather than a per-namespace entry count. On connection errors the
+    cache behaves as empty so requests fall through to the database instead of failing.
+    """
+    # Only delete the recompute lock if we still own it
+    _RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, namespace: str, client, ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.client = client
+        self.ttl = ttl
+        self._key_locks = _KeyLocks()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key) -> str:
+        return f"{CACHE_KEY_PREFIX}:{self.namespace}:{key}"
+
+    def _lock_key(self, key) -> str:
+        return f"{CACHE_KEY_PREFIX}:lock:{self.namespace}:{key}"
+
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(self._key(key))
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Cache get failed for {self.namespace}: {e}")
+            return default
+        value = self._decode(key, raw)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def _decode(self, key, raw):
+        if raw is None:
+            return _MISSING
+        try:
+            return decode_json(raw)
+        except ValueError:
+            # Not written by this cache (e.g. an entry from before values were JSON); treated as a miss
+            logger.warning(f"Ignoring undecodable cache entry {self.namespace}:{key}")
+            return _MISSING
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            raw = encode_json(value)
+        except TypeError as e:
+            self.errors += 1
+            logger.warning(f"Cache set skipped for {self.namespace}, value is not JSON serializable: {e}")
+            return
+        try:
+            self.client.set(self._key(key), raw, px=int(ttl * 1000) if ttl else None)
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Cache set failed for {self.namespace}: {e}")
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Cache delete failed for {self.namespace}: {e}")
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=self._key('*')))
+            if keys:
+                self.client.delete(*keys)
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Cache clear failed for {self.namespace}: {e}")
+
+    def items(self):
+        prefix = self._key('')
+        output = []
+        try:
+            for redis_key in self.client.scan_iter(match=self._key('*')):
+                key = redis_key.decode('utf-8')[len(prefix):]
+                value = self._decode(key, self.client.get(redis_key))
+                if value is not _MISSING:
+                    output.append((key, value))
+        except redis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Cache scan failed for {self.namespace}: {e}")
+        return output
+
+    def get_or_set(self, key, factory: Callable[[], Any], ttl: Optional[float] = None):
+        """
+        Return the cached value for key, computing it with factory on a miss.
+
+        Threads in this worker queue on a local lock; across workers a SET NX lock lets one worker
+        compute while the others poll for the result, up to CACHE_LOCK_TIMEOUT_SECONDS.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        self._key_locks.acquire(key)
+        try:
+            return self._compute_shared(key, factory, ttl)
+        finally:
+            self._key_locks.release(key)
+
+    def _compute_shared(self, key, factory, ttl):
+        token = secrets.token_hex(8)
+        deadline = time.monotonic() + CACHE_LOCK_TIMEOUT_SECONDS
+        while True:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            try:
+                acquired = self.client.set(self._lock_key(key), token, nx=True, px=int(CACHE_LOCK_TIMEOUT_SECONDS * 1000))
+            except redis.RedisError:
+                acquired = None
+            if acquired or acquired is None or time.monotonic() > deadline:
+                # Lock acquired, Redis unreachable, or the holder took too long: compute it ourselves
+                try:
+                    value = factory()
+                    self.set(key, value, ttl)
+                    return value
+                finally:
+                    if acquired:
+                        try:
+                            self.client.eval(self._RELEASE_LOCK_SCRIPT, 1, self._lock_key(key), token)
+                        except redis.RedisError:
+                            pass
+            time.sleep(0.05)
+
+    def stats(self) -> dict:
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+_REDIS_CLIENT = None
+
+def _get_redis_client():
+    global _REDIS_CLIENT
+    if _REDIS_CLIENT is None:
+        _REDIS_CLIENT = redis.Redis.from_url(CACHE_URL, socket_timeout=1, socket_connect_timeout=1, health_check_interval=30)
+    return _REDIS_CLIENT
+
+def get_cache(namespace: str, max_size: Optional[int] = 1024, ttl: Optional[float] = None, shared: bool = True):
+    """
+    Return the cache for a namespace, creating it on first use.
+
+    Shared caches use Redis when CACHE_URL is set and the redis package is installed, and fall back to
+    an in-process LRU otherwise. Pass shared=False for values each worker should keep locally.
+    """
+    with _CACHES_LOCK:
+        if namespace not in _CACHES:
+            if shared and CACHE_URL and redis is not None:
+                _CACHES[namespace] = RedisCache(namespace, _get_redis_client(), ttl=ttl)
+            else:
+                if shared and CACHE_URL:
+                    logger.warning(f"CACHE_URL is set but redis is not installed; {namespace} cache is per-worker")
+                _CACHES[namespace] = MemoryCache(namespace, max_size=max_size, ttl=ttl)
+        return _CACHES[namespace]
+
+def get_cache_stats() -> dict:
+    return {namespace: cache.stats() for namespace, cache in _CACHES.items()}
+
+register_metrics('caches', get_cache_stats)
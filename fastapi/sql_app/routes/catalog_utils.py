@@ -0,0 +1,106 @@
+from .. import crud
+from .cache_utils import get_cache
+from .response_utils import encode_json
+from sqlalchemy.orm import Session
+from typing import Optional
+import datetime
+import hashlib
+import json
+import threading
+
+class CatalogSnapshot:
+    """
+    In-memory copy of the lookup dimensions (genres, publications, moods, artists).
+
+    These values only change after a dbt run, so they are loaded once, stamped with a
+    version hash, and the response payloads for the lookup endpoints are prebuilt.
+    """
+    def __init__(self, genre_rows, publication_rows, mood_rows, artist_rows, fingerprint=()):
+        self.genre_rows = [(genre, subgenre) for genre, subgenre in genre_rows]
+        self.publication_rows = sorted((publication, list_name) for publication, list_name in publication_rows)
+        self.moods = [mood for (mood,) in mood_rows]
+        self.artist_rows = [(artist_name, artist_id) for artist_name, artist_id in artist_rows]
+        # Cheap summary of the album/ranking tables so rankings also invalidate when dbt rebuilds them
+        self.fingerprint = [str(i) for i in fingerprint]
+        self.loaded_at = datetime.datetime.utcnow()
+        # Time the content last changed; carried over on refresh when the version is unchanged
+        self.changed_at = self.loaded_at
+        self.version = self._compute_version()
+
+        self.genre_hierarchy = {}
+        web_genres = {}
+        for genre, subgenre in self.genre_rows:
+            web_genres.setdefault(genre, []).append(subgenre)
+            if not genre:
+                continue
+            self.genre_hierarchy.setdefault(genre, [])
+            if subgenre and subgenre not in self.genre_hierarchy[genre]:
+                self.genre_hierarchy[genre].append(subgenre)
+
+        app_genres = {}
+        for genre, subgenre in self.genre_rows:
+            subgenres = app_genres.setdefault(genre, [])
+            if subgenre not in subgenres:
+                subgenres.append(subgenre)
+
+        publications = {}
+        for publication, list_name in self.publication_rows:
+            publications.setdefault(publication, []).append(list_name)
+
+        self.web_genres = {'genres': web_genres}
+        self.app_genres = {'genres': [{'name': genre, 'subgenres': subgenres} for genre, subgenres in app_genres.items()]}
+        self.publications = {'publications': publications}
+        self.web_moods = {'moods': list(self.moods)}
+        self.web_artists = {'artists': {artist_name: artist_id for artist_name, artist_id in self.artist_rows}}
+        self.app_artists = {'artists': [{'name': artist_name, 'id': artist_id} for artist_name, artist_id in self.artist_rows]}
+        self._encoded = {}
+
+    def encoded(self, name: str) -> bytes:
+        """
+        Return the named prebuilt payload as JSON bytes, encoding it once per snapshot
+        """
+        if name not in self._encoded:
+            self._encoded[name] = encode_json(getattr(self, name))
+        return self._encoded[name]
+
+    def _compute_version(self) -> str:
+        payload = json.dumps([self.genre_rows, self.publication_rows, self.moods, self.artist_rows, self.fingerprint], default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, db: Session):
+        return cls(genre_rows=crud.get_unique_genres(db),
+                   publication_rows=crud.get_unique_publications(db),
+                   mood_rows=crud.get_unique_moods(db),
+                   artist_rows=crud.get_artist_name_ids(db),
+                   fingerprint=crud.get_catalog_fingerprint(db)
+                   )
+
+# Kept per worker: the snapshot is read on every lookup request, so decoding it from a shared
+# backend would cost more than reloading it, and every worker derives the same version hash
+_CATALOG_CACHE = get_cache('catalog', max_size=1, shared=False)
+_CATALOG_LOCK = threading.Lock()
+
+def get_catalog_snapshot(db: Session) -> CatalogSnapshot:
+    """
+    Return the current catalog snapshot, loading it on first use
+    """
+    return _CATALOG_CACHE.get_or_set('snapshot', lambda: CatalogSnapshot.load(db))
+
+def refresh_catalog_snapshot(db: Session) -> CatalogSnapshot:
+    """
+    Reload the catalog snapshot from the database and swap it in atomically.
+
+    Called by the scheduler and the admin refresh endpoint after a dbt run.
+    """
+    snapshot = CatalogSnapshot.load(db)
+    with _CATALOG_LOCK:
+        current = _CATALOG_CACHE.get('snapshot')
+        if current is not None and current.version == snapshot.version:
+            snapshot.changed_at = current.changed_at
+        _CATALOG_CACHE.set('snapshot', snapshot)
+    return snapshot
+
+def get_catalog_version() -> Optional[str]:
+    snapshot = _CATALOG_CACHE.get('snapshot')
+    return snapshot.version if snapshot is not None else None
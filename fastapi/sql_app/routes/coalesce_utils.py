@@ -0,0 +1,83 @@
+from .metrics_utils import register_metrics
+from typing import Any, Callable, Hashable
+import threading
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls into one execution.
+
+    The first caller for a key runs the function; callers that arrive with the same key while it is
+    running wait and receive the same result (or exception). Nothing is cached once the call returns.
+    Only use it for endpoints whose result is fully determined by the key (no randomisation).
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]):
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlight()
+                self._in_flight[key] = call
+                self.executions += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'executions': self.executions, 'coalesced': self.coalesced,
+                'errors': self.errors, 'in_flight': len(self._in_flight)}
+
+_GROUPS = {}
+_GROUPS_LOCK = threading.Lock()
+
+def get_single_flight(name: str) -> SingleFlight:
+    with _GROUPS_LOCK:
+        if name not in _GROUPS:
+            _GROUPS[name] = SingleFlight(name)
+        return _GROUPS[name]
+
+def filter_key(values) -> tuple:
+    """
+    Normalise a list query parameter: crud only applies a filter when its first value is non-empty
+    """
+    if not values or not values[0]:
+        return ()
+    return tuple(values)
+
+def get_coalesce_stats() -> dict:
+    return {name: group.stats() for name, group in _GROUPS.items()}
+
+register_metrics('coalescing', get_coalesce_stats)
@@ -0,0 +1,62 @@
+from .. import crud
+from .cache_utils import get_cache
+from .catalog_utils import get_catalog_snapshot
+from .llm_utils import AVAILABLE_MOODS
+from sqlalchemy.orm import Session
+from typing import Optional
+
+MAX_DESCRIPTORS_PER_ALBUM = 3
+BASELINE_FEATURES = ['danceability', 'energy', 'instrumentalness', 'valence', 'tempo']
+
+# Dataset-wide means/standard deviations only change when the catalog does
+_BASELINE_CACHE = get_cache('audio_feature_baselines', max_size=1, shared=False)
+
+def load_audio_feature_baselines(db: Session) -> Optional[dict]:
+    rows = crud.get_mean_standard_deviation_of_audio_features(db)
+    if not rows or rows[0][0] is None:
+        return None
+    baselines = {}
+    for i, feature in enumerate(BASELINE_FEATURES):
+        baselines[feature] = rows[0][2 * i]
+        baselines[f'{feature}_std'] = rows[0][2 * i + 1]
+    return baselines
+
+def get_audio_feature_baselines(db: Session) -> Optional[dict]:
+    """
+    Mean and standard deviation of each album audio feature, computed once per catalog version
+    """
+    version = get_catalog_snapshot(db).version
+    baselines = _BASELINE_CACHE.get(version)
+    if baselines is None:
+        baselines = load_audio_feature_baselines(db)
+        if baselines is not None:
+            _BASELINE_CACHE.set(version, baselines)
+    return baselines
+
+def get_album_features(album) -> dict:
+    """
+    The FctAlbums fields the descriptor prompt uses
+    """
+    return {
+        'danceability': album.spotify_danceability_clean,
+        'energy': album.spotify_energy_clean,
+        'instrumentalness': album.spotify_instrumentalness_clean,
+        'valence': album.spotify_valence_clean,
+        'tempo': album.spotify_tempo_clean,
+        'genre': album.genre,
+        'subgenre': album.subgenre,
+        'apple_music_editorial_notes_short': album.apple_music_editorial_notes_short,
+        'apple_music_editorial_notes_standard': album.apple_music_editorial_notes_standard,
+    }
+
+def clean_descriptors(descriptors) -> list:
+    """
+    Keep valid descriptors only (case-insensitive, deduplicated), at most MAX_DESCRIPTORS_PER_ALBUM
+    """
+    valid = {mood.lower(): mood for mood in AVAILABLE_MOODS}
+    cleaned = []
+    for descriptor in descriptors or []:
+        mood = valid.get(str(descriptor).strip().lower())
+        if mood and mood not in cleaned:
+            cleaned.append(mood)
+    return cleaned[:MAX_DESCRIPTORS_PER_ALBUM]
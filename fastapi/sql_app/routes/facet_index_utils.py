@@ -0,0 +1,196 @@
+from .. import crud
+from .cache_utils import get_cache
+from .catalog_utils import get_catalog_snapshot
+from .lazy_utils import pd
+from .metrics_utils import register_metrics
+from sqlalchemy.orm import Session
+import numpy as np
+import os
+import threading
+import time
+
+FACET_INDEX_ENABLED = os.getenv('FACET_INDEX_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+# Filter-spec key -> column position in crud.get_facet_index_rows
+FACET_COLUMNS = {
+    'genres': 2,
+    'subgenres': 3,
+    'energy_levels': 4,
+    'valence_levels': 5,
+    'danceability_levels': 6,
+    'instrumentalness_levels': 7,
+}
+YEAR_COLUMN = 8
+
+def _popcount(bitmap: np.ndarray) -> int:
+    # NumPy 2 has a native popcount; unpacking and counting is the fastest fallback
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bitmap).sum())
+    return int(np.count_nonzero(np.unpackbits(bitmap)))
+
+_facet_stats = {'builds': 0, 'build_seconds': 0.0, 'tracks': 0, 'bitmaps': 0, 'bytes': 0, 'evaluations': 0, 'fallbacks': 0}
+_facet_stats_lock = threading.Lock()
+
+def _record(**values):
+    with _facet_stats_lock:
+        for key, value in values.items():
+            _facet_stats[key] += value
+
+def get_facet_stats() -> dict:
+    with _facet_stats_lock:
+        return dict(_facet_stats)
+
+register_metrics('facet_index', get_facet_stats)
+
+def _clean_year(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def clean_filter_spec(filter_spec: dict) -> dict:
+    """
+    Copy of an LLM-produced filter spec with the shapes the lookups expect: facet values as lists of
+    strings (a bare string is wrapped, anything else dropped) and years as ints ("1990" -> 1990,
+    unparseable years dropped). Keys the lookups do not read are passed through unchanged.
+    """
+    cleaned = dict(filter_spec or {})
+    for key in list(FACET_COLUMNS) + ['moods']:
+        values = cleaned.get(key)
+        if values is None:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        elif not isinstance(values, (list, tuple, set)):
+            values = []
+        cleaned[key] = [value for value in values if isinstance(value, str)]
+    for key in ('year_min', 'year_max'):
+        if key in cleaned:
+            cleaned[key] = _clean_year(cleaned[key])
+    return cleaned
+
+class FacetIndex:
+    """
+    Bitmap per filter dimension value over the playable track catalog.
+
+    Each genre, subgenre, audio level and mood gets a bit-packed array with one bit per track, so a
+    filter spec is OR within a dimension and AND across dimensions, and the match count is a
+    popcount. Year bounds use one cumulative "year <= y" bitmap per distinct year. Semantics match
+    crud.get_tracks_by_filter_spec: any listed mood matches, and NULL values never match a filter.
+    """
+    def __init__(self, track_rows, mood_rows):
+        start = time.perf_counter()
+        rows = list(track_rows)
+        self.size = len(rows)
+        self.track_ids = np.array([row[0] for row in rows], dtype=object)
+        self._all = np.packbits(np.ones(self.size, dtype=bool))
+        self._empty = np.zeros_like(self._all)
+
+        self.bitmaps = {}
+        for key, position in FACET_COLUMNS.items():
+            self.bitmaps[key] = self._value_bitmaps([row[position] for row in rows])
+
+        album_keys = np.array([row[1] if row[1] is not None else -1 for row in rows], dtype=np.int64)
+        mood_albums = {}
+        for album_key, mood in mood_rows:
+            if mood:
+                mood_albums.setdefault(mood, []).append(album_key)
+        self.bitmaps['moods'] = {mood: np.packbits(np.isin(album_keys, keys)) for mood, keys in mood_albums.items()}
+
+        years = np.array([row[YEAR_COLUMN] if row[YEAR_COLUMN] is not None else np.nan for row in rows], dtype=float)
+        has_year = ~np.isnan(years)
+        self._has_year = np.packbits(has_year)
+        self.years = np.unique(years[has_year]).astype(int)
+        # Cumulative, so a year range costs two lookups however wide it is
+        self._year_at_most = [np.packbits(has_year & (years <= year)) for year in self.years]
+
+        bitmap_count = sum(len(values) for values in self.bitmaps.values()) + len(self._year_at_most)
+        self.nbytes = bitmap_count * self._all.nbytes
+        _record(builds=1, build_seconds=time.perf_counter() - start, bitmaps=bitmap_count, bytes=self.nbytes, tracks=self.size)
+
+    @staticmethod
+    def _value_bitmaps(values) -> dict:
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        return {value: np.packbits(codes == code) for code, value in enumerate(uniques)}
+
+    def _years_bitmap(self, year_min, year_max):
+        bitmap = self._has_year
+        if year_max is not None:
+            i = int(np.searchsorted(self.years, year_max, side='right')) - 1
+            bitmap = self._year_at_most[i] if i >= 0 else self._empty
+        if year_min is not None:
+            i = int(np.searchsorted(self.years, year_min, side='left')) - 1
+            if i >= 0:
+                bitmap = bitmap & ~self._year_at_most[i]
+        return bitmap
+
+    def evaluate(self, filter_spec: dict) -> np.ndarray:
+        """
+        Packed bitmap of the tracks matching a filter spec
+        """
+        _record(evaluations=1)
+        result = self._all
+        for key, value_bitmaps in self.bitmaps.items():
+            values = filter_spec.get(key) or []
+            if not values:
+                continue
+            matched = [value_bitmaps[value] for value in values if value in value_bitmaps]
+            if not matched:
+                return self._empty
+            result = result & (np.bitwise_or.reduce(matched) if len(matched) > 1 else matched[0])
+        if filter_spec.get('year_min') is not None or filter_spec.get('year_max') is not None:
+            result = result & self._years_bitmap(filter_spec.get('year_min'), filter_spec.get('year_max'))
+        return result
+
+    def count(self, filter_spec: dict) -> int:
+        return _popcount(self.evaluate(filter_spec))
+
+    def count_many(self, filter_specs: list) -> list:
+        return [self.count(filter_spec) for filter_spec in filter_specs]
+
+    def track_ids_for(self, filter_spec: dict, limit: int = None) -> list:
+        """
+        Ids of the matching tracks; past the limit a uniform sample, so the pool is not biased towards low track ids
+        """
+        positions = np.flatnonzero(np.unpackbits(self.evaluate(filter_spec), count=self.size))
+        if limit is not None and len(positions) > limit:
+            positions = np.sort(np.random.default_rng().choice(positions, size=limit, replace=False))
+        return self.track_ids[positions].tolist()
+
+    @classmethod
+    def load(cls, db: Session):
+        return cls(crud.get_facet_index_rows(db), crud.get_album_mood_rows(db))
+
+# Per worker and keyed by catalog version, like the accolade index; a dbt run bumps the version
+_FACET_INDEX_CACHE = get_cache('facet_index', max_size=1, shared=False)
+_FACET_INDEX_LOCK = threading.Lock()
+
+def get_facet_index(db: Session) -> FacetIndex:
+    version = get_catalog_snapshot(db).version
+    index = _FACET_INDEX_CACHE.get(version)
+    if index is None:
+        # One build per worker even when a burst of requests arrives after a refresh
+        with _FACET_INDEX_LOCK:
+            index = _FACET_INDEX_CACHE.get_or_set(version, lambda: FacetIndex.load(db))
+    return index
+
+def count_tracks_for_filter_specs(db: Session, filter_specs: list) -> list:
+    """
+    Exact match counts for several filter specs, from the facet index unless it is disabled
+    """
+    filter_specs = [clean_filter_spec(filter_spec) for filter_spec in filter_specs]
+    if not FACET_INDEX_ENABLED:
+        _record(fallbacks=1)
+        return crud.count_tracks_for_filter_specs(db, filter_specs)
+    return get_facet_index(db).count_many(filter_specs)
+
+def get_tracks_by_filter_spec(db: Session, filter_spec: dict, song_limit: int = 200):
+    """
+    Tracks matching a filter spec: ids come from the facet index, rows from one primary-key lookup
+    """
+    filter_spec = clean_filter_spec(filter_spec)
+    if not FACET_INDEX_ENABLED:
+        _record(fallbacks=1)
+        return crud.get_tracks_by_filter_spec(db, filter_spec, song_limit=song_limit)
+    track_ids = get_facet_index(db).track_ids_for(filter_spec, limit=song_limit)
+    return crud.get_tracks_by_ids(db, track_ids)
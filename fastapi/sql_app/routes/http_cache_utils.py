@@ -0,0 +1,66 @@
+from fastapi import Request, Response
+from typing import Optional
+from email.utils import format_datetime, parsedate_to_datetime
+import datetime
+import hashlib
+import json
+import os
+
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 300))
+
+def build_etag(version: str, request: Request) -> str:
+    """
+    Weak ETag derived from the catalog version plus the request path and query parameters
+    """
+    params = sorted(request.query_params.multi_items())
+    basis = json.dumps([version, request.url.path, params])
+    return f'W/"{hashlib.sha1(basis.encode("utf-8")).hexdigest()[:20]}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def _not_modified_since(if_modified_since: str, last_modified: datetime.datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+def conditional_response(request: Request, response: Response, snapshot) -> Optional[Response]:
+    """
+    Attach ETag / Last-Modified / Cache-Control validators for a catalog-backed endpoint.
+
+    Returns a 304 response when the client's If-None-Match (or, failing that, If-Modified-Since)
+    shows it already has the current representation, so the caller can skip the query and
+    serialisation entirely. Returns None when the full response should be built.
+    """
+    etag = build_etag(snapshot.version, request)
+    last_modified = snapshot.changed_at.replace(tzinfo=datetime.timezone.utc)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': format_datetime(last_modified, usegmt=True),
+        'Cache-Control': f'public, max-age={CATALOG_CACHE_MAX_AGE}',
+    }
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    elif if_modified_since is not None:
+        not_modified = _not_modified_since(if_modified_since, last_modified)
+    else:
+        not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,189 @@
+from .cache_utils import get_cache
+from .catalog_utils import get_catalog_snapshot
+from .llm_utils import AVAILABLE_MOODS, YEAR_MIN, YEAR_MAX, _get_genre_hierarchy
+from .metrics_utils import register_metrics
+from .playlist_utils import normalize_prompt
+from sqlalchemy.orm import Session
+from typing import Optional
+import os
+import re
+import threading
+import time
+
+INTENT_PARSER_ENABLED = os.getenv('INTENT_PARSER_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+# Words that map straight onto an audio level; anything subtler is left to the LLM
+LEVEL_PHRASES = {
+    'energy_levels': {
+        'high energy': ['high energy', 'energetic', 'intense', 'workout', 'gym', 'running', 'hype', 'pump up'],
+        'moderate energy': ['moderate energy'],
+        'calm/relaxing': ['calm', 'relaxing', 'relaxed', 'relax', 'sleep', 'sleepy', 'soothing', 'peaceful'],
+    },
+    'valence_levels': {
+        'sad/depressing': ['sad', 'depressing', 'melancholy', 'melancholic', 'gloomy', 'heartbreak', 'heartbroken'],
+        'happy/upbeat': ['happy', 'cheerful', 'feel good', 'joyful', 'sunny'],
+        'neutral/mellow': ['mellow'],
+    },
+    'danceability_levels': {
+        'very danceable': ['danceable', 'dance', 'dancing', 'party', 'club'],
+        'not danceable': ['not danceable', 'undanceable'],
+    },
+    'instrumentalness_levels': {
+        'instrumental': ['instrumental', 'instrumentals', 'no vocals', 'without vocals', 'no lyrics'],
+    },
+}
+# Words that carry no filter of their own; a prompt made only of these and matched terms is unambiguous
+FILLER_WORDS = set("""
+a an the some any me my us our i m im we please give make play create build find put together want need
+like love would could can just really very more of for to from in on with and or by era decade decades years
+music songs song tracks track tunes playlist playlists mix list vibes vibe stuff something albums album
+""".split())
+
+WORD_DECADES = {'fifties': 1950, 'sixties': 1960, 'seventies': 1970, 'eighties': 1980, 'nineties': 1990}
+YEAR_RANGE_PATTERN = re.compile(r"\b(?:between )?((?:19|20)\d{2}) (?:to |and |through |until )?((?:19|20)\d{2})\b")
+YEAR_BOUND_PATTERN = re.compile(r"\b(since|after|post|before|pre|until) ((?:19|20)\d{2})\b")
+DECADE_PATTERN = re.compile(r"\b(?:(early|mid|late) )?(?:((?:19|20)?)(\d)0s|(fifties|sixties|seventies|eighties|nineties))\b")
+SINGLE_YEAR_PATTERN = re.compile(r"\b((?:19|20)\d{2})\b")
+DECADE_PARTS = {None: (0, 9), 'early': (0, 3), 'mid': (3, 6), 'late': (6, 9)}
+
+_intent_stats = {'prompts': 0, 'answered': 0, 'fallbacks': 0, 'parse_seconds': 0.0}
+_intent_stats_lock = threading.Lock()
+
+def _record(**values):
+    with _intent_stats_lock:
+        for key, value in values.items():
+            _intent_stats[key] += value
+
+def get_intent_stats() -> dict:
+    with _intent_stats_lock:
+        stats = dict(_intent_stats)
+    stats['answered_share'] = round(stats['answered'] / stats['prompts'], 3) if stats['prompts'] else None
+    return stats
+
+register_metrics('intent_parser', get_intent_stats)
+
+def _decade_start(century: str, digit: str) -> int:
+    if century:
+        return int(century + digit + '0')
+    # Two-digit decades: 50s-90s are the 1900s, 00s-40s the 2000s
+    return (1900 if int(digit) >= 5 else 2000) + int(digit) * 10
+
+def parse_years(text: str):
+    """
+    (year_min, year_max, remaining text) for the year expressions in a normalized prompt
+    (with "80 s" rejoined as "80s"):
+    ranges ("1985 to 1990"), open bounds ("since 2010", "pre 1980"), decades ("70s", "early 90s",
+    "the eighties") and single years. Several decades widen to cover all of them.
+    """
+    bounds = []
+    for match in YEAR_RANGE_PATTERN.finditer(text):
+        bounds.append((int(match.group(1)), int(match.group(2))))
+    text = YEAR_RANGE_PATTERN.sub(' ', text)
+    for match in YEAR_BOUND_PATTERN.finditer(text):
+        word, year = match.group(1), int(match.group(2))
+        if word in ('since', 'after', 'post'):
+            bounds.append((year + (word == 'after'), None))
+        else:
+            bounds.append((None, year - (word != 'until')))
+    text = YEAR_BOUND_PATTERN.sub(' ', text)
+    for match in DECADE_PATTERN.finditer(text):
+        part, century, digit, word = match.groups()
+        start = WORD_DECADES[word] if word else _decade_start(century, digit)
+        offset_min, offset_max = DECADE_PARTS[part]
+        bounds.append((start + offset_min, start + offset_max))
+    text = DECADE_PATTERN.sub(' ', text)
+    for match in SINGLE_YEAR_PATTERN.finditer(text):
+        bounds.append((int(match.group(1)), int(match.group(1))))
+    text = SINGLE_YEAR_PATTERN.sub(' ', text)
+    if not bounds:
+        return None, None, text
+    year_min = None if any(low is None for low, _ in bounds) else min(low for low, _ in bounds)
+    year_max = None if any(high is None for _, high in bounds) else max(high for _, high in bounds)
+    return year_min, year_max, text
+
+class IntentVocabulary:
+    """
+    Phrase table for recognising simple playlist prompts without the LLM.
+
+    Genres and subgenres come from the catalog's hierarchy, moods and audio levels from the values
+    the filter-spec prompt offers. A prompt is answered locally only when every word is either a
+    matched phrase, a year expression or filler; anything else (negations, artists, activities
+    the table does not know) goes to the LLM.
+    """
+    def __init__(self, hierarchy: dict):
+        self.hierarchy = hierarchy
+        self.phrases = {}
+        for key, values in LEVEL_PHRASES.items():
+            for value, phrases in values.items():
+                for phrase in phrases:
+                    self.phrases[phrase] = [(key, value)]
+        for mood in AVAILABLE_MOODS:
+            self.phrases[normalize_prompt(mood)] = [('moods', mood)]
+        subgenre_parents = {}
+        for genre, subgenres in hierarchy.items():
+            for subgenre in subgenres:
+                subgenre_parents.setdefault(subgenre, []).append(genre)
+        # Catalog names win over the level/mood synonyms, and a genre over a subgenre of the same name
+        for subgenre, parents in subgenre_parents.items():
+            self.phrases[normalize_prompt(subgenre)] = [('subgenres', subgenre)] + [('genres', genre) for genre in parents]
+        for genre in hierarchy:
+            self.phrases[normalize_prompt(genre)] = [('genres', genre)]
+        self.phrases.pop('', None)
+        # Longest phrases first so "high energy" wins over "energy" and "indie rock" over "rock"
+        alternatives = sorted(self.phrases, key=len, reverse=True)
+        self._pattern = re.compile(r"\b(?:" + '|'.join(re.escape(phrase) for phrase in alternatives) + r")\b")
+
+    def parse(self, user_request: str) -> Optional[dict]:
+        """
+        Filter spec for an unambiguous prompt, or None when it should go to the LLM
+        """
+        text = re.sub(r"\b((?:19|20)?\d0) s\b", r"\1s", normalize_prompt(user_request))
+        year_min, year_max, rest = parse_years(text)
+        spec = {}
+        for match in self._pattern.finditer(rest):
+            for key, value in self.phrases[match.group(0)]:
+                values = spec.setdefault(key, [])
+                if value not in values:
+                    values.append(value)
+        leftover = [word for word in self._pattern.sub(' ', rest).split() if word not in FILLER_WORDS]
+        if leftover or not (spec or year_min is not None or year_max is not None):
+            return None
+        # "happy sad songs" names two levels of one dimension; let the LLM decide what was meant
+        if any(len(spec.get(key, [])) > 1 for key in LEVEL_PHRASES):
+            return None
+        # Subgenres narrow every genre, so "rock and house" would silently drop the rock
+        if spec.get('subgenres') and any(not set(self.hierarchy.get(genre, [])) & set(spec['subgenres']) for genre in spec['genres']):
+            return None
+        if year_min is not None:
+            spec['year_min'] = max(year_min, YEAR_MIN)
+        if year_max is not None:
+            spec['year_max'] = min(year_max, YEAR_MAX)
+        if spec.get('year_min', YEAR_MIN) > spec.get('year_max', YEAR_MAX):
+            return None
+        # Name it after what the user typed, minus the filler ("some 90's hip-hop" -> "90's Hip-hop")
+        named = [word[:1].upper() + word[1:] for word in user_request.split() if normalize_prompt(word) not in FILLER_WORDS]
+        matched = [f"{key} {', '.join(value) if isinstance(value, list) else value}" for key, value in spec.items()]
+        spec['explanation'] = f"Matched locally: {'; '.join(matched)}"
+        spec['playlist_name'] = ' '.join(named)
+        return spec
+
+# The phrase table only changes with the genre hierarchy, i.e. with the catalog version
+_VOCABULARY_CACHE = get_cache('intent_vocabulary', max_size=1, shared=False)
+
+def get_intent_vocabulary(db: Session) -> IntentVocabulary:
+    version = get_catalog_snapshot(db).version
+    return _VOCABULARY_CACHE.get_or_set(version, lambda: IntentVocabulary(_get_genre_hierarchy(db)))
+
+def parse_playlist_intent(user_request: str, db: Session) -> Optional[dict]:
+    """
+    Filter spec for simple prompts (a genre, a decade, a mood word...) without calling the LLM;
+    None means the prompt is ambiguous and should go to generate_playlist_filter_spec
+    """
+    if not INTENT_PARSER_ENABLED:
+        return None
+    start = time.perf_counter()
+    spec = get_intent_vocabulary(db).parse(user_request)
+    _record(prompts=1, answered=int(spec is not None), fallbacks=int(spec is None), parse_seconds=time.perf_counter() - start)
+    if spec:
+        print("Filter spec (local):", spec)
+    return spec
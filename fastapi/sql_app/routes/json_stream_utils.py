@@ -0,0 +1,74 @@
+from typing import Optional
+import json
+
+class JSONObjectExtractor:
+    """
+    Incrementally find the first top-level JSON object in streamed model output.
+
+    feed() each text chunk as it arrives; it returns the object's text once the brace that opened
+    it closes (ignoring braces inside strings), so the caller can stop generation right there.
+    Anything before the opening brace (e.g. "JSON:" or a code fence) is skipped.
+    """
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self.text = None
+
+    @property
+    def complete(self) -> bool:
+        return self.text is not None
+
+    def feed(self, chunk: str) -> Optional[str]:
+        if self.complete:
+            return self.text
+        start = 0
+        for i, char in enumerate(chunk):
+            if not self._started:
+                if char != '{':
+                    continue
+                self._started = True
+                start = i
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[start:i + 1])
+                    self.text = ''.join(self._parts)
+                    return self.text
+        if self._started:
+            self._parts.append(chunk[start:])
+        return None
+
+    def parse(self) -> dict:
+        """
+        The completed object as a dict; raises ValueError if the stream ended before it closed
+        """
+        if not self.complete:
+            raise ValueError("JSON object did not close before the stream ended")
+        return json.loads(self.text, strict=False)
+
+def extract_json_object(text: str) -> Optional[dict]:
+    """
+    First complete top-level JSON object in a full (non-streamed) response, or None
+    """
+    extractor = JSONObjectExtractor()
+    extractor.feed(text or '')
+    if not extractor.complete:
+        return None
+    try:
+        return extractor.parse()
+    except ValueError:
+        return None
@@ -0,0 +1,21 @@
+import importlib
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that is only imported on first attribute access.
+
+    Keeps pandas, scikit-learn and anthropic out of the import path for cold starts,
+    health checks and --reload cycles; the first request that needs one pays the cost.
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = LazyModule('pandas')
+pairwise = LazyModule('sklearn.metrics.pairwise')
+anthropic = LazyModule('anthropic')
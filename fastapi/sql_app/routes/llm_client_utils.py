@@ -0,0 +1,405 @@
+from .json_stream_utils import JSONObjectExtractor, extract_json_object
+from .lazy_utils import anthropic
+from .metrics_utils import register_metrics
+from requests.adapters import HTTPAdapter
+from typing import Callable, Optional
+import json
+import logging
+import os
+import threading
+import time
+import httpx
+import requests
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_HOST = os.getenv('LLM_ENDPOINT')
+# Leave unset to use api.anthropic.com; point at the stub server (benchmarks/llm_stub_server.py) in development
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL') or None
+ANTHROPIC_MAX_RETRIES = int(os.getenv('ANTHROPIC_MAX_RETRIES', 2))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 60))
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv('OLLAMA_TIMEOUT_SECONDS', 120))
+LLM_POOL_SIZE = int(os.getenv('LLM_POOL_SIZE', 20))
+# Calls in flight per backend per process; further callers wait (up to their deadline) for a slot
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv('ANTHROPIC_MAX_CONCURRENCY', 8))
+OLLAMA_MAX_CONCURRENCY = int(os.getenv('OLLAMA_MAX_CONCURRENCY', 2))
+# Extensions of a truncated Ollama JSON generation before giving up
+OLLAMA_MAX_CONTINUATIONS = int(os.getenv('OLLAMA_MAX_CONTINUATIONS', 3))
+# Our specs are flat, pretty-printed objects, so a brace at the start of a line closes the top level
+OLLAMA_JSON_STOP = ('\n}',)
+# How long Ollama keeps the model loaded after a request, so the next call does not wait for a reload
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+BACKENDS = ('anthropic', 'ollama')
+
+class LLMTimeoutError(TimeoutError):
+    """
+    The call's deadline passed, either waiting for a backend slot or waiting for the response
+    """
+
+class LLMResult:
+    def __init__(self, text: str, backend: str, model: str, latency: float, input_tokens: int = 0, output_tokens: int = 0, raw: dict = None):
+        self.text = text
+        self.backend = backend
+        self.model = model
+        self.latency = latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.raw = raw or {}
+        self.stopped_early = False
+        # output_tokens was counted from a stream closed early rather than reported by the backend
+        self.output_tokens_partial = False
+        self.continuations = 0
+        # Input tokens served from a provider prompt cache / written to it (input_tokens excludes both)
+        self.cached_input_tokens = 0
+        self.cache_write_input_tokens = 0
+
+    def parsed(self) -> Optional[dict]:
+        """
+        The first JSON object in the text, or None if there isn't a complete one
+        """
+        return extract_json_object(self.text)
+
+class _BackendLimiter:
+    """
+    Per-backend concurrency limit: a thread semaphore sized to the backend's limit
+    """
+    def __init__(self, limit: int):
+        self.limit = max(limit, 1)
+        self._semaphore = threading.BoundedSemaphore(self.limit)
+
+    def acquire(self, timeout: Optional[float]) -> bool:
+        return self._semaphore.acquire(timeout=timeout)
+
+    def release(self):
+        self._semaphore.release()
+
+_limiters = {'anthropic': _BackendLimiter(ANTHROPIC_MAX_CONCURRENCY), 'ollama': _BackendLimiter(OLLAMA_MAX_CONCURRENCY)}
+
+_anthropic_client = None
+_ollama_session = None
+_client_lock = threading.Lock()
+
+_stats = {backend: {'calls': 0, 'errors': 0, 'timeouts': 0, 'in_flight': 0, 'latency_seconds': 0.0, 'max_latency_seconds': 0.0,
+                    'queue_wait_seconds': 0.0, 'input_tokens': 0, 'output_tokens': 0,
+                    'cached_input_tokens': 0, 'cache_write_input_tokens': 0,
+                    'streams': 0, 'streams_stopped_early': 0, 'estimated_output_tokens': 0, 'continuations': 0} for backend in BACKENDS}
+_stats_lock = threading.Lock()
+
+def _record(backend: str, **values):
+    with _stats_lock:
+        stats = _stats[backend]
+        for name, value in values.items():
+            if name == 'max_latency_seconds':
+                stats[name] = max(stats[name], value)
+            else:
+                stats[name] += value
+
+def get_llm_stats() -> dict:
+    with _stats_lock:
+        stats = {backend: dict(values) for backend, values in _stats.items()}
+    for values in stats.values():
+        succeeded = values['calls'] - values['errors'] - values['timeouts'] - values['in_flight']
+        values['mean_latency_seconds'] = values['latency_seconds'] / succeeded if succeeded > 0 else None
+    return stats
+
+register_metrics('llm', get_llm_stats)
+
+def get_anthropic_client():
+    """
+    Process-wide anthropic.Anthropic client, so every call reuses its pooled keep-alive connections
+    (the SDK manages its own connection pool; LLM_POOL_SIZE applies to the Ollama session)
+    """
+    global _anthropic_client
+    if _anthropic_client is None:
+        with _client_lock:
+            if _anthropic_client is None:
+                # Retries are ours (_send_anthropic): the SDK would resend with the full timeout and overrun the deadline
+                _anthropic_client = anthropic.Anthropic(
+                    api_key=os.getenv('ANTHROPIC_API_KEY'), base_url=ANTHROPIC_BASE_URL, max_retries=0, timeout=LLM_TIMEOUT_SECONDS)
+    return _anthropic_client
+
+def get_ollama_session() -> requests.Session:
+    global _ollama_session
+    if _ollama_session is None:
+        with _client_lock:
+            if _ollama_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=LLM_POOL_SIZE, pool_maxsize=LLM_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _ollama_session = session
+    return _ollama_session
+
+def close_llm_clients():
+    global _anthropic_client, _ollama_session
+    with _client_lock:
+        if _anthropic_client is not None:
+            _anthropic_client.close()
+            _anthropic_client = None
+        if _ollama_session is not None:
+            _ollama_session.close()
+            _ollama_session = None
+
+def _resolve_deadline(backend: str, timeout: Optional[float], deadline: Optional[float]) -> float:
+    if deadline is None:
+        if timeout is None:
+            timeout = LLM_TIMEOUT_SECONDS if backend == 'anthropic' else OLLAMA_TIMEOUT_SECONDS
+        deadline = time.monotonic() + timeout
+    return deadline
+
+def _remaining(backend: str, deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        _record(backend, timeouts=1)
+        raise LLMTimeoutError(f"{backend} call exceeded its deadline")
+    return remaining
+
+def _send_anthropic(deadline: float, send: Callable[[float], object]):
+    """
+    send(timeout) with up to ANTHROPIC_MAX_RETRIES retries of 429, 5xx (including 529 overloaded) and connection errors, each
+    backoff (or Retry-After) only taken while it still fits before the deadline. A timed-out request
+    is not retried: the next attempt could only get what is left of the same deadline.
+    """
+    for attempt in range(ANTHROPIC_MAX_RETRIES + 1):
+        try:
+            return send(_remaining('anthropic', deadline))
+        except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+            status = getattr(e, 'status_code', None)
+            if isinstance(e, anthropic.APITimeoutError) or (status is not None and status != 429 and status < 500) or attempt == ANTHROPIC_MAX_RETRIES:
+                raise
+            retry_after = status is not None and e.response.headers.get('retry-after')
+            backoff = float(retry_after) if retry_after and retry_after.isdigit() else min(0.5 * 2 ** attempt, 8.0)
+            if time.monotonic() + backoff >= deadline:
+                raise
+            time.sleep(backoff)
+
+def _anthropic_request(prompt: str, model: str, max_tokens: int, options: dict, cache_prefix: str = None) -> dict:
+    request = {'model': model, 'max_tokens': max_tokens, 'messages': [{'role': 'user', 'content': prompt}]}
+    if cache_prefix:
+        # The static instructions go in a cached system block; only the user message is processed fresh
+        request['system'] = [{'type': 'text', 'text': cache_prefix, 'cache_control': {'type': 'ephemeral'}}]
+    request.update(options)
+    return request
+
+def _with_anthropic_usage(result: LLMResult, usage) -> LLMResult:
+    result.cached_input_tokens = getattr(usage, 'cache_read_input_tokens', None) or 0
+    result.cache_write_input_tokens = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    return result
+
+def _anthropic_result(response, model: str, latency: float) -> LLMResult:
+    text = ''.join(block.text for block in response.content if getattr(block, 'type', 'text') == 'text')
+    usage = response.usage
+    return _with_anthropic_usage(LLMResult(text, 'anthropic', model, latency, usage.input_tokens, usage.output_tokens), usage)
+
+def _ollama_payload(prompt: str, model: str, max_tokens: int, options: dict) -> dict:
+    payload = {'model': model, 'prompt': prompt, 'stream': False, 'keep_alive': OLLAMA_KEEP_ALIVE, 'options': {'num_predict': int(max_tokens)}}
+    payload['options'].update(options.pop('options', {}))
+    payload.update(options)
+    return payload
+
+def _ollama_result(body: dict, model: str, latency: float) -> LLMResult:
+    return LLMResult(body.get('response', ''), 'ollama', model, latency, body.get('prompt_eval_count', 0), body.get('eval_count', 0), body)
+
+def _is_timeout(error: Exception) -> bool:
+    return isinstance(error, (requests.Timeout, httpx.TimeoutException, anthropic.APITimeoutError))
+
+def _default_model(backend: str, model: Optional[str]) -> str:
+    return model or ('claude-haiku-4-5' if backend == 'anthropic' else 'llama2:7b')
+
+def _run(backend: str, deadline: float, call: Callable[[float], LLMResult]) -> LLMResult:
+    """
+    Run call(start) inside a backend slot, translating timeouts and recording metrics
+    """
+    limiter = _limiters[backend]
+    queued_at = time.monotonic()
+    _record(backend, calls=1)
+    if not limiter.acquire(_remaining(backend, deadline)):
+        _record(backend, timeouts=1)
+        raise LLMTimeoutError(f"Timed out waiting for a {backend} slot")
+    start = time.monotonic()
+    _record(backend, in_flight=1, queue_wait_seconds=start - queued_at)
+    try:
+        result = call(start)
+    except LLMTimeoutError:
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            _record(backend, timeouts=1)
+            raise LLMTimeoutError(f"{backend} call exceeded its deadline") from e
+        _record(backend, errors=1)
+        raise
+    finally:
+        _record(backend, in_flight=-1)
+        limiter.release()
+    _record(backend, latency_seconds=result.latency, max_latency_seconds=result.latency,
+            input_tokens=result.input_tokens, output_tokens=result.output_tokens,
+            cached_input_tokens=result.cached_input_tokens, cache_write_input_tokens=result.cache_write_input_tokens)
+    return result
+
+def complete(prompt: str, backend: str = 'anthropic', model: str = None, max_tokens: int = 1024, timeout: float = None,
+             deadline: float = None, cache_prefix: str = None, **options) -> LLMResult:
+    """
+    Run one completion on a pooled client, blocking the calling thread.
+
+    backend is 'anthropic' or 'ollama'. deadline is a time.monotonic() timestamp covering both the wait
+    for a backend slot and the request itself (timeout is the relative form). cache_prefix is static
+    text that precedes prompt and is the same across calls: it is sent as a cache_control system block
+    to Anthropic and simply prepended to the prompt for Ollama. Extra keyword arguments go into the
+    request body. Raises LLMTimeoutError when the deadline passes; other backend errors propagate.
+    """
+    model = _default_model(backend, model)
+    deadline = _resolve_deadline(backend, timeout, deadline)
+
+    def call(start: float) -> LLMResult:
+        if backend == 'anthropic':
+            request = _anthropic_request(prompt, model, max_tokens, options, cache_prefix)
+            response = _send_anthropic(deadline, lambda timeout: get_anthropic_client().messages.create(**request, timeout=timeout))
+            return _anthropic_result(response, model, time.monotonic() - start)
+        payload = _ollama_payload((cache_prefix or '') + prompt, model, max_tokens, options)
+        response = get_ollama_session().post(f"{OLLAMA_HOST}/api/generate", json=payload, timeout=(LLM_CONNECT_TIMEOUT, _remaining(backend, deadline)))
+        response.raise_for_status()
+        return _ollama_result(response.json(), model, time.monotonic() - start)
+
+    return _run(backend, deadline, call)
+
+class _EnteredStream:
+    """
+    A messages.stream() manager already entered, so sending the request can sit inside the retry loop
+    """
+    def __init__(self, manager):
+        self._manager = manager
+        self._stream = manager.__enter__()
+
+    def __enter__(self):
+        return self._stream
+
+    def __exit__(self, *exc_info):
+        return self._manager.__exit__(*exc_info)
+
+def _streamed_result(extractor: JSONObjectExtractor, text: str, backend: str, model: str, start: float,
+                     input_tokens: int, output_tokens: int, raw: dict = None, received_chunks: int = 0) -> LLMResult:
+    """
+    When the stream was closed early the backend never sends its final usage, so output_tokens is at
+    least the number of text chunks received (one token each on Ollama, one or more on Anthropic) and
+    output_tokens_partial is set: the figure is a lower bound, not the backend's count.
+    """
+    result = LLMResult(extractor.text or text, backend, model, time.monotonic() - start, input_tokens, output_tokens, raw)
+    result.stopped_early = extractor.complete and not result.raw.get('done', False)
+    if result.stopped_early:
+        result.output_tokens = max(output_tokens, received_chunks)
+        result.output_tokens_partial = True
+    # The share of output_tokens that was counted locally rather than reported
+    _record(backend, streams=1, streams_stopped_early=int(result.stopped_early),
+            estimated_output_tokens=result.output_tokens if result.stopped_early else 0)
+    return result
+
+def stream_json(prompt: str, backend: str = 'anthropic', model: str = None, max_tokens: int = 1024, timeout: float = None,
+                deadline: float = None, cache_prefix: str = None, **options) -> LLMResult:
+    """
+    Stream a completion and stop as soon as the first top-level JSON object closes.
+
+    Closing the stream early ends generation on the backend, so trailing prose after the object is
+    never generated. result.text is the object's text (or everything received if it never closed);
+    use result.parsed() to get the dict. cache_prefix works as in complete().
+    """
+    model = _default_model(backend, model)
+    deadline = _resolve_deadline(backend, timeout, deadline)
+
+    def call(start: float) -> LLMResult:
+        extractor = JSONObjectExtractor()
+        received = []
+        if backend == 'anthropic':
+            request = _anthropic_request(prompt, model, max_tokens, options, cache_prefix)
+            # The request is sent when the stream is entered, so that is the part retried
+            with _send_anthropic(deadline, lambda timeout: _EnteredStream(get_anthropic_client().messages.stream(**request, timeout=timeout))) as stream:
+                for text in stream.text_stream:
+                    received.append(text)
+                    if extractor.feed(text) is not None:
+                        break
+                    _remaining(backend, deadline)
+                snapshot = stream.current_message_snapshot
+                done = snapshot.stop_reason is not None
+            return _with_anthropic_usage(_streamed_result(extractor, ''.join(received), backend, model, start, snapshot.usage.input_tokens,
+                                                          snapshot.usage.output_tokens, {'done': done, 'stop_reason': snapshot.stop_reason},
+                                                          received_chunks=len(received)), snapshot.usage)
+        payload = _ollama_payload((cache_prefix or '') + prompt, model, max_tokens, options)
+        payload['stream'] = True
+        text, body, output_tokens = _stream_ollama(payload, extractor, deadline)
+        return _streamed_result(extractor, text, backend, model, start, body.get('prompt_eval_count', 0), output_tokens, body)
+
+    return _run(backend, deadline, call)
+
+def _stream_ollama(payload: dict, extractor: JSONObjectExtractor, deadline: float):
+    """
+    Feed a streamed Ollama generation into extractor, hanging up once the object closes.
+
+    Returns the text received, the last chunk (the final one carries context and counts when the
+    generation ran to the end) and the number of tokens generated.
+    """
+    received = []
+    body = {}
+    chunks = 0
+    with get_ollama_session().post(f"{OLLAMA_HOST}/api/generate", json=payload, stream=True,
+                                   timeout=(LLM_CONNECT_TIMEOUT, _remaining('ollama', deadline))) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            body = json.loads(line)
+            chunks += 1
+            received.append(body.get('response', ''))
+            if extractor.feed(body.get('response', '')) is not None or body.get('done'):
+                break
+            _remaining('ollama', deadline)
+    # Each streamed Ollama chunk is one token, which is all we have if we hung up before the final counts
+    return ''.join(received), body, body.get('eval_count', chunks)
+
+def stream_ollama_json(prompt: str, model: str = None, max_tokens: int = 600, max_continuations: int = OLLAMA_MAX_CONTINUATIONS,
+                       stop: tuple = OLLAMA_JSON_STOP, timeout: float = None, deadline: float = None, cache_prefix: str = None, **options) -> LLMResult:
+    """
+    Stream a JSON answer from Ollama, extending a truncated generation instead of restarting it.
+
+    When the token budget runs out before the object closes, the next request passes the returned
+    context back in raw mode so the model carries on from where it stopped, up to max_continuations
+    times. The stop sequences end generation on the closing brace of a top-level object; Ollama
+    strips the matched sequence, so it is fed back to the extractor. result.continuations says how
+    many extensions were needed.
+    """
+    backend = 'ollama'
+    model = _default_model(backend, model)
+    deadline = _resolve_deadline(backend, timeout, deadline)
+
+    def call(start: float) -> LLMResult:
+        extractor = JSONObjectExtractor()
+        payload = _ollama_payload((cache_prefix or '') + prompt, model, max_tokens, options)
+        payload['stream'] = True
+        if stop:
+            payload['options']['stop'] = list(stop)
+        received = []
+        input_tokens = output_tokens = continuations = 0
+        while True:
+            text, body, generated = _stream_ollama(payload, extractor, deadline)
+            received.append(text)
+            input_tokens += body.get('prompt_eval_count', 0)
+            output_tokens += generated
+            if extractor.complete or not body.get('done'):
+                break
+            if body.get('done_reason') != 'length':
+                # Stopped on a stop sequence (or the model ended): restore the stripped closing brace
+                for sequence in stop or ():
+                    if extractor.feed(sequence) is not None:
+                        received.append(sequence)
+                        break
+                break
+            if continuations >= max_continuations or not body.get('context'):
+                break
+            continuations += 1
+            payload = dict(payload, prompt='', raw=True, context=body['context'])
+        result = _streamed_result(extractor, ''.join(received), backend, model, start, input_tokens, output_tokens, body)
+        result.continuations = continuations
+        _record(backend, continuations=continuations)
+        return result
+
+    return _run(backend, deadline, call)
@@ -1,62 +1,50 @@
 from .. import crud
+from .catalog_utils import get_catalog_snapshot
 from fastapi import HTTPException
-import time
-import re
 import json
 import requests
 import numpy as np
-import pandas as pd
-import os
+from functools import lru_cache
 from typing import List, Optional
 from sqlalchemy.orm import Session
-import anthropic
+from .lazy_utils import pd
+from .llm_client_utils import complete, stream_json, stream_ollama_json
+from .predicate_utils import ColumnarTrackStore, parse_condition_string
 
-OLLAMA_HOST = os.getenv('LLM_ENDPOINT')
+def test_llm(prompt, model="llama2:7b", initial_max_tokens=600, timeout=None, continuation=True):
+    """Test the LLM with adaptive token limits and retry logic
 
-def test_llm(prompt, model="llama2:7b", initial_max_tokens=600):
-    """Test the LLM with adaptive token limits and retry logic"""
+    With continuation (the default) a truncated answer is extended from Ollama's returned context
+    rather than regenerated; otherwise each retry starts over with a larger token budget.
+    """
     
-    max_attempts = 3
     token_increments = [initial_max_tokens, initial_max_tokens * 1.5, initial_max_tokens * 2, initial_max_tokens * 3]
     
     for attempt, max_tokens in enumerate(token_increments):
-        url = f"{OLLAMA_HOST}/api/generate"
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "num_predict": int(max_tokens),
-                "temperature": 0.7,
-                # "stop": ["}"]  # Stop after JSON closes
-            }
-        }
-        
         try:
-            start_time = time.time()
-            response = requests.post(url, json=payload, timeout=120)  # Increased timeout
-            end_time = time.time()
+            # Streamed: generation stops as soon as the JSON object closes, so a budget only runs out on a truly long answer
+            if continuation:
+                result = stream_ollama_json(prompt, model=model, max_tokens=initial_max_tokens, timeout=timeout, options={"temperature": 0.7})
+            else:
+                result = stream_json(prompt, backend='ollama', model=model, max_tokens=max_tokens, timeout=timeout, options={"temperature": 0.7})
+            response_text = result.text
             
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result['response']
-                
-                print(f"⏱️ Response time: {end_time - start_time:.2f}s (tokens: {max_tokens})")
-                
-                # Check if response looks complete
-                if response_text.strip().endswith('}'):
-                    print(f"✅ Complete response received")
-                    return response_text
-                elif attempt < len(token_increments) - 1:
-                    print(f"⚠️ Response may be truncated, retrying with more tokens...")
-                    continue
-                else:
-                    print(f"⚠️ Response may be truncated but using anyway")
-                    return response_text
+            print(f"⏱️ Response time: {result.latency:.2f}s (tokens: {result.output_tokens}, continuations: {result.continuations})")
+            
+            # Check if response looks complete
+            if result.parsed() is not None:
+                print(f"✅ Complete response received")
+                return response_text
+            elif not continuation and attempt < len(token_increments) - 1:
+                print(f"⚠️ Response may be truncated, retrying with more tokens...")
+                continue
             else:
-                print(f"❌ Error {response.status_code}: {response.text}")
-                return None
-                
+                print(f"⚠️ Response may be truncated but using anyway")
+                return response_text
+        
+        except requests.HTTPError as e:
+            print(f"❌ Error {e.response.status_code}: {e.response.text}")
+            return None
         except Exception as e:
             print(f"❌ Error (attempt {attempt + 1}): {e}")
             if attempt < len(token_increments) - 1:
@@ -66,26 +54,31 @@ def test_llm(prompt, model="llama2:7b", initial_max_tokens=600):
     
     return None
 
-def test_llm_claude(prompt, model="claude-haiku-4-5"):
-    client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+def test_llm_claude(prompt, model="claude-haiku-4-5", timeout=None):
     try:
-        start_time = time.time()
-        response = client.messages.create(
-            model=model,
-            max_tokens=1024,
-            messages=[
-                {"role": "user", "content": f"{prompt}"}
-            ]
-        )
-        end_time = time.time()
-        # return json.loads(response.content[0].text, strict=False)
-        return response.content[0].text
+        result = complete(prompt, backend='anthropic', model=model, max_tokens=1024, timeout=timeout)
+        return result.text
             
     except Exception as e:
         print(f"❌ Error): {e}")
         return None
-    
-    return None
+
+def test_llm_claude_json(prompt, model="claude-haiku-4-5", timeout=None, cache_prefix=None) -> dict:
+    """
+    Stream a Claude completion and return its JSON object as soon as it closes ({} on failure).
+    cache_prefix is the static part of the prompt, sent as a cached system block.
+    """
+    try:
+        result = stream_json(prompt, backend='anthropic', model=model, max_tokens=1024, timeout=timeout, cache_prefix=cache_prefix)
+    except Exception as e:
+        print(f"❌ Error): {e}")
+        return {}
+    spec = result.parsed()
+    if spec is None:
+        print('No JSON object returned')
+        print(result.text)
+        return {}
+    return spec
 
 def get_all_tracks(db: Session, genres: List[str] = [], limit: int = None):
     db_tracks = crud.get_all_tracks_new(db, genres=genres)
@@ -160,171 +153,39 @@ def derive_mood_from_features(row):
         return 'unknown'
 
 def parse_condition(df, condition):
-    """Parse a single WHERE condition more precisely"""
-    condition = condition.strip()
-    
-    # Handle different condition types
-    if " IN (" in condition.upper():
-        # Extract column name and values for IN conditions
-        match = re.match(r'(\w+)\s+IN\s*\(\s*(.+?)\s*\)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            values_str = match.group(2)
-            # Extract quoted values
-            values = re.findall(r"'([^']*)'", values_str)
-            return 'IN', column, values
-    
-    elif " BETWEEN " in condition.upper():
-        # Handle BETWEEN conditions
-        # match = re.match(r'(\w+)\s+BETWEEN\s+(\d+)\s+AND\s+(\d+)', condition, re.IGNORECASE)
-        match = re.match(r'(\w+)\s+BETWEEN\s+([\d.]+)\s+AND\s+([\d.]+)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            min_val = float(match.group(2))
-            max_val = float(match.group(3))
-            return 'BETWEEN', column, (min_val, max_val)
-    
-    elif " > " in condition:
-        # Handle greater than conditions
-        match = re.match(r'(\w+)\s*>\s*([\d.]+)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            value = float(match.group(2))
-            return '>', column, value
-    
-    elif " < " in condition:
-        # Handle less than conditions
-        match = re.match(r'(\w+)\s*<\s*([\d.]+)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            value = float(match.group(2))
-            return '<', column, value
-    
-    elif " >= " in condition:
-        # Handle greater than or equal
-        match = re.match(r'(\w+)\s*>=\s*([\d.]+)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            value = float(match.group(2))
-            return '>=', column, value
-    
-    elif " <= " in condition:
-        # Handle less than or equal
-        match = re.match(r'(\w+)\s*<=\s*([\d.]+)', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            value = float(match.group(2))
-            return '<=', column, value
-    
-    elif " LIKE " in condition.upper() or " ILIKE " in condition.upper():
-        # Handle LIKE conditions
-        match = re.match(r'(\w+)\s+I?LIKE\s+\'([^\']+)\'', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            pattern = match.group(2)
-            return 'LIKE', column, pattern
-    
-    elif " = " in condition:
-        # Handle equality conditions
-        match = re.match(r'(\w+)\s*=\s*\'?([^\']+)\'?', condition, re.IGNORECASE)
-        if match:
-            column = match.group(1)
-            value = match.group(2)
-            # Try to convert to float if it's a number, otherwise keep as string
-            try:
-                value = float(value)
-            except ValueError:
-                pass
-            return '=', column, value
-    
-    return None, None, None
+    """Parse a single WHERE condition into (operator, column, value)"""
+    return parse_condition_string(condition)
 
 def query_songs_with_features(df, where_conditions=None, weigh_by_popularity=True, song_limit=50):
-    """Query songs using your actual feature set with better condition parsing"""
-    
-    df = df.copy()
-    
+    """Query songs using your actual feature set
+
+    All conditions are compiled into one boolean mask over the columns, so the frame is sliced
+    once, for the sampled rows only.
+    """
+    store = ColumnarTrackStore(df)
     if where_conditions:
         print(f"🔍 Applying filters: {where_conditions}")
-        
-        for condition in where_conditions:
-            try:
-                operator, column, value = parse_condition(df, condition)
-                
-                if operator is None:
-                    print(f"⚠️ Could not parse condition: '{condition}'")
-                    continue
-                
-                print(f"  Parsing: {column} {operator} {value}")
-                
-                # Map column names to DataFrame columns (case-insensitive)
-                column_mapping = {}
-                for col in df.columns:
-                    if col not in column_mapping:
-                        column_mapping[col.lower()] = col
-                
-                df_column = column_mapping.get(column.lower())
-                if df_column is None:
-                    print(f"⚠️ Column '{column}' not found in data")
-                    continue
-                
-                # Apply the filter based on operator
-                if operator == 'IN':
-                    df = df[df[df_column].isin(value)]
-                    print(f"    Filtered to {len(df)} songs where {df_column} in {value}")
-                
-                elif operator == 'BETWEEN':
-                    min_val, max_val = value
-                    df = df[(df[df_column] >= min_val) & (df[df_column] <= max_val)]
-                    print(f"    Filtered to {len(df)} songs where {df_column} between {min_val} and {max_val}")
-                
-                elif operator == '>':
-                    df = df[df[df_column] > value]
-                    print(f"    Filtered to {len(df)} songs where {df_column} > {value}")
-                
-                elif operator == '<':
-                    df = df[df[df_column] < value]
-                    print(f"    Filtered to {len(df)} songs where {df_column} < {value}")
-                
-                elif operator == '>=':
-                    df = df[df[df_column] >= value]
-                    print(f"    Filtered to {len(df)} songs where {df_column} >= {value}")
-                
-                elif operator == '<=':
-                    df = df[df[df_column] <= value]
-                    print(f"    Filtered to {len(df)} songs where {df_column} <= {value}")
-                
-                elif operator == 'LIKE':
-                    df = df[df[df_column].str.contains(value, case=False, na=False)]
-                    print(f"    Filtered to {len(df)} songs where {df_column} contains '{value}'")
+    positions = np.flatnonzero(store.mask(where_conditions))
 
-                elif operator == '=':
-                    df = df[df[df_column] == value]
-                    print(f"    Filtered to {len(df)} songs where {df_column} = {value}")
-                
-            except Exception as e:
-                print(f"⚠️ Error processing condition '{condition}': {e}")
-                continue
-    
-    # Sort by popularity if available
+    # Sample weighted by popularity if available
     if weigh_by_popularity:
         try:
-            weights = df['popularity'].values
+            weights = store.numeric(store.column('popularity'))[positions]
             min_weight = weights.min()
             if min_weight <= 0:
                 weights = weights - min_weight + 0.01
-            sampled_indices = np.random.choice(
-                            df.index, 
-                            size=min(song_limit, len(df)), 
-                            replace=False, 
+            positions = np.random.choice(
+                            positions,
+                            size=min(song_limit, len(positions)),
+                            replace=False,
                             p=weights / weights.sum()
                         )
-            result = df.loc[sampled_indices]
         except Exception as e:
             print('Error', e)
-            result = df.head(song_limit)
+            positions = positions[:song_limit]
     else:
-        result = df.head(song_limit)
+        positions = positions[:song_limit]
+    result = df.iloc[positions]
     print(f"✅ Final result: {len(result)} songs")
     return result
 
@@ -377,11 +238,8 @@ def generate_audio_descriptors_using_features(album_features, audio_features):
     "explanation": "reasoning about audio descriptors",
     }}
     '''
-    response = test_llm_claude(prompt, model="claude-sonnet-4-6")
-    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-    if json_match:
-        query_spec = json.loads(json_match.group(), strict=False)
-
+    query_spec = test_llm_claude_json(prompt, model="claude-sonnet-4-6")
+    if query_spec:
         print("🤖 LLM Generated:")
         print(json.dumps(query_spec, indent=2))
 
@@ -405,35 +263,21 @@ AVAILABLE_INSTRUMENTALNESS_LEVELS = ['instrumental']
 YEAR_MIN = 1955
 YEAR_MAX = 2026
 
-_GENRE_HIERARCHY_CACHE: Optional[dict] = None
-
-
 def _get_genre_hierarchy(db: Session) -> dict:
-    global _GENRE_HIERARCHY_CACHE
-    if _GENRE_HIERARCHY_CACHE is not None:
-        return _GENRE_HIERARCHY_CACHE
-    rows = crud.get_unique_genres(db)
-    hierarchy: dict = {}
-    for genre, subgenre in rows:
-        if not genre:
-            continue
-        hierarchy.setdefault(genre, [])
-        if subgenre and subgenre not in hierarchy[genre]:
-            hierarchy[genre].append(subgenre)
-    _GENRE_HIERARCHY_CACHE = hierarchy
-    return hierarchy
+    return get_catalog_snapshot(db).genre_hierarchy
 
 
 def _format_genre_hierarchy(hierarchy: dict) -> str:
     return "\n".join(f"  {genre}: {', '.join(subs) if subs else '(no subgenres)'}" for genre, subs in hierarchy.items())
 
 
-def generate_playlist_filter_spec(user_request: str, db: Session) -> dict:
-    hierarchy = _get_genre_hierarchy(db)
-    hierarchy_text = _format_genre_hierarchy(hierarchy)
-    prompt = f"""You are a music curator. Given a user's playlist request, return a JSON filter spec using only the values listed below.
-
-User request: "{user_request}"
+@lru_cache(maxsize=4)
+def _filter_spec_static_prompt(hierarchy_text: str) -> str:
+    """
+    Everything in the filter-spec prompt except the request; identical across calls for a given
+    catalog, so it can be cached by the provider
+    """
+    return f"""You are a music curator. Given a user's playlist request, return a JSON filter spec using only the values listed below.
 
 AVAILABLE VALUES:
 - moods (album-level): {AVAILABLE_MOODS}
@@ -467,33 +311,24 @@ Return ONLY valid JSON:
   "explanation": "brief reasoning",
   "playlist_name": "short name"
 }}
-
-JSON:"""
-    response = test_llm_claude(prompt)
-    if not response:
-        return {}
-    try:
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            spec = json.loads(json_match.group(), strict=False)
-            print("Filter spec:", json.dumps(spec, indent=2))
-            return spec
-    except Exception as e:
-        print(f"Error parsing filter spec: {e}")
-    return {}
+"""
 
 
-def relax_playlist_filter_spec(user_request: str, prior_spec: dict, prior_count: int, db: Session) -> dict:
-    prior_filters = {k: v for k, v in prior_spec.items() if k not in ('explanation', 'playlist_name')}
+def generate_playlist_filter_spec(user_request: str, db: Session) -> dict:
     hierarchy = _get_genre_hierarchy(db)
     hierarchy_text = _format_genre_hierarchy(hierarchy)
+    prompt = f"""User request: "{user_request}"
 
-    prompt = f"""You previously generated a filter spec for a music playlist request, but it returned only {prior_count} candidate tracks — too few to build a good playlist. Return a broadened filter spec that stays true to the spirit of the original request.
+JSON:"""
+    spec = test_llm_claude_json(prompt, cache_prefix=_filter_spec_static_prompt(hierarchy_text))
+    if spec:
+        print("Filter spec:", json.dumps(spec, indent=2))
+    return spec
 
-User request: "{user_request}"
 
-Your previous filter spec (too narrow):
-{json.dumps(prior_filters, indent=2)}
+@lru_cache(maxsize=4)
+def _relax_static_prompt(hierarchy_text: str) -> str:
+    return f"""You broaden filter specs for music playlist requests whose previous spec returned too few candidate tracks to build a good playlist. Return a broadened filter spec that stays true to the spirit of the original request.
 
 AVAILABLE VALUES:
 - moods (album-level): {AVAILABLE_MOODS}
@@ -531,25 +366,34 @@ Return ONLY valid JSON in the same shape as before:
   "explanation": "what was relaxed and why",
   "playlist_name": "short name"
 }}
+"""
+
+
+def relax_playlist_filter_spec(user_request: str, prior_spec: dict, prior_count: int, db: Session) -> dict:
+    prior_filters = {k: v for k, v in prior_spec.items() if k not in ('explanation', 'playlist_name')}
+    hierarchy = _get_genre_hierarchy(db)
+    hierarchy_text = _format_genre_hierarchy(hierarchy)
+
+    prompt = f"""You previously generated a filter spec for a music playlist request, but it returned only {prior_count} candidate tracks.
+
+User request: "{user_request}"
+
+Your previous filter spec (too narrow):
+{json.dumps(prior_filters, indent=2)}
 
 JSON:"""
-    response = test_llm_claude(prompt)
-    if not response:
-        return {}
-    try:
-        json_match = re.search(r'\{.*\}', response, re.DOTALL)
-        if json_match:
-            spec = json.loads(json_match.group(), strict=False)
-            print("Relaxed filter spec:", json.dumps(spec, indent=2))
-            return spec
-    except Exception as e:
-        print(f"Error parsing relaxed filter spec: {e}")
-    return {}
+    spec = test_llm_claude_json(prompt, cache_prefix=_relax_static_prompt(hierarchy_text))
+    if spec:
+        print("Relaxed filter spec:", json.dumps(spec, indent=2))
+    return spec
 
 
 def generate_playlist_with_audio_features(user_request, df, weigh_by_popularity=True, song_limit=50):
-    """Generate playlist using your actual audio features"""
-    
+    """Generate playlist using your actual audio features
+
+    df is a track frame with tempo_mapped and derived_mood columns.
+    """
+
     # Build context from your actual data
     genre_counts = df['genre'].value_counts().head(15)
     subgenre_counts = df['subgenre'].value_counts().head(10)
@@ -611,41 +455,33 @@ Return ONLY valid JSON:
 
 Request: {user_request}
 JSON:"""
-    response = test_llm_claude(prompt)
+    query_spec = test_llm_claude_json(prompt)
     
-    if response:
+    if query_spec:
         try:
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                query_spec = json.loads(json_match.group(), strict=False)
-                
-                print("🤖 LLM Generated:")
-                print(json.dumps(query_spec, indent=2))
-                
-                # Apply to real data
-                where_conditions = query_spec.get('where_conditions', [])
-                explanation = query_spec.get('explanation', '')
-                playlist_name = query_spec.get('playlist name', '')
-                print('*******************Where Conditions')
-                results = query_songs_with_features(df, where_conditions, weigh_by_popularity=weigh_by_popularity, song_limit=song_limit)
-                
-                print(f"\n🎵 Playlist Results:")
-                for idx, row in results.iterrows():
-                    energy = f"E:{row.get('energy', 'N/A'):.2f}" if pd.notna(row.get('energy')) else "E:N/A"
-                    valence = f"V:{row.get('valence', 'N/A'):.2f}" if pd.notna(row.get('valence')) else "V:N/A"
-                    danceability = f"D:{row.get('danceability', 'N/A'):.2f}" if pd.notna(row.get('danceability')) else "D:N/A"
-                    instrumentalness = f"I:{row.get('instrumentalness', 'N/A'):.2f}" if pd.notna(row.get('instrumentalness')) else "I:N/A"
-                    tempo = f"T:{row.get('tempo_mapped', 'N/A'):.0f}" if pd.notna(row.get('tempo_mapped')) else "T:N/A"
-                    
-                    print(f"  {row['artist']} - {row.get('track_name', 'Unknown Track Name')} ({row['genre']}) [{energy}, {valence}, {tempo}, {danceability}, {instrumentalness}]")
-                return results, explanation, playlist_name,where_conditions, prompt
-            else:
-                print('No JSON match returned')
-                print(response)
+            print("🤖 LLM Generated:")
+            print(json.dumps(query_spec, indent=2))
+            
+            # Apply to real data
+            where_conditions = query_spec.get('where_conditions', [])
+            explanation = query_spec.get('explanation', '')
+            playlist_name = query_spec.get('playlist name', '')
+            print('*******************Where Conditions')
+            results = query_songs_with_features(df, where_conditions, weigh_by_popularity=weigh_by_popularity, song_limit=song_limit)
+            
+            print(f"\n🎵 Playlist Results:")
+            for idx, row in results.iterrows():
+                energy = f"E:{row.get('energy', 'N/A'):.2f}" if pd.notna(row.get('energy')) else "E:N/A"
+                valence = f"V:{row.get('valence', 'N/A'):.2f}" if pd.notna(row.get('valence')) else "V:N/A"
+                danceability = f"D:{row.get('danceability', 'N/A'):.2f}" if pd.notna(row.get('danceability')) else "D:N/A"
+                instrumentalness = f"I:{row.get('instrumentalness', 'N/A'):.2f}" if pd.notna(row.get('instrumentalness')) else "I:N/A"
+                tempo = f"T:{row.get('tempo_mapped', 'N/A'):.0f}" if pd.notna(row.get('tempo_mapped')) else "T:N/A"
                 
+                print(f"  {row['artist']} - {row.get('track_name', 'Unknown Track Name')} ({row['genre']}) [{energy}, {valence}, {tempo}, {danceability}, {instrumentalness}]")
+            return results, explanation, playlist_name,where_conditions, prompt
         except Exception as e:
             print(f"❌ Error processing LLM response: {e}")
-            print("Raw response:", response)
+            print("Raw response:", query_spec)
     else:
         print('No response returned.')
     
@@ -0,0 +1,17 @@
+from typing import Callable
+import threading
+
+_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+def register_metrics(name: str, provider: Callable[[], dict]):
+    """
+    Register a function returning a section of in-process counters for /web/get_metrics/
+    """
+    with _PROVIDERS_LOCK:
+        _PROVIDERS[name] = provider
+
+def collect_metrics() -> dict:
+    with _PROVIDERS_LOCK:
+        providers = dict(_PROVIDERS)
+    return {name: provider() for name, provider in providers.items()}
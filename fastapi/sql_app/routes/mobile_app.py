@@ -1,43 +1,37 @@
 from ..database import get_db
 from .. import crud, models, schemas
-from fastapi import Depends, FastAPI, HTTPException, Query, APIRouter
+from fastapi import Depends, FastAPI, HTTPException, Query, APIRouter, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 from ._utils import verify_api_key, _get_apple_music_auth_header, pull_relevant_albums, unpack_albums_new, return_tracks_new, normalize_weights
+from .accolade_utils import get_accolade_index
+from .catalog_utils import get_catalog_snapshot
+from .coalesce_utils import get_single_flight, filter_key
+from .facet_index_utils import get_tracks_by_filter_spec
+from .intent_utils import parse_playlist_intent
+from .descriptor_utils import get_audio_feature_baselines, get_album_features
+from .http_cache_utils import conditional_response
+from .playlist_utils import get_cached_filter_spec, cache_filter_spec, relax_filter_spec, record_llm_relaxation
 from .llm_utils import test_llm, get_all_tracks, normalize_tempo_column, query_songs_with_features, derive_mood_from_features, generate_playlist_with_audio_features, generate_audio_descriptors_using_features, generate_playlist_filter_spec, relax_playlist_filter_spec
 import numpy as np
-import pandas as pd
+from .lazy_utils import pd
 import json
 
 router = APIRouter(prefix="/app", tags=["Mobile App"])
 
+# Identical concurrent requests (e.g. the home screen loading for many users) share one query
+_relevant_albums_flight = get_single_flight('app_get_relevant_albums')
+_similar_albums_flight = get_single_flight('app_get_similar_albums')
+
 @router.get("/genres/", response_model=schemas.GenresList)
-def get_distinct_genres(db: Session = Depends(get_db)):
-    db_genre = crud.get_unique_genres(db)
-    x = {'genres': []}
-    for i in db_genre:
-        genre = i[0]
-        subgenre = i[1]
-        genre_not_present = True
-        for value in x['genres']:
-            if value['name'] == genre:
-                if subgenre in value['subgenres']:
-                    pass
-                else:
-                    value['subgenres'].append(subgenre)
-                genre_not_present = False
-                continue
-        if genre_not_present:
-            x['genres'].append({'name': genre, 'subgenres': [subgenre]})
-    return x
+def get_distinct_genres(request: Request, response: Response, db: Session = Depends(get_db)):
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or snapshot.app_genres
 
 @router.get("/artists/", response_model=schemas.ArtistsList)
-def get_distinct_artists(db: Session = Depends(get_db)):
-    db_artist = crud.get_artist_name_ids(db)
-    x = {'artists': []}
-    for i in db_artist:
-        x['artists'].append({'name': i.artist_name, 'id': i.artist_id})
-    return x
+def get_distinct_artists(request: Request, response: Response, db: Session = Depends(get_db)):
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or snapshot.app_artists
 
 @router.get("/artist_id_from_artist_name/", response_model=schemas.ArtistsList)
 def get_artist_id_from_artist_name(artist_name: str, db: Session = Depends(get_db)):
@@ -50,7 +44,9 @@ def get_artist_id_from_artist_name(artist_name: str, db: Session = Depends(get_d
     return x
 
 @router.get("/get_relevant_albums/", response_model=schemas.AlbumsList)
-def get_relevant_albums(min_year: int, 
+def get_relevant_albums(request: Request,
+                        response: Response,
+                        min_year: int, 
                         max_year: int, 
                         genre: List[str] = Query([None]), 
                         subgenre: List[str] = Query([None]), 
@@ -68,32 +64,42 @@ def get_relevant_albums(min_year: int,
 
     Returned in list format, used for Flutterflow
     """
-    if order_by_recency:
-        sort_by_column = 'album_key'
-    else:
-        sort_by_column = 'weighted_rank'
-    x = pull_relevant_albums(db=db, 
-                             min_year=min_year,
-                             max_year=max_year, 
-                             genre=genre, 
-                             subgenre=subgenre, 
-                             publication=publication, 
-                             list=list,
-                             mood=mood,
-                             points_weight=points_weight,
-                             album_uri_required=False,
-                             sort_by_column=sort_by_column,
-                             album_limit=album_limit
-                             )
-    new_dict = []
-    if order_by_recency:
-        for value in sorted(x['albums'].items(), key=lambda x: x[1]['album_key'], reverse=True)[:album_limit]:
-            new_dict.append(value[1])
-    else:
-        for value in sorted(x['albums'].items(), key=lambda x: x[1]['weighted_rank'], reverse=True)[:album_limit]:
-            new_dict.append(value[1])
-    x['albums'] = new_dict
-    return x
+    not_modified = conditional_response(request, response, get_catalog_snapshot(db))
+    if not_modified:
+        return not_modified
+    def compute():
+        if order_by_recency:
+            sort_by_column = 'album_key'
+        else:
+            sort_by_column = 'weighted_rank'
+        x = pull_relevant_albums(db=db, 
+                                 min_year=min_year,
+                                 max_year=max_year, 
+                                 genre=genre, 
+                                 subgenre=subgenre, 
+                                 publication=publication, 
+                                 list=list,
+                                 mood=mood,
+                                 points_weight=points_weight,
+                                 album_uri_required=False,
+                                 sort_by_column=sort_by_column,
+                                 album_limit=album_limit
+                                 )
+        new_dict = []
+        if order_by_recency:
+            for value in sorted(x['albums'].items(), key=lambda x: x[1]['album_key'], reverse=True)[:album_limit]:
+                new_dict.append(value[1])
+        else:
+            for value in sorted(x['albums'].items(), key=lambda x: x[1]['weighted_rank'], reverse=True)[:album_limit]:
+                new_dict.append(value[1])
+        x['albums'] = new_dict
+        return x
+
+    if randomize:
+        return compute()
+    key = (min_year, max_year, filter_key(genre), filter_key(subgenre), filter_key(publication), filter_key(list),
+           filter_key(mood), points_weight, order_by_recency, album_limit)
+    return _relevant_albums_flight.do(key, compute)
 
 @router.get("/get_similar_albums/", response_model=schemas.AlbumsList)
 def get_similar_albums(album_key: str,
@@ -102,28 +108,32 @@ def get_similar_albums(album_key: str,
                       num_results: int = 10,
                       skip_first_album: bool = True,
                       db: Session = Depends(get_db)):
-    x = {}
-    x['albums'] = []
-    results = crud.get_similar_albums(db=db, album_key=album_key, publication_weight=publication_weight, label_weight=label_weight, num_results=num_results)
-    if skip_first_album:
-        results = results[1:]
-    for value in results:
-        x['albums'].append({
-            'album_key': value.album_key,
-            'artist': value.artist,
-            'album': value.album,
-            'genre': value.genre,
-            'year': value.year,
-            'subgenre': value.subgenre,
-            'image_url': value.image_url,
-            'spotify_album_id': value.spotify_album_id,
-            'apple_music_album_id': value.apple_music_album_id,
-            'apple_music_url': value.apple_music_url,
-            'mood_distance': value.mood_distance,
-            'publication_distance': value.publication_distance,
-            'record_label_distance': value.record_label_distance
-        })
-    return x
+    def compute():
+        x = {}
+        x['albums'] = []
+        results = crud.get_similar_albums(db=db, album_key=album_key, publication_weight=publication_weight, label_weight=label_weight, num_results=num_results)
+        if skip_first_album:
+            results = results[1:]
+        for value in results:
+            x['albums'].append({
+                'album_key': value.album_key,
+                'artist': value.artist,
+                'album': value.album,
+                'genre': value.genre,
+                'year': value.year,
+                'subgenre': value.subgenre,
+                'image_url': value.image_url,
+                'spotify_album_id': value.spotify_album_id,
+                'apple_music_album_id': value.apple_music_album_id,
+                'apple_music_url': value.apple_music_url,
+                'mood_distance': value.mood_distance,
+                'publication_distance': value.publication_distance,
+                'record_label_distance': value.record_label_distance
+            })
+        return x
+
+    key = (album_key, publication_weight, label_weight, num_results, skip_first_album)
+    return _similar_albums_flight.do(key, compute)
 
 @router.get("/get_tracks_from_albums/", response_model=schemas.TracksList)
 def get_tracks_from_albums(album_keys: List[str] = Query(['']),
@@ -394,35 +404,19 @@ def get_artist_id_from_artist_name(artist_name: str, db: Session = Depends(get_d
     return x
 
 @router.get('/get_album_accolades/', response_model=schemas.AlbumsList)
-def get_album_accolades(album_id: str = Query(None),
+def get_album_accolades(request: Request,
+                        response: Response,
+                        album_id: str = Query(None),
                         n_accolades: int = 10,
                         db: Session = Depends(get_db),
                         exclude_accolades_only_one_point: bool = True):
     """
     Return a dictionary of album accolades given a single album URI
     """
-    db_albums = crud.get_album_accolades(db, album_id=album_id)
-    if db_albums is None:
-        raise HTTPException(status_code=404, detail="No albums that match criteria")
-    if len(db_albums) == 1:
-        exclude_accolades_only_one_point = False
-    x = {'albums': []}
-    for position, value in enumerate(db_albums):
-        new_value = {}
-        for feature in ['rank', 'points', 'publication', 'list']:
-            new_value[feature] = getattr(value, feature)
-        x['albums'].append(new_value)
-    new_dict = []
-    counting_value = 0
-    for value in sorted(x['albums'], key=lambda x: x['points'], reverse=True):
-        if exclude_accolades_only_one_point:
-            if value['points'] == 1:
-                continue
-        new_dict.append(value)
-        counting_value += 1
-        if counting_value >= n_accolades:
-            break
-    x['albums'] = new_dict
+    not_modified = conditional_response(request, response, get_catalog_snapshot(db))
+    if not_modified:
+        return not_modified
+    x = {'albums': get_accolade_index(db).lookup(album_id, n_accolades, exclude_accolades_only_one_point)}
     return x
 
 @router.get("/get_artists_from_search_string/", response_model=schemas.ArtistsList)
@@ -474,56 +468,53 @@ def get_album_info(album_id: str, db: Session = Depends(get_db)):
 
 @router.get("/get_descriptor_buckets_for_album/{album_id}", response_model=schemas.AudioDescription)
 def get_descriptor_buckets_for_album(album_id: str, db: Session = Depends(get_db)):
-    #Get Mean and Standard Deviation of Audio Features
-    db_audio_features = crud.get_mean_standard_deviation_of_audio_features(db)
-    if db_audio_features is None:
+    audio_features = get_audio_feature_baselines(db)
+    if audio_features is None:
         raise HTTPException(status_code=404, detail="No audio features found")
-    audio_features = {}
-    audio_features['danceability'] = db_audio_features[0][0]
-    audio_features['danceability_std'] = db_audio_features[0][1]
-    audio_features['energy'] = db_audio_features[0][2]
-    audio_features['energy_std'] = db_audio_features[0][3]
-    audio_features['instrumentalness'] = db_audio_features[0][4]
-    audio_features['instrumentalness_std'] = db_audio_features[0][5]
-    audio_features['valence'] = db_audio_features[0][6]
-    audio_features['valence_std'] = db_audio_features[0][7]
-    audio_features['tempo'] = db_audio_features[0][8]
-    audio_features['tempo_std'] = db_audio_features[0][9]
     #Get Descriptor Buckets for Album
     db_album = crud.get_album_info_new_albums_table(db=db, album_key=album_id)
-    if db_album is None:
+    if not db_album:
         raise HTTPException(status_code=404, detail="Album not found")
-    album_features = {}
-    album_features['danceability'] = db_album[0].spotify_danceability_clean
-    album_features['energy'] = db_album[0].spotify_energy_clean
-    album_features['instrumentalness'] = db_album[0].spotify_instrumentalness_clean
-    album_features['valence'] = db_album[0].spotify_valence_clean
-    album_features['tempo'] = db_album[0].spotify_tempo_clean
-    album_features['genre'] = db_album[0].genre
-    album_features['subgenre'] = db_album[0].subgenre
-    album_features['apple_music_editorial_notes_short'] = db_album[0].apple_music_editorial_notes_short
-    album_features['apple_music_editorial_notes_standard'] = db_album[0].apple_music_editorial_notes_standard
+    album_features = get_album_features(db_album[0])
     audio_descriptors, explanation = generate_audio_descriptors_using_features(album_features, audio_features)
     print('RESPONSE FROM LLM', audio_descriptors, explanation)
     return {'album_id': album_id, 'audio_descriptors': audio_descriptors, 'explanation': explanation}
 
 @router.get("/create_playlist_from_user_prompt/", response_model=schemas.TracksLLMResponse)
 def create_playlist_from_user_prompt(user_request: str, weigh_by_popularity: bool = True, song_limit: int = 50, debug: bool = False, db: Session = Depends(get_db)):
-    filter_spec = generate_playlist_filter_spec(user_request, db)
-    if not filter_spec:
-        raise HTTPException(status_code=500, detail="Failed to generate filter spec from prompt")
-
-    db_tracks = crud.get_tracks_by_filter_spec(db, filter_spec, song_limit=song_limit * 4)
-    print('NUM OF RETURNED SONGS', len(db_tracks))
-
-    if len(db_tracks) < song_limit:
-        relaxed_spec = relax_playlist_filter_spec(user_request, filter_spec, len(db_tracks), db)
-        if relaxed_spec:
-            relaxed_tracks = crud.get_tracks_by_filter_spec(db, relaxed_spec, song_limit=song_limit * 4)
-            print('NUM OF RETURNED SONGS AFTER RELAX', len(relaxed_tracks))
-            if len(relaxed_tracks) > len(db_tracks):
-                filter_spec = relaxed_spec
-                db_tracks = relaxed_tracks
+    filter_spec = get_cached_filter_spec(user_request, song_limit, db)
+    if filter_spec:
+        # Repeat prompt: reuse the final (already relaxed) spec and skip the LLM entirely
+        db_tracks = get_tracks_by_filter_spec(db, filter_spec, song_limit=song_limit * 4)
+    else:
+        # Simple prompts (a genre, a decade, a mood word) are parsed locally; the rest go to the LLM
+        filter_spec = parse_playlist_intent(user_request, db) or generate_playlist_filter_spec(user_request, db)
+        if not filter_spec:
+            raise HTTPException(status_code=500, detail="Failed to generate filter spec from prompt")
+
+        db_tracks = get_tracks_by_filter_spec(db, filter_spec, song_limit=song_limit * 4)
+        print('NUM OF RETURNED SONGS', len(db_tracks))
+
+        relaxed = False
+        if len(db_tracks) < song_limit:
+            relaxed = True
+            # Relax locally from facet counts first; the LLM is only asked when that still comes up short
+            local_spec, local_count, steps = relax_filter_spec(user_request, filter_spec, song_limit, db)
+            if steps and local_count > len(db_tracks):
+                filter_spec = local_spec
+                db_tracks = get_tracks_by_filter_spec(db, filter_spec, song_limit=song_limit * 4)
+                print('NUM OF RETURNED SONGS AFTER LOCAL RELAX', len(db_tracks))
+            if len(db_tracks) < song_limit:
+                record_llm_relaxation()
+                relaxed_spec = relax_playlist_filter_spec(user_request, filter_spec, len(db_tracks), db)
+                if relaxed_spec:
+                    relaxed_tracks = get_tracks_by_filter_spec(db, relaxed_spec, song_limit=song_limit * 4)
+                    print('NUM OF RETURNED SONGS AFTER RELAX', len(relaxed_tracks))
+                    if len(relaxed_tracks) > len(db_tracks):
+                        filter_spec = relaxed_spec
+                        db_tracks = relaxed_tracks
+        if db_tracks:
+            cache_filter_spec(user_request, filter_spec, len(db_tracks), relaxed, db)
 
     if not db_tracks:
         raise HTTPException(status_code=404, detail="No tracks found, please try again with a different request")
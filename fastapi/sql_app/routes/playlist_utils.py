@@ -0,0 +1,213 @@
+from sqlalchemy.orm import Session
+from typing import Optional
+from .cache_utils import get_cache
+from .catalog_utils import get_catalog_snapshot
+from .facet_index_utils import count_tracks_for_filter_specs
+from .llm_utils import YEAR_MIN, YEAR_MAX
+from .metrics_utils import register_metrics
+import copy
+import os
+import re
+import threading
+
+FILTER_SPEC_CACHE_MAX_SIZE = int(os.getenv('FILTER_SPEC_CACHE_MAX_SIZE', 2048))
+FILTER_SPEC_CACHE_TTL_SECONDS = int(os.getenv('FILTER_SPEC_CACHE_TTL_SECONDS', 60 * 60 * 24))
+
+_filter_spec_cache = get_cache('playlist_filter_specs', max_size=FILTER_SPEC_CACHE_MAX_SIZE, ttl=FILTER_SPEC_CACHE_TTL_SECONDS)
+
+def normalize_prompt(user_request: str) -> str:
+    """
+    Lowercase, drop punctuation and collapse whitespace so "Chill!" and "  chill " share a cache entry
+    """
+    text = re.sub(r"[^\w\s]", " ", user_request.lower())
+    return " ".join(text.split())
+
+def _filter_spec_cache_key(user_request: str, db: Session) -> str:
+    # The spec is only valid for the genre hierarchy the LLM was shown, so key it on the catalog version
+    return f"{get_catalog_snapshot(db).version}:{normalize_prompt(user_request)}"
+
+def get_cached_filter_spec(user_request: str, song_limit: int, db: Session) -> Optional[dict]:
+    """
+    Return the cached final filter spec for a prompt, or None if there is none usable for this song_limit.
+
+    An entry that was never relaxed and had fewer candidates than song_limit is skipped, so the caller
+    can run the full pipeline (including relaxation) for the larger playlist.
+    """
+    entry = _filter_spec_cache.get(_filter_spec_cache_key(user_request, db))
+    if entry is None:
+        return None
+    if entry['candidate_count'] < song_limit and not entry['relaxed']:
+        return None
+    return entry['filter_spec']
+
+def cache_filter_spec(user_request: str, filter_spec: dict, candidate_count: int, relaxed: bool, db: Session):
+    _filter_spec_cache.set(_filter_spec_cache_key(user_request, db), {
+        'filter_spec': filter_spec,
+        'candidate_count': candidate_count,
+        'relaxed': relaxed,
+    })
+
+AUDIO_LEVEL_KEYS = ['energy_levels', 'valence_levels', 'danceability_levels', 'instrumentalness_levels']
+# Words that mean the user asked for an audio-feature dimension themselves, rather than the LLM adding it
+AUDIO_LEVEL_KEYWORDS = {
+    'energy_levels': ['energy', 'energetic', 'intense', 'workout', 'gym', 'running', 'hype', 'calm', 'relax', 'sleep'],
+    'valence_levels': ['happy', 'sad', 'upbeat', 'depress', 'melanchol', 'cheerful', 'gloomy', 'mellow'],
+    'danceability_levels': ['danc', 'party', 'club'],
+    'instrumentalness_levels': ['instrumental', 'no vocals', 'without vocals'],
+}
+# Ordered scales used to widen a level with its neighbours
+ADJACENT_LEVELS = {
+    'energy_levels': ['calm/relaxing', 'moderate energy', 'high energy'],
+    'valence_levels': ['sad/depressing', 'neutral/mellow', 'happy/upbeat'],
+}
+YEAR_WIDEN_STEP = int(os.getenv('RELAX_YEAR_WIDEN_STEP', 5))
+YEAR_PATTERN = re.compile(r"\b(\d0s|\d{2}s|(19|20)\d{2}s?|sixties|seventies|eighties|nineties)\b")
+
+_relaxation_stats = {'runs': 0, 'satisfied_locally': 0, 'llm_fallbacks': 0, 'steps': 0}
+_relaxation_stats_lock = threading.Lock()
+
+def _count_relaxation(name: str, amount: int = 1):
+    with _relaxation_stats_lock:
+        _relaxation_stats[name] += amount
+
+def get_relaxation_stats() -> dict:
+    with _relaxation_stats_lock:
+        return dict(_relaxation_stats)
+
+register_metrics('playlist_relaxation', get_relaxation_stats)
+
+def _load_bearing(user_request: str, filter_spec: dict) -> set:
+    """
+    Dimensions (and individual moods/genres) the user named explicitly; these are relaxed last
+    """
+    prompt = normalize_prompt(user_request)
+    load_bearing = set()
+    for key, keywords in AUDIO_LEVEL_KEYWORDS.items():
+        if any(keyword in prompt for keyword in keywords):
+            load_bearing.add(key)
+    for mood in filter_spec.get('moods', []):
+        if mood.lower() in prompt:
+            load_bearing.add('moods')
+    for key in ('genres', 'subgenres'):
+        if any(value.lower() in prompt for value in filter_spec.get(key, [])):
+            load_bearing.add(key)
+    if YEAR_PATTERN.search(prompt):
+        load_bearing.add('years')
+    return load_bearing
+
+def fix_genre_hierarchy(filter_spec: dict, hierarchy: dict) -> list:
+    """
+    Make sure every subgenre's parent genre is in "genres" (genre and subgenre filters are AND-combined),
+    and drop subgenres that are not in the catalog. Returns a description of each fix made.
+    """
+    steps = []
+    parent_of = {subgenre: genre for genre, subgenres in hierarchy.items() for subgenre in subgenres}
+    subgenres = filter_spec.get('subgenres', [])
+    unknown = [i for i in subgenres if i not in parent_of]
+    if unknown:
+        filter_spec['subgenres'] = [i for i in subgenres if i in parent_of]
+        steps.append(f"dropped unknown subgenres {unknown}")
+    genres = filter_spec.get('genres', [])
+    if genres:
+        missing_parents = sorted({parent_of[i] for i in filter_spec.get('subgenres', [])} - set(genres))
+        if missing_parents:
+            filter_spec['genres'] = genres + missing_parents
+            steps.append(f"added parent genres {missing_parents}")
+    if 'subgenres' in filter_spec and not filter_spec['subgenres']:
+        del filter_spec['subgenres']
+    return steps
+
+def _relaxation_candidates(filter_spec: dict, load_bearing: set) -> list:
+    """
+    Candidate relaxations as tiers, most preferred first; each candidate is (description, relaxed spec)
+    """
+    def without(key):
+        spec = copy.deepcopy(filter_spec)
+        spec.pop(key, None)
+        return spec
+
+    tiers = []
+    # 1. Audio-feature levels the LLM added on its own initiative
+    tiers.append([(f"dropped {key}", without(key)) for key in AUDIO_LEVEL_KEYS if filter_spec.get(key) and key not in load_bearing])
+
+    def widen_years():
+        year_min, year_max = filter_spec.get('year_min'), filter_spec.get('year_max')
+        if year_min is None and year_max is None:
+            return []
+        spec = copy.deepcopy(filter_spec)
+        if year_min is not None:
+            spec['year_min'] = max(year_min - YEAR_WIDEN_STEP, YEAR_MIN)
+        if year_max is not None:
+            spec['year_max'] = min(year_max + YEAR_WIDEN_STEP, YEAR_MAX)
+        if (spec.get('year_min'), spec.get('year_max')) == (year_min, year_max):
+            spec.pop('year_min', None)
+            spec.pop('year_max', None)
+            return [("dropped year bounds", spec)]
+        return [(f"widened years to {spec.get('year_min', YEAR_MIN)}-{spec.get('year_max', YEAR_MAX)}", spec)]
+
+    # 2. Year bounds implied rather than asked for
+    tiers.append(widen_years() if 'years' not in load_bearing else [])
+    # 3. Supplementary moods
+    tiers.append([("dropped moods", without('moods'))] if filter_spec.get('moods') and 'moods' not in load_bearing else [])
+    # 4. Widen what the user did ask for: neighbouring audio levels, then explicit years
+    adjacent = []
+    for key, scale in ADJACENT_LEVELS.items():
+        values = filter_spec.get(key, [])
+        if values:
+            positions = {scale.index(i) for i in values if i in scale}
+            neighbours = [scale[j] for i in positions for j in (i - 1, i + 1) if 0 <= j < len(scale) and scale[j] not in values]
+            if neighbours:
+                spec = copy.deepcopy(filter_spec)
+                spec[key] = values + sorted(set(neighbours), key=scale.index)
+                adjacent.append((f"added adjacent {key} {sorted(set(neighbours))}", spec))
+    tiers.append(adjacent + (widen_years() if 'years' in load_bearing else []))
+    # 5. Subgenre constraints (the parent genres stay)
+    tiers.append([("dropped subgenres", without('subgenres'))] if filter_spec.get('subgenres') and 'subgenres' not in load_bearing else [])
+    return tiers
+
+def relax_filter_spec(user_request: str, filter_spec: dict, song_limit: int, db: Session, max_rounds: int = 12):
+    """
+    Broaden a filter spec that matches fewer than song_limit tracks without calling the LLM.
+
+    Each round counts every candidate relaxation against the facet index, then applies the best candidate
+    from the highest-priority tier that adds tracks: LLM-added audio levels, implied year bounds,
+    supplementary moods, adjacent levels / explicit years, and finally subgenres. Returns the relaxed
+    spec, its candidate count and the steps taken; the caller falls back to the LLM if the count is
+    still short.
+    """
+    _count_relaxation('runs')
+    spec = copy.deepcopy(filter_spec)
+    steps = fix_genre_hierarchy(spec, get_catalog_snapshot(db).genre_hierarchy)
+    load_bearing = _load_bearing(user_request, spec)
+    count = count_tracks_for_filter_specs(db, [spec])[0]
+    for _ in range(max_rounds):
+        if count >= song_limit:
+            break
+        tiers = _relaxation_candidates(spec, load_bearing)
+        candidates = [candidate for tier in tiers for candidate in tier]
+        if not candidates:
+            break
+        counts = count_tracks_for_filter_specs(db, [candidate_spec for _, candidate_spec in candidates])
+        chosen = None
+        position = 0
+        for tier in tiers:
+            tier_counts = counts[position:position + len(tier)]
+            improving = [(tier_count, i) for i, tier_count in enumerate(tier_counts) if tier_count > count]
+            if improving:
+                best_count, best = max(improving)
+                chosen = (tier[best][0], tier[best][1], best_count)
+                break
+            position += len(tier)
+        if chosen is None:
+            break
+        step, spec, count = chosen
+        steps.append(step)
+    _count_relaxation('steps', len(steps))
+    if count >= song_limit:
+        _count_relaxation('satisfied_locally')
+    if steps:
+        spec['explanation'] = f"{spec.get('explanation', '')} (Relaxed: {'; '.join(steps)})".strip()
+    return spec, count, steps
+
+def record_llm_relaxation():
+    _count_relaxation('llm_fallbacks')
@@ -0,0 +1,158 @@
+from .metrics_utils import register_metrics
+from functools import lru_cache
+from typing import Optional
+import numpy as np
+import re
+import threading
+
+# The condition grammar the audio-feature prompt asks for, e.g. "Energy BETWEEN 0.1 AND 0.4",
+# "Genre IN ('Rock', 'Pop')", "Danceability > 0.6", "Subgenre LIKE '%house%'", "Year = 1994"
+_IN = re.compile(r'(\w+)\s+IN\s*\(\s*(.+?)\s*\)', re.IGNORECASE)
+_BETWEEN = re.compile(r'(\w+)\s+BETWEEN\s+([\d.]+)\s+AND\s+([\d.]+)', re.IGNORECASE)
+_COMPARISON = re.compile(r'(\w+)\s*(>=|<=|>|<)\s*([\d.]+)')
+_LIKE = re.compile(r'(\w+)\s+I?LIKE\s+\'([^\']+)\'', re.IGNORECASE)
+_EQUALS = re.compile(r'(\w+)\s*=\s*\'?([^\']+)\'?')
+
+PARSE_CACHE_SIZE = 4096
+
+_predicate_stats = {'queries': 0, 'conditions': 0, 'skipped_conditions': 0}
+_predicate_stats_lock = threading.Lock()
+
+def _count(key: str, n: int = 1):
+    with _predicate_stats_lock:
+        _predicate_stats[key] += n
+
+def get_predicate_stats() -> dict:
+    info = parse_condition_string.cache_info()
+    with _predicate_stats_lock:
+        return dict(_predicate_stats, parse_cache_hits=info.hits, parse_cache_misses=info.misses, parse_cache_size=info.currsize)
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_condition_string(condition: str) -> tuple:
+    """
+    (operator, column, value) for one WHERE condition, or (None, None, None) if it does not parse.
+
+    Cached per condition string: the model repeats the same handful of conditions across prompts.
+    """
+    condition = condition.strip()
+    upper = condition.upper()
+    if " IN (" in upper:
+        match = _IN.match(condition)
+        if match:
+            return 'IN', match.group(1), tuple(re.findall(r"'([^']*)'", match.group(2)))
+    elif " BETWEEN " in upper:
+        match = _BETWEEN.match(condition)
+        if match:
+            return 'BETWEEN', match.group(1), (float(match.group(2)), float(match.group(3)))
+    elif " LIKE " in upper or " ILIKE " in upper:
+        match = _LIKE.match(condition)
+        if match:
+            return 'LIKE', match.group(1), match.group(2)
+    else:
+        match = _COMPARISON.match(condition)
+        if match:
+            return match.group(2), match.group(1), float(match.group(3))
+        match = _EQUALS.match(condition)
+        if match:
+            value = match.group(2)
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+            return '=', match.group(1), value
+    return None, None, None
+
+class ColumnarTrackStore:
+    """
+    Column-per-array view of a track DataFrame for evaluating WHERE conditions in one pass.
+
+    Numeric columns are used as float arrays. Text conditions run after the numeric ones and only
+    test the rows still in the mask. Column names are matched case-insensitively, as the model
+    writes "Energy" for the energy column.
+    """
+    def __init__(self, df):
+        self.df = df
+        self.size = len(df)
+        self._columns = {}
+        for column in df.columns:
+            self._columns.setdefault(column.lower(), column)
+        self._numeric = {}
+
+    def column(self, name: str) -> Optional[str]:
+        return self._columns.get(name.lower())
+
+    def numeric(self, column: str) -> Optional[np.ndarray]:
+        if column not in self._numeric:
+            series = self.df[column]
+            self._numeric[column] = series.to_numpy(dtype=float, na_value=np.nan) if series.dtype.kind in 'biuf' else None
+        return self._numeric[column]
+
+    def predicate(self, operator: str, column: str, value, positions: np.ndarray = None) -> np.ndarray:
+        """
+        Boolean array for one parsed condition; text columns are tested only at positions
+        """
+        values = self.numeric(column)
+        if values is not None:
+            with np.errstate(invalid='ignore'):
+                if operator == 'BETWEEN':
+                    return (values >= value[0]) & (values <= value[1])
+                if operator == '>':
+                    return values > value
+                if operator == '<':
+                    return values < value
+                if operator == '>=':
+                    return values >= value
+                if operator == '<=':
+                    return values <= value
+            if operator in ('IN', '='):
+                targets = [float(i) for i in (value if operator == 'IN' else [value]) if _is_number(i)]
+                return np.isin(values, targets)
+        else:
+            series = self.df[column] if positions is None else self.df[column].iloc[positions]
+            if operator == 'IN':
+                return series.isin(value).to_numpy()
+            if operator == '=':
+                return (series == value).to_numpy()
+            if operator == 'LIKE':
+                return series.str.contains(value.strip('%'), case=False, na=False, regex=False).to_numpy(dtype=bool)
+        raise TypeError(f"{operator} is not supported on column '{column}'")
+
+    def mask(self, where_conditions) -> np.ndarray:
+        """
+        Rows matching every condition; conditions that do not parse or name an unknown column are skipped
+        """
+        _count('queries')
+        compiled = []
+        for condition in where_conditions or []:
+            _count('conditions')
+            operator, name, value = parse_condition_string(condition)
+            column = self.column(name) if operator else None
+            if column is None:
+                _count('skipped_conditions')
+                print(f"⚠️ Could not apply condition: '{condition}'")
+                continue
+            compiled.append((condition, operator, column, value))
+        # Numeric comparisons first, so text tests only see the surviving rows
+        compiled.sort(key=lambda i: self.numeric(i[2]) is None)
+
+        mask = np.ones(self.size, dtype=bool)
+        for condition, operator, column, value in compiled:
+            try:
+                if self.numeric(column) is not None:
+                    np.logical_and(mask, self.predicate(operator, column, value), out=mask)
+                else:
+                    positions = np.flatnonzero(mask)
+                    mask[positions] = self.predicate(operator, column, value, positions)
+            except Exception as e:
+                _count('skipped_conditions')
+                print(f"⚠️ Error processing condition '{condition}': {e}")
+        return mask
+
+def _is_number(value) -> bool:
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+register_metrics('llm_predicates', get_predicate_stats)
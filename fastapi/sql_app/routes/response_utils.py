@@ -0,0 +1,70 @@
+from fastapi import FastAPI, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from decimal import Decimal
+import datetime
+import json
+import os
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv('COMPRESSION_MINIMUM_SIZE', 1000))
+
+def _default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_json(content) -> bytes:
+    """
+    Encode a payload of plain Python / numpy values to JSON bytes, using orjson when it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def decode_json(data: bytes):
+    """
+    Decode JSON bytes written by encode_json
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONResponse(Response):
+    """
+    JSON response that skips response_model validation and jsonable_encoder.
+
+    Only use it for payloads the endpoint already builds in the documented shape. Accepts either a
+    payload to encode or bytes that were encoded ahead of time (e.g. from the catalog snapshot).
+    """
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return encode_json(content)
+
+def add_compression_middleware(app: FastAPI):
+    """
+    Compress responses per request based on Accept-Encoding: brotli when brotli-asgi is installed
+    (falling back to gzip for clients that don't accept br), otherwise gzip only
+    """
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+    else:
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
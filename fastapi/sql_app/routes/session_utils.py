@@ -2,72 +2,124 @@ import secrets
 import datetime
 import os
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from fastapi import Cookie, HTTPException, Header
+from fastapi import Cookie, Depends, HTTPException, Header
+from sqlalchemy.orm import Session
 from typing import Optional
+from .. import crud
+from ..database import get_db
 from ._utils import _get_apple_music_auth_header
+from .cache_utils import get_cache
 
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
 SESSION_COOKIE_NAME = "apple_music_session"
 SESSION_MAX_AGE = 60 * 60 * 24 * 30  # 30 days
+# Sessions and API keys live in user_data; each worker keeps a small read-through cache in front of them
+SESSION_CACHE_MAX_SIZE = int(os.getenv('SESSION_CACHE_MAX_SIZE', 1024))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv('SESSION_CACHE_TTL_SECONDS', 300))
 
 serializer = URLSafeTimedSerializer(SECRET_KEY)
 
-sessions = {}
-api_keys = {}
+sessions = get_cache('sessions', max_size=SESSION_CACHE_MAX_SIZE, ttl=SESSION_CACHE_TTL_SECONDS, shared=False)
+api_keys = get_cache('api_keys', max_size=SESSION_CACHE_MAX_SIZE, ttl=SESSION_CACHE_TTL_SECONDS, shared=False)
 
-def create_session(user_token: str):
+def create_session(db: Session, user_token: str):
     session_id = secrets.token_urlsafe(32)
-    sessions[session_id] = {
+    created_at = datetime.datetime.utcnow()
+    expires_at = created_at + datetime.timedelta(seconds=SESSION_MAX_AGE)
+    crud.create_user_session(db, session_id=session_id, user_token=user_token, created_at=created_at, expires_at=expires_at)
+    sessions.set(session_id, {
         'user_token': user_token,
-        'created_at': datetime.datetime.now(),
-        'expires_at': datetime.datetime.now() + datetime.timedelta(seconds=SESSION_MAX_AGE)
-    }
+        'created_at': created_at,
+        'expires_at': expires_at
+    })
     return session_id
 
-def get_session(session_id: str):
-    if session_id not in sessions:
+def _load_session(db: Session, session_id: str):
+    db_session = crud.get_user_session(db, session_id=session_id)
+    if db_session is None:
         return None
-    session_data = sessions[session_id]
-    if session_data['expires_at'] < datetime.datetime.now():
-        del sessions[session_id]
+    return {
+        'user_token': db_session.user_token,
+        'created_at': db_session.created_at,
+        'expires_at': db_session.expires_at
+    }
+
+def get_session(db: Session, session_id: str):
+    session_data = sessions.get(session_id)
+    if session_data is None:
+        session_data = _load_session(db, session_id)
+        if session_data is None:
+            return None
+        sessions.set(session_id, session_data)
+    if session_data['expires_at'] < datetime.datetime.utcnow():
+        sessions.delete(session_id)
         return None
     return session_data
 
-def get_current_session(session_cookie: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME)) -> dict:
+def get_current_session(session_cookie: Optional[str] = Cookie(None, alias=SESSION_COOKIE_NAME), db: Session = Depends(get_db)) -> dict:
     if not session_cookie:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
         session_id = serializer.loads(session_cookie, max_age=SESSION_MAX_AGE)
     except (BadSignature, SignatureExpired):
         raise HTTPException(status_code=401, detail="Invalid or expired session")
-    session_data = get_session(session_id)
+    session_data = get_session(db, session_id)
     if not session_data:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     return session_data
 
-def create_api_key(session_id: str):
+def create_api_key(db: Session, session_id: str):
     api_key = secrets.token_urlsafe(32)
-    api_keys[api_key] = {
+    created_at = datetime.datetime.utcnow()
+    expires_at = created_at + datetime.timedelta(seconds=SESSION_MAX_AGE)
+    crud.create_user_api_key(db, api_key=api_key, session_id=session_id, created_at=created_at, expires_at=expires_at)
+    api_keys.set(api_key, {
         'session_id': session_id,
-        'created_at': datetime.datetime.utcnow()
-    }
+        'created_at': created_at,
+        'expires_at': expires_at
+    })
     return api_key
 
-def get_api_key(x_api_key: Optional[str] = Header(None)):
-    if x_api_key not in api_keys:
+def get_api_key(x_api_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    if not x_api_key:
         raise HTTPException(status_code=401, detail="Invalid or expired API key")
-    return api_keys[x_api_key]
+    api_key_data = api_keys.get(x_api_key)
+    if api_key_data is None:
+        db_api_key = crud.get_user_api_key(db, api_key=x_api_key)
+        if db_api_key is None:
+            raise HTTPException(status_code=401, detail="Invalid or expired API key")
+        api_key_data = {
+            'session_id': db_api_key.session_id,
+            'created_at': db_api_key.created_at,
+            'expires_at': db_api_key.expires_at
+        }
+        api_keys.set(x_api_key, api_key_data)
+    if api_key_data['expires_at'] < datetime.datetime.utcnow():
+        api_keys.delete(x_api_key)
+        raise HTTPException(status_code=401, detail="Invalid or expired API key")
+    return api_key_data
+
+def return_all_sessions_api_keys(db: Session):
+    db_sessions, db_api_keys = crud.get_all_user_sessions_api_keys(db)
+    all_sessions = {i.session_id: {'user_token': i.user_token, 'created_at': i.created_at, 'expires_at': i.expires_at} for i in db_sessions}
+    all_api_keys = {i.api_key: {'session_id': i.session_id, 'created_at': i.created_at, 'expires_at': i.expires_at} for i in db_api_keys}
+    return all_sessions, all_api_keys
 
-def return_all_sessions_api_keys():
-    return sessions, api_keys
+def sweep_expired_sessions(db: Session):
+    """
+    Delete expired sessions and API keys from user_data; returns (sessions deleted, api keys deleted)
+    """
+    return crud.delete_expired_sessions(db)
 
-def get_user_token_developer_token(session_info: dict):
+def get_user_token_developer_token(db: Session, session_info: dict):
     # Get session data for user
     session_id = session_info['session_id']
-    session_data = get_session(session_id)
+    session_data = get_session(db, session_id)
+    if session_data is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
     user_token = session_data['user_token']
     # Get developer API key
     api_key = os.getenv('API_KEY')
     developer_token_dict = _get_apple_music_auth_header(api_key)
     developer_token = developer_token_dict['developer_token']
-    return user_token, developer_token
\ No newline at end of file
+    return user_token, developer_token
@@ -1,20 +1,25 @@
 from ..database import get_db
 from .. import crud, models, schemas
 from fastapi import Depends, FastAPI, HTTPException, Query, APIRouter, Request, Header, Response, Cookie
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from ._utils import normalize_weights, reweight_list, unskew_features_function, unpack_tracks, _get_similar_genres, _get_similar_artists_by_track_details, _get_similar_tracks_by_euclidean_distance, _get_similar_tracks, pull_relevant_albums, _get_similar_artists_by_genre, _get_similar_albums_by_track_details, _get_similar_artists_by_publication, _get_similar_albums_by_publication, _get_apple_music_auth_header, verify_api_key, _get_apple_music_recently_played_tracks
+from ._utils import normalize_weights, reweight_list, unskew_features_function, unpack_tracks, _get_similar_genres, _get_similar_artists_by_track_details, _get_similar_tracks_by_euclidean_distance, _get_similar_tracks, pull_relevant_albums, _get_similar_artists_by_genre, _get_similar_albums_by_track_details, _get_similar_artists_by_publication, _get_similar_albums_by_publication, _get_apple_music_auth_header, verify_api_key, _get_apple_music_recently_played_tracks, summarize_listening_preferences
+from .accolade_utils import get_accolade_index
+from .apple_music_utils import async_apple_music_request
+from .catalog_utils import get_catalog_snapshot, refresh_catalog_snapshot
+from .http_cache_utils import conditional_response
+from .metrics_utils import collect_metrics
+from .response_utils import FastJSONResponse
 from .session_utils import get_api_key, return_all_sessions_api_keys, get_user_token_developer_token, create_session, create_api_key, serializer, SESSION_COOKIE_NAME, SESSION_MAX_AGE
 from sqlalchemy.orm import Session
 import numpy as np
 from typing import List, Optional
 from pathlib import Path
-import pandas as pd
+from .lazy_utils import pd
 import json
 import datetime
 import os
-import requests
-from collections import Counter
 
 
 router = APIRouter(prefix="/web", tags=["Web"])
@@ -22,45 +27,27 @@ router = APIRouter(prefix="/web", tags=["Web"])
 templates = Jinja2Templates(directory=Path(__file__).parent.parent / "templates")
 
 @router.get("/genres/", response_model=schemas.Genres)
-def get_distinct_genres(db: Session = Depends(get_db)):
+def get_distinct_genres(request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Get distinct genres from the database, returned as a dictionary
     """
-    db_genre = crud.get_unique_genres(db)
-    x = {'genres': {}}
-    for i in db_genre:
-        if i[0] in x['genres']:
-            x['genres'][i[0]].append(i[1])
-        else:
-            x['genres'][i[0]] = [i[1]]
-    return x
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or snapshot.web_genres
 
 @router.get("/publications/", response_model=schemas.Publications)
-def get_distinct_publications(db: Session = Depends(get_db)):
-    db_genre = crud.get_unique_publications(db)
-    x = {'publications': {}}
-    for i in db_genre:
-        if i[0] in x['publications']:
-            x['publications'][i[0]].append(i[1])
-        else:
-            x['publications'][i[0]] = [i[1]]
-    return x
+def get_distinct_publications(request: Request, response: Response, db: Session = Depends(get_db)):
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or snapshot.publications
 
 @router.get("/artists/", response_model=schemas.Artists)
-def get_distinct_artists(db: Session = Depends(get_db)):
-    db_artist = crud.get_artist_name_ids(db)
-    x = {'artists': {}}
-    for i in db_artist:
-        x['artists'][i.artist_name] = i.artist_id
-    return x
+def get_distinct_artists(request: Request, response: Response, db: Session = Depends(get_db)):
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or FastJSONResponse(snapshot.encoded('web_artists'), headers=response.headers)
 
 @router.get("/moods/", response_model=schemas.Moods)
-def get_distinct_moods(db: Session = Depends(get_db)):
-    db_mood = crud.get_unique_moods(db)
-    x = {'moods': []}
-    for i in db_mood:
-        x['moods'].append(i.mood)
-    return x
+def get_distinct_moods(request: Request, response: Response, db: Session = Depends(get_db)):
+    snapshot = get_catalog_snapshot(db)
+    return conditional_response(request, response, snapshot) or snapshot.web_moods
 
 @router.get("/artists_albums/", response_model=schemas.AlbumsList)
 def get_distinct_artists_albums(db: Session = Depends(get_db)):
@@ -189,7 +176,9 @@ def get_random_track_from_album(album_id: str,
     return {'tracks': {track_choice: tracks['tracks'][track_choice]}}
 
 @router.get("/get_relevant_albums/", response_model=schemas.Albums)
-def get_relevant_albums(min_year: int, 
+def get_relevant_albums(request: Request,
+                        response: Response,
+                        min_year: int, 
                         max_year: int, 
                         genre: List[str] = Query([None]), 
                         subgenre: List[str] = Query([None]), 
@@ -205,6 +194,9 @@ def get_relevant_albums(min_year: int,
 
     Returned in dictionary format, used for Streamlit
     """
+    not_modified = conditional_response(request, response, get_catalog_snapshot(db))
+    if not_modified:
+        return not_modified
     output = {'albums': {}}
     x = pull_relevant_albums(db=db, 
                              min_year=min_year,
@@ -221,7 +213,7 @@ def get_relevant_albums(min_year: int,
                             )
     for value in sorted(x['albums'].items(), key=lambda x: x[1]['weighted_rank'], reverse=True)[:album_limit]:
         output['albums'][value[0]] = value[1]
-    return output
+    return FastJSONResponse(output, headers=response.headers)
 
 @router.get("/get_similar_artists_by_publication/{artist_id}", response_model=schemas.Artists)
 def get_similar_artists_by_publication(artist_id: str, 
@@ -528,7 +520,9 @@ def get_track_data_multiple_tracks(track_ids: List[str] = Query([None]),
     return x
 
 @router.get('/get_album_accolades_multiple_albums/', response_model=schemas.Albums)
-def get_album_accolades_multiple_albums(album_ids: List[str] = Query([None]),
+def get_album_accolades_multiple_albums(request: Request,
+                                        response: Response,
+                                        album_ids: List[str] = Query([None]),
                                         n_accolades: int = 10,
                                         album_limit: int = 50,
                                         db: Session = Depends(get_db),
@@ -539,38 +533,16 @@ def get_album_accolades_multiple_albums(album_ids: List[str] = Query([None]),
 
     Used as endpoint in Top Albums in Streamlit
     """
-    db_albums = crud.get_album_accolades_multiple_albums(db, album_ids=album_ids[:album_limit])
-    if db_albums is None:
-        raise HTTPException(status_code=404, detail="No albums that match criteria")
-    elif len(db_albums) == 0:
-        raise HTTPException(status_code=404, detail="No albums that match criteria")
+    not_modified = conditional_response(request, response, get_catalog_snapshot(db))
+    if not_modified:
+        return not_modified
+    accolade_index = get_accolade_index(db)
     x = {'albums': {}}
-    for position, value in enumerate(db_albums):
-        album_key = getattr(value, 'album_key')
-        if album_key in x['albums']:
-            pass
-        else:
-            x['albums'][album_key] = []
-        new_value = {}
-        for feature in ['rank', 'points', 'publication', 'list']:
-            new_value[feature] = getattr(value, feature)
-        x['albums'][album_key].append(new_value)
-    for album in x['albums']:
-        new_dict = []
-        counting_value = 0
-        if len(x['albums'][album]) == 1:
-            skip_low_points_value = False
-        else:
-            skip_low_points_value = exclude_accolades_only_one_point
-        for value in sorted(x['albums'][album], key=lambda x: x['points'], reverse=True):
-            if skip_low_points_value:
-                if value['points'] == 1:
-                    continue
-            new_dict.append(value)
-            counting_value += 1
-            if counting_value >= n_accolades:
-                break
-        x['albums'][album] = new_dict
+    for album_key in album_ids[:album_limit]:
+        if album_key in accolade_index and album_key not in x['albums']:
+            x['albums'][album_key] = accolade_index.lookup(album_key, n_accolades, exclude_accolades_only_one_point)
+    if len(x['albums']) == 0:
+        raise HTTPException(status_code=404, detail="No albums that match criteria")
     return x
 
 @router.get('/get_tracks_by_features/', response_model=schemas.Tracks)
@@ -702,7 +674,7 @@ def get_relevant_lists(min_year: int,
     return x
 
 @router.post("/create_session_endpoint/")
-async def create_session_endpoint(token_request: schemas.UserTokenRequest, response: Response):
+def create_session_endpoint(token_request: schemas.UserTokenRequest, response: Response, db: Session = Depends(get_db)):
     """
     Create a session after successful authorization and set secure cookie
     """
@@ -710,8 +682,8 @@ async def create_session_endpoint(token_request: schemas.UserTokenRequest, respo
     if not user_token:
         raise HTTPException(status_code=400, detail="No user token provided")
 
-    session_id = create_session(user_token)
-    api_key = create_api_key(session_id)
+    session_id = create_session(db, user_token)
+    api_key = create_api_key(db, session_id)
     signed_session = serializer.dumps(session_id)
     response.set_cookie(
         key=SESSION_COOKIE_NAME, 
@@ -729,31 +701,47 @@ async def create_session_endpoint(token_request: schemas.UserTokenRequest, respo
         "redirect_url": f"https://topmusic.lol/?api_key={api_key}"
         }
 
+@router.post("/refresh_catalog/")
+def refresh_catalog(api_key: str = Depends(verify_api_key), db: Session = Depends(get_db)):
+    """
+    Reload the catalog snapshot used by the lookup endpoints, e.g. after a dbt run
+    """
+    snapshot = refresh_catalog_snapshot(db)
+    return {'version': snapshot.version, 'loaded_at': snapshot.loaded_at}
+
+@router.get("/get_metrics/")
+def get_metrics(api_key: str = Depends(verify_api_key)):
+    """
+    Return in-process counters for this worker, one section per registered module
+    """
+    return collect_metrics()
+
 @router.get("/get_all_api_keys/")
-async def get_all_api_keys(api_key: str = Depends(verify_api_key)):
+def get_all_api_keys(api_key: str = Depends(verify_api_key), db: Session = Depends(get_db)):
     """
     Get all API keys
     """
-    return return_all_sessions_api_keys()
+    return return_all_sessions_api_keys(db)
 
 @router.get("/get_user_apple_library/")
-async def get_user_apple_library(session_info: dict = Depends(get_api_key)):
-    USER_TOKEN, DEVELOPER_TOKEN = get_user_token_developer_token(session_info)
+async def get_user_apple_library(session_info: dict = Depends(get_api_key), db: Session = Depends(get_db)):
+    # The session lookup reads user_data; keep it off the event loop the Apple request awaits on
+    USER_TOKEN, DEVELOPER_TOKEN = await run_in_threadpool(get_user_token_developer_token, db, session_info)
     headers = {
         'Authorization': f'Bearer {DEVELOPER_TOKEN}',
         'Music-User-Token': USER_TOKEN
     }
-    response = requests.get('https://api.music.apple.com/v1/me/library/songs?limit=1', headers=headers)
+    response = await async_apple_music_request('GET', '/v1/me/library/songs', headers=headers, params={'limit': 1})
     if response.status_code == 200:
         return response.json()
     return None
 
 @router.post("/create_apple_music_playlist/")
-async def create_apple_music_playlist(session_info: dict = Depends(get_api_key), tracks: List[str] = Query([None]), playlist_name: str = Query(None)):
+async def create_apple_music_playlist(session_info: dict = Depends(get_api_key), tracks: List[str] = Query([None]), playlist_name: str = Query(None), db: Session = Depends(get_db)):
     """
     Create an Apple Music playlist
     """
-    USER_TOKEN, DEVELOPER_TOKEN = get_user_token_developer_token(session_info)
+    USER_TOKEN, DEVELOPER_TOKEN = await run_in_threadpool(get_user_token_developer_token, db, session_info)
     headers = {
         'Authorization': f'Bearer {DEVELOPER_TOKEN}',
         'Music-User-Token': USER_TOKEN,
@@ -768,7 +756,7 @@ async def create_apple_music_playlist(session_info: dict = Depends(get_api_key),
     "relationships": {"tracks": {"data": tracks_data}}
     }
 
-    response = requests.post('https://api.music.apple.com/v1/me/library/playlists', headers=headers, json=playlist_json)
+    response = await async_apple_music_request('POST', '/v1/me/library/playlists', headers=headers, json=playlist_json)
     if response.status_code == 201:
         return response.json()
     else:
@@ -816,35 +804,7 @@ def get_user_track_data(
         for feature in ['apple_music_track_id', 'album_key', 'artist', 'album', 'genre', 'subgenre', 'year', 'image_url', 'apple_music_album_id', 'apple_music_album_url', 'spotify_album_uri', 'duration_ms', 'apple_music_track_name', 'track_popularity', 'album_points', 'eligible_points', 'tempo_raw', 'danceability_clean', 'energy_clean', 'instrumentalness_clean', 'valence_clean', 'speechiness_clean']:
             d[feature] = getattr(value, feature)
         x['tracks'].append(d)
-    all_results = []
-    total_track_length = len(x['tracks'])
-
-    top_artist = Counter(i['artist'] for i in x['tracks']).most_common(1)
-    for i in top_artist:
-        artist_album_keys = list(set(
-            str(t['album_key']) for t in x['tracks'] if t['artist'] == i[0]
-        ))
-        all_results.append({
-            'topic': i[0],
-            'type': 'artist',
-            'count': i[1],
-            'rate': i[1] / total_track_length,
-            'album_keys': artist_album_keys
-        })
-
-    top_genres = Counter(i['genre'] for i in x['tracks']).most_common(2)
-    for i in top_genres:
-        genre_album_keys = list(set(
-            str(t['album_key']) for t in x['tracks'] if t['genre'] == i[0]
-        ))
-        all_results.append({
-            'topic': i[0],
-            'type': 'genre',
-            'count': i[1],
-            'rate': i[1] / total_track_length,
-            'album_keys': genre_album_keys
-        })
-
+    all_results = summarize_listening_preferences(x['tracks'])
     crud.upsert_user_listening_preferences(db, api_key=api_key, results=all_results)
     return all_results
 
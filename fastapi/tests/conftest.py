@@ -0,0 +1,74 @@
+"""
+Shared fixtures. Tests run against in-memory SQLite databases with the dbt and user_data schemas attached,
+standing in for Postgres, and against the local stub servers in benchmarks/:
+
+    cd fastapi && python -m pytest -q tests
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from llm_stub_server import StubHandler, start_stub_server
+from sql_app import models
+from sql_app.routes import llm_client_utils
+
+def sqlite_engine(*tables):
+    """
+    A single-connection in-memory SQLite engine with the schemas attached and `tables` created
+    """
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(connection, _):
+        for schema in ('dbt', 'user_data'):
+            connection.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+
+    models.Base.metadata.create_all(engine, tables=[table.__table__ for table in tables])
+    return engine
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make(*tables):
+        engines.append(sqlite_engine(*tables))
+        return engines[-1]
+
+    yield make
+    for engine in engines:
+        engine.dispose()
+
+@pytest.fixture(scope='session')
+def llm_stub_url():
+    server = start_stub_server(token_delay=0.001)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+@pytest.fixture
+def llm_stub(llm_stub_url, monkeypatch):
+    """
+    Point both LLM backends at the stub with fresh pooled clients; the real ANTHROPIC_* settings are overridden
+    """
+    monkeypatch.setenv('ANTHROPIC_BASE_URL', llm_stub_url)
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'stub')
+    monkeypatch.setattr(llm_client_utils, 'ANTHROPIC_BASE_URL', llm_stub_url)
+    monkeypatch.setattr(llm_client_utils, 'OLLAMA_HOST', llm_stub_url)
+    monkeypatch.setattr(llm_client_utils, '_anthropic_client', None)
+    monkeypatch.setattr(llm_client_utils, '_ollama_session', None)
+    monkeypatch.setattr(StubHandler, 'delay', 0.0)
+    # Let streams an earlier test hung up on finish, so they don't add to this test's tokens_sent
+    deadline = time.monotonic() + 5
+    while StubHandler.open_streams and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield StubHandler
+    for client in (llm_client_utils._ollama_session, llm_client_utils._anthropic_client):
+        if client is not None:
+            client.close()
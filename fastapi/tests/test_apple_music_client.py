@@ -0,0 +1,98 @@
+"""
+Retry policy of the Apple Music client against benchmarks/apple_music_mock_server.py, for both the
+requests (sync) and httpx (async) paths: 429 is always retried and honours Retry-After, 5xx and timeouts
+are retried only for idempotent methods, and a deadline raises TimeoutError.
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from apple_music_mock_server import RECENTLY_PLAYED_PATH, MockAppleHandler, start_mock_server
+from sql_app.routes import apple_music_utils
+
+PLAYLISTS_PATH = '/v1/me/library/playlists'
+
+@pytest.fixture(scope='module')
+def mock_server():
+    server = start_mock_server()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+@pytest.fixture(params=['sync', 'async'])
+def send(request, mock_server, monkeypatch):
+    monkeypatch.setattr(apple_music_utils, 'APPLE_MUSIC_BASE_URL', mock_server)
+    monkeypatch.setattr(apple_music_utils, 'APPLE_MUSIC_BACKOFF_SECONDS', 0.01)
+    monkeypatch.setattr(apple_music_utils, '_process_rate_limiter', apple_music_utils.TokenBucket(0, 1))
+    MockAppleHandler.reset()
+
+    def send_sync(method, path, headers, read_timeout=None, **kwargs):
+        if read_timeout is not None:
+            kwargs['timeout'] = (1, read_timeout)
+        return apple_music_utils.apple_music_request(method, path, headers=headers, **kwargs)
+
+    def send_async(method, path, headers, read_timeout=None, **kwargs):
+        if read_timeout is not None:
+            kwargs['timeout'] = httpx.Timeout(read_timeout, connect=1)
+
+        async def run():
+            try:
+                return await apple_music_utils.async_apple_music_request(method, path, headers=headers, **kwargs)
+            finally:
+                await apple_music_utils.close_apple_music_clients()
+
+        return asyncio.run(run())
+
+    send_sync.timeout_error, send_async.timeout_error = requests.Timeout, httpx.TimeoutException
+    return send_sync if request.param == 'sync' else send_async
+
+def scripted(request_id, status='', delay=0):
+    return {'X-Mock-Request-Id': request_id, 'X-Mock-Status': status, 'X-Mock-Delay': str(delay)}
+
+@pytest.mark.parametrize('method, path, ok', [('GET', RECENTLY_PLAYED_PATH, 200), ('POST', PLAYLISTS_PATH, 201)])
+def test_429_is_retried_for_every_method(send, method, path, ok):
+    response = send(method, path, scripted('throttled', '429,429'), json={})
+    assert response.status_code == ok
+    assert MockAppleHandler.attempts['throttled'] == 3
+
+def test_5xx_is_retried_for_get(send):
+    response = send('GET', RECENTLY_PLAYED_PATH, scripted('unavailable', '503,502'))
+    assert response.status_code == 200
+    assert MockAppleHandler.attempts['unavailable'] == 3
+
+def test_5xx_is_not_retried_for_post(send):
+    response = send('POST', PLAYLISTS_PATH, scripted('unavailable', '503'), json={})
+    assert response.status_code == 503
+    assert MockAppleHandler.attempts['unavailable'] == 1
+
+def test_read_timeout_is_retried_for_get_but_not_post(send):
+    assert send('GET', RECENTLY_PLAYED_PATH, scripted('stalled get', delay=2), read_timeout=0.3).status_code == 200
+    assert MockAppleHandler.attempts['stalled get'] == 2
+    # The playlist may have been created before the reply was lost, so it is not sent again
+    with pytest.raises(send.timeout_error):
+        send('POST', PLAYLISTS_PATH, scripted('stalled post', delay=2), read_timeout=0.3, json={})
+    assert MockAppleHandler.attempts['stalled post'] == 1
+
+def test_retry_after_is_honoured(send, monkeypatch):
+    # The mock's own throttle answers with Retry-After: 1, longer than any backoff the client would pick itself
+    monkeypatch.setattr(MockAppleHandler, 'rate_limit', 1.0)
+    monkeypatch.setattr(MockAppleHandler, 'burst', 1)
+    MockAppleHandler.reset()
+    assert send('GET', '/v1/me/library/songs', {}).status_code == 200
+    start = time.monotonic()
+    assert send('GET', '/v1/me/library/songs', {}).status_code == 200
+    assert time.monotonic() - start >= 0.95
+    assert MockAppleHandler.statuses[('GET', 429)] == 1
+
+def test_deadline_raises_timeout_error(send):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        send('GET', RECENTLY_PLAYED_PATH, scripted('deadline', delay=5), deadline=time.monotonic() + 0.5)
+    # Bounded by the deadline, not the 10 s read timeout or the retries
+    assert time.monotonic() - start < 1.5
@@ -0,0 +1,41 @@
+"""
+RedisCache stores JSON, never pickles: values round-trip as plain data and a pickle planted in the server
+is ignored rather than loaded. Runs against fakeredis when it is installed.
+"""
+import pickle
+
+import pytest
+
+from sql_app.routes.cache_utils import RedisCache
+
+fakeredis = pytest.importorskip('fakeredis')
+
+class Exploit:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Exploit, 'ran', True))
+
+@pytest.fixture
+def cache():
+    return RedisCache('test', fakeredis.FakeRedis(), ttl=60)
+
+def test_values_round_trip_as_json(cache):
+    entry = {'filter_spec': {'genres': ['Rock'], 'year_range': (1990, 1999)}, 'candidate_count': 12, 'relaxed': False}
+    cache.set('chill rock', entry)
+    assert cache.client.get(cache._key('chill rock')).startswith(b'{"filter_spec"')
+    assert cache.get('chill rock') == dict(entry, filter_spec={'genres': ['Rock'], 'year_range': [1990, 1999]})
+    assert cache.items() == [('chill rock', cache.get('chill rock'))]
+    assert cache.get_or_set('other', lambda: [1, 2]) == [1, 2] and cache.get('other') == [1, 2]
+
+def test_pickled_entries_are_not_loaded(cache):
+    cache.client.set(cache._key('planted'), pickle.dumps(Exploit()))
+    assert cache.get('planted') is None
+    assert cache.items() == []
+    assert not Exploit.ran
+    assert cache.get_or_set('planted', lambda: {'fresh': True}) == {'fresh': True}
+
+def test_values_that_are_not_json_are_not_cached(cache):
+    cache.set('object', object())
+    assert cache.get('object') is None
+    assert cache.stats()['errors'] == 1
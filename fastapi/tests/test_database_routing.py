@@ -0,0 +1,83 @@
+"""
+RoutingSession against two file-backed SQLite databases standing in for the primary and the read replica.
+Each holds a catalog album named after it, so a read shows which database answered.
+"""
+import datetime
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import database, models
+
+def connector(path, down=None):
+    def connect():
+        if down and down[0]:
+            raise sqlite3.OperationalError('could not connect to server: Connection refused')
+        connection = sqlite3.connect(str(path) + '.db', check_same_thread=False)
+        for schema in ('dbt', 'user_data'):
+            connection.execute(f"ATTACH DATABASE '{path}_{schema}.db' AS {schema}")
+        return connection
+    return connect
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    replica_down = [False]
+    primary = create_engine('sqlite://', creator=connector(tmp_path / 'primary'))
+    replica = create_engine('sqlite://', creator=connector(tmp_path / 'replica', replica_down), pool_pre_ping=True)
+    models.Base.metadata.create_all(primary, tables=[models.FctAlbums.__table__, models.UserApiKey.__table__])
+    # The replica only carries the dbt catalog
+    models.Base.metadata.create_all(replica, tables=[models.FctAlbums.__table__])
+    for name, engine in (('primary', primary), ('replica', replica)):
+        with sessionmaker(bind=engine)() as db:
+            db.add(models.FctAlbums(album_key=1, album=name))
+            db.commit()
+    monkeypatch.setattr(database, 'engine', primary)
+    monkeypatch.setattr(database, 'replica_engine', replica)
+    monkeypatch.setattr(database, '_replica_status', {'available': True, 'checked_at': 0.0})
+    Session = sessionmaker(bind=primary, class_=database.RoutingSession)
+    yield Session, replica, replica_down
+    primary.dispose()
+    replica.dispose()
+
+def album_names(engine):
+    with sessionmaker(bind=engine)() as db:
+        return [album.album for album in db.query(models.FctAlbums).order_by(models.FctAlbums.album_key)]
+
+def test_writes_and_user_data_go_to_the_primary(databases):
+    Session, replica, _ = databases
+    with Session() as db:
+        assert db.query(models.FctAlbums).one().album == 'replica'
+        # The replica has no user_data tables, so this would fail if it were routed there
+        assert db.query(models.UserApiKey).count() == 0
+        now = datetime.datetime.utcnow()
+        db.add(models.UserApiKey(api_key='key', session_id='session', created_at=now, expires_at=now))
+        db.add(models.FctAlbums(album_key=2, album='flushed'))
+        db.flush()
+        db.execute(update(models.FctAlbums).where(models.FctAlbums.album_key == 1).values(album='updated'))
+        db.commit()
+        assert db.query(models.UserApiKey).one().session_id == 'session'
+    assert album_names(database.engine) == ['updated', 'flushed']
+    assert album_names(replica) == ['replica']
+
+def test_reads_fall_back_when_the_replica_goes_down(databases):
+    Session, replica, replica_down = databases
+    with Session() as db:
+        assert db.query(models.FctAlbums).one().album == 'replica'
+    assert database._replica_status['available']
+
+    # Down since the last health check, which is still cached as healthy
+    replica_down[0] = True
+    replica.dispose()
+    with Session() as db:
+        assert db.query(models.FctAlbums).one().album == 'primary'
+    assert not database._replica_status['available']
+    with Session() as db:
+        assert db.query(models.FctAlbums).one().album == 'primary'
+
+    # Back once the next health check succeeds
+    replica_down[0] = False
+    database._replica_status['checked_at'] = 0.0
+    with Session() as db:
+        assert db.query(models.FctAlbums).one().album == 'replica'
@@ -0,0 +1,101 @@
+"""
+The facet index must select the same tracks as the SQL filter-spec query it replaces.
+
+Runs against an in-memory SQLite database with the dbt schema attached:
+
+    cd fastapi && python -m pytest -q tests
+"""
+import os
+import random
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from sql_app import crud, models
+from sql_app.routes.facet_index_utils import FacetIndex, clean_filter_spec
+
+GENRES = {'Rock': ['Indie Rock', 'Shoegaze', 'Punk'], 'Electronic': ['House', 'Techno', 'Ambient'], 'Jazz': ['Bebop']}
+MOODS = ['dreamy', 'aggressive', 'melancholic', 'uplifting', 'nocturnal']
+LEVELS = {
+    'energy_levels': ('energy_level', ['calm/relaxing', 'moderate energy', 'high energy']),
+    'valence_levels': ('valence_level', ['sad/depressing', 'neutral/mellow', 'happy/upbeat']),
+    'danceability_levels': ('danceability_level', ['not danceable', 'somewhat danceable', 'very danceable']),
+    'instrumentalness_levels': ('instrumentalness_level', ['vocal', 'instrumental']),
+}
+
+@pytest.fixture(scope='module')
+def db():
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(connection, _):
+        connection.execute("ATTACH DATABASE ':memory:' AS dbt")
+
+    tables = [models.FctAlbums.__table__, models.AlbumDescriptors.__table__, models.FctTracks.__table__]
+    models.Base.metadata.create_all(engine, tables=tables)
+    session = sessionmaker(bind=engine)()
+
+    rng = random.Random(3)
+    for album_key in range(150):
+        genre = rng.choice(list(GENRES))
+        subgenre = rng.choice(GENRES[genre])
+        year = rng.choice([None] + list(range(1965, 2024)))
+        session.add(models.FctAlbums(album_key=album_key, genre=genre, subgenre=subgenre, year=year))
+        for mood in rng.sample(MOODS, rng.randint(0, 2)):
+            session.add(models.AlbumDescriptors(album_key=album_key, mood=mood))
+        for t in range(8):
+            levels = {column: rng.choice(scale + [None]) for column, scale in LEVELS.values()}
+            track_id = None if t == 7 else f'{album_key}.{t}'
+            if track_id:
+                session.add(models.FctTracks(apple_music_track_id=track_id, album_key=album_key, genre=genre,
+                                             subgenre=subgenre, year=year, **levels))
+    session.commit()
+    yield session
+    session.close()
+
+def random_spec(rng):
+    genre = rng.choice(list(GENRES))
+    spec = {'genres': [genre]}
+    if rng.random() < 0.5:
+        spec['subgenres'] = rng.sample(GENRES[genre], 1)
+    if rng.random() < 0.5:
+        spec['moods'] = rng.sample(MOODS, rng.randint(1, 2))
+    for key, (_, scale) in LEVELS.items():
+        if rng.random() < 0.3:
+            spec[key] = rng.sample(scale, rng.randint(1, 2))
+    if rng.random() < 0.5:
+        spec['year_min'] = rng.randint(1960, 2010)
+    if rng.random() < 0.5:
+        spec['year_max'] = rng.randint(1990, 2025)
+    return spec
+
+def test_index_and_sql_select_the_same_pool(db):
+    index = FacetIndex.load(db)
+    rng = random.Random(11)
+    for _ in range(200):
+        spec = random_spec(rng)
+        sql_ids = sorted(track.apple_music_track_id for track in crud.get_tracks_by_filter_spec(db, spec, song_limit=10000))
+        assert sorted(index.track_ids_for(spec)) == sql_ids, spec
+        assert index.count(spec) == len(sql_ids)
+        assert crud.count_tracks_for_filter_specs(db, [spec]) == [len(sql_ids)]
+
+def test_limited_pool_is_a_sample_of_the_matches(db):
+    index = FacetIndex.load(db)
+    spec = {'genres': ['Rock']}
+    matches = set(index.track_ids_for(spec))
+    samples = [index.track_ids_for(spec, limit=20) for _ in range(20)]
+    assert all(len(sample) == 20 and set(sample) <= matches for sample in samples)
+    # Not always the first 20 ids
+    assert len(set().union(*samples)) > 20
+
+def test_llm_spec_shapes_are_cleaned(db):
+    index = FacetIndex.load(db)
+    spec = clean_filter_spec({'genres': 'Rock', 'moods': [['dreamy'], {'x': 1}, 'dreamy'], 'year_min': '1990', 'year_max': 'soon'})
+    assert spec['genres'] == ['Rock'] and spec['moods'] == ['dreamy']
+    assert spec['year_min'] == 1990 and spec['year_max'] is None
+    sql_ids = sorted(track.apple_music_track_id for track in crud.get_tracks_by_filter_spec(db, spec, song_limit=10000))
+    assert sorted(index.track_ids_for(spec)) == sql_ids
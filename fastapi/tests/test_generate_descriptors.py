@@ -0,0 +1,99 @@
+"""
+The descriptor batch over a small SQLite catalog, classified by the LLM stub server: keyset pages cover
+every pending album, failures are checkpointed and retried, re-inserts are no-ops and the catalog
+version moves once descriptors are written.
+"""
+import json
+import statistics
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, generate_descriptors, models
+from sql_app.routes.catalog_utils import CatalogSnapshot
+
+class StdDev:
+    """
+    Postgres' stddev (sample standard deviation), which SQLite lacks
+    """
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        return statistics.stdev(self.values) if len(self.values) > 1 else None
+
+@pytest.fixture
+def catalog(make_engine, llm_stub, monkeypatch, tmp_path):
+    engine = make_engine(models.FctAlbums, models.AlbumDescriptors, models.FctTracks, models.RelevantAlbums, models.AppleMusicArtists)
+    engine.raw_connection().driver_connection.create_aggregate('stddev', 1, StdDev)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        for album_key in range(1, 9):
+            db.add(models.FctAlbums(album_key=album_key, genre='Noise' if album_key == 4 else 'Rock', subgenre='Shoegaze',
+                                    spotify_danceability_clean=0.1 * album_key, spotify_energy_clean=0.5, spotify_instrumentalness_clean=0.2,
+                                    spotify_valence_clean=0.3, spotify_tempo_clean=100 + album_key))
+        # Already classified, so never pending
+        db.add(models.AlbumDescriptors(album_key=8, mood='Lush', explanation='Earlier run'))
+        db.commit()
+    monkeypatch.setattr(generate_descriptors, 'SessionLocal', Session)
+    monkeypatch.setattr(generate_descriptors, 'PAGE_SIZE', 3)
+
+    pages = []
+    get_albums_missing_descriptors = crud.get_albums_missing_descriptors
+
+    def record_page(db, limit=None, after_album_key=None):
+        page = get_albums_missing_descriptors(db, limit=limit, after_album_key=after_album_key)
+        pages.append([album.album_key for album in page])
+        return page
+
+    monkeypatch.setattr(crud, 'get_albums_missing_descriptors', record_page)
+
+    # The Noise album is the one the model cannot classify
+    classify = generate_descriptors.generate_audio_descriptors_using_features
+    failing = {'Noise'}
+
+    def classify_or_fail(album_features, baselines):
+        if album_features['genre'] in failing:
+            return None, None
+        return classify(album_features, baselines)
+
+    monkeypatch.setattr(generate_descriptors, 'generate_audio_descriptors_using_features', classify_or_fail)
+    return Session, pages, failing, str(tmp_path / 'checkpoint.json')
+
+def descriptor_rows(Session):
+    with Session() as db:
+        return sorted((row.album_key, row.mood) for row in db.query(models.AlbumDescriptors))
+
+def test_batch_pages_checkpoints_and_retries(catalog):
+    Session, pages, failing, checkpoint_path = catalog
+    with Session() as db:
+        version_before = CatalogSnapshot.load(db).version
+
+    stats = generate_descriptors.run(concurrency=1, batch_size=2, checkpoint_path=checkpoint_path)
+    assert pages == [[1, 2, 3], [4, 5, 6], [7], []]
+    assert {key: stats[key] for key in ('albums', 'classified', 'failed', 'rows_written')} == {'albums': 7, 'classified': 6, 'failed': 1, 'rows_written': 12}
+    assert descriptor_rows(Session) == sorted([(key, mood) for key in (1, 2, 3, 5, 6, 7) for mood in ('Chill', 'Wistful')] + [(8, 'Lush')])
+    with open(checkpoint_path) as f:
+        assert json.load(f)['failed'] == {'4': 1}
+    assert stats['catalog_version'] != version_before
+
+    # A re-run skips the recorded failure; --retry-failed tries it again
+    pages.clear()
+    stats = generate_descriptors.run(concurrency=1, batch_size=2, checkpoint_path=checkpoint_path)
+    assert (stats['albums'], pages) == (0, [[4], []])
+    failing.clear()
+    stats = generate_descriptors.run(concurrency=1, batch_size=2, checkpoint_path=checkpoint_path, retry_failed=True)
+    assert (stats['albums'], stats['classified'], stats['rows_written']) == (1, 1, 2)
+    with open(checkpoint_path) as f:
+        assert json.load(f)['failed'] == {}
+
+    # Rows written by an overlapping run are skipped rather than duplicated
+    rows = descriptor_rows(Session)
+    with Session() as db:
+        crud.bulk_insert_album_descriptors(db, [{'album_key': 1, 'mood': 'Chill', 'explanation': 'Overlapping run'},
+                                                {'album_key': 1, 'mood': 'Groovy', 'explanation': 'Overlapping run'}])
+    assert descriptor_rows(Session) == sorted(rows + [(1, 'Groovy')])
@@ -0,0 +1,87 @@
+"""
+complete() against benchmarks/llm_stub_server.py: both backends share pooled clients across calls and
+threads, cache_prefix is dispatched per backend, and the deadline covers the slot wait, the request
+and any retries.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sql_app.routes import llm_client_utils
+from sql_app.routes.llm_client_utils import LLMTimeoutError, complete
+
+PREFIX = 'You turn music requests into filter specs. ' * 20
+
+@pytest.fixture
+def stub(llm_stub, monkeypatch):
+    monkeypatch.setattr(llm_stub, 'token_delay', 0.0)
+    monkeypatch.setattr(llm_stub, 'fail_statuses', [])
+    monkeypatch.setattr(llm_stub, 'cached_prefixes', set())
+    # Warm up the lazy anthropic import so it is not charged to the first call's deadline
+    llm_client_utils.get_anthropic_client()
+    return llm_stub
+
+@pytest.mark.parametrize('backend', llm_client_utils.BACKENDS)
+def test_calls_share_pooled_connections(stub, backend):
+    client = llm_client_utils.get_anthropic_client() if backend == 'anthropic' else llm_client_utils.get_ollama_session()
+    connections = stub.connections
+    # One thread for Anthropic: the SDK installed for local runs (1.x on pydantic 1) can mis-parse responses
+    # decoded on several threads at once, unlike the pinned release
+    threads = 1 if backend == 'anthropic' else 4
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda _: complete('Chill rock', backend=backend), range(24)))
+    assert all(result.parsed()['genres'] == ['Rock'] for result in results)
+    assert stub.connections - connections <= threads
+    assert (llm_client_utils.get_anthropic_client() if backend == 'anthropic' else llm_client_utils.get_ollama_session()) is client
+
+def test_cache_prefix_is_a_cached_system_block_for_anthropic(stub):
+    first = complete('Chill rock', backend='anthropic', cache_prefix=PREFIX)
+    second = complete('Sad jazz', backend='anthropic', cache_prefix=PREFIX)
+    assert (first.backend, first.input_tokens, first.cache_write_input_tokens) == ('anthropic', 2, 140)
+    assert (second.input_tokens, second.cached_input_tokens, second.cache_write_input_tokens) == (2, 140, 0)
+
+def test_cache_prefix_is_prepended_for_ollama(stub):
+    result = complete('Chill rock', backend='ollama', cache_prefix=PREFIX)
+    assert (result.backend, result.model, result.input_tokens) == ('ollama', 'llama2:7b', 142)
+    assert result.cached_input_tokens == result.cache_write_input_tokens == 0
+    assert result.output_tokens == result.raw['eval_count'] > 0
+
+@pytest.mark.parametrize('backend', llm_client_utils.BACKENDS)
+def test_timeout_is_not_retried_past_the_deadline(stub, backend, monkeypatch):
+    monkeypatch.setattr(stub, 'delay', 2.0)
+    served = stub.requests_served
+    start = time.monotonic()
+    with pytest.raises(LLMTimeoutError):
+        complete('Chill rock', backend=backend, timeout=0.3)
+    assert time.monotonic() - start < 0.8
+    assert stub.requests_served - served == 1
+
+def test_overloaded_anthropic_is_retried_within_the_deadline(stub):
+    stub.fail_statuses.append(529)
+    served = stub.requests_served
+    assert complete('Chill rock', backend='anthropic', timeout=5).parsed()['genres'] == ['Rock']
+    assert stub.requests_served - served == 2
+
+    # A backoff that would not fit before the deadline is not taken
+    stub.fail_statuses.append(529)
+    start = time.monotonic()
+    with pytest.raises(llm_client_utils.anthropic.APIStatusError):
+        complete('Chill rock', backend='anthropic', timeout=0.3)
+    assert time.monotonic() - start < 0.3
+
+def test_deadline_covers_the_wait_for_a_slot(stub, monkeypatch):
+    monkeypatch.setattr(llm_client_utils, '_limiters', dict(llm_client_utils._limiters, ollama=llm_client_utils._BackendLimiter(1)))
+    monkeypatch.setattr(stub, 'delay', 1.0)
+    holder = threading.Thread(target=complete, args=('Chill rock',), kwargs={'backend': 'ollama'})
+    holder.start()
+    try:
+        while llm_client_utils.get_llm_stats()['ollama']['in_flight'] == 0:
+            time.sleep(0.01)
+        start = time.monotonic()
+        with pytest.raises(LLMTimeoutError, match='slot'):
+            complete('Chill rock', backend='ollama', deadline=time.monotonic() + 0.2)
+        assert time.monotonic() - start < 0.5
+    finally:
+        holder.join(5)
@@ -0,0 +1,28 @@
+"""
+stream_json against benchmarks/llm_stub_server.py, which follows its JSON with a paragraph of prose:
+the stream is closed when the object closes, so the prose is never generated.
+"""
+import json
+
+import pytest
+
+from llm_stub_server import DEFAULT_REPLY, TRAILER, tokenize
+from sql_app.routes import llm_client_utils
+
+REPLY_TOKENS = len(tokenize(DEFAULT_REPLY))
+
+@pytest.mark.parametrize('backend', ['anthropic', 'ollama'])
+def test_stream_stops_when_the_object_closes(llm_stub, backend):
+    tokens_before = llm_stub.tokens_sent
+    result = llm_client_utils.stream_json('Make me a chill rock playlist', backend=backend)
+    assert result.parsed() == json.loads(DEFAULT_REPLY)
+    assert result.stopped_early and result.output_tokens_partial
+    # The backend's final usage never arrives; the count comes from the chunks received
+    assert REPLY_TOKENS - 1 <= result.output_tokens <= REPLY_TOKENS + 1
+    assert llm_stub.tokens_sent - tokens_before < REPLY_TOKENS + len(tokenize(TRAILER)) // 2
+
+def test_ollama_stream_that_runs_to_the_end_uses_reported_counts(llm_stub, monkeypatch):
+    monkeypatch.setattr(llm_stub, 'reply', 'no JSON here')
+    result = llm_client_utils.stream_json('Make me a chill rock playlist', backend='ollama')
+    assert result.parsed() is None and not result.stopped_early and not result.output_tokens_partial
+    assert result.output_tokens == result.raw['eval_count'] == len(tokenize('no JSON here' + TRAILER))
@@ -0,0 +1,92 @@
+"""
+The compiled WHERE-condition mask must select the same rows as the step-by-step DataFrame filtering
+query_songs_with_features used before it, including missing values and conditions that are skipped.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+
+from sql_app.routes.predicate_utils import ColumnarTrackStore, parse_condition_string
+
+GENRES = {'Rock': ['Indie Rock', 'Shoegaze'], 'Electronic': ['Deep House', 'Techno'], 'Jazz': ['Bebop']}
+
+def catalog(rng, n=300):
+    genres = [rng.choice(list(GENRES)) for _ in range(n)]
+    maybe = lambda value: None if rng.random() < 0.05 else value  # noqa: E731
+    return pd.DataFrame({
+        'genre': genres,
+        'subgenre': [maybe(rng.choice(GENRES[genre])) for genre in genres],
+        'year': [rng.randint(1965, 2024) for _ in range(n)],
+        'energy': [maybe(rng.random()) for _ in range(n)],
+        'valence': [rng.random() for _ in range(n)],
+        'tempo_mapped': [rng.uniform(60, 180) for _ in range(n)],
+        'popularity': [rng.randint(0, 100) for _ in range(n)],
+    }, index=rng.sample(range(10 * n), n))
+
+def random_conditions(rng):
+    pool = [
+        f"Energy BETWEEN {rng.choice([0.0, 0.2, 0.4])} AND {rng.choice([0.5, 0.7, 1.0])}",
+        f"Valence {rng.choice(['>', '<', '>=', '<='])} {rng.random():.2f}",
+        f"Tempo_mapped > {rng.randint(80, 150)}",
+        f"Genre IN ('{rng.choice(list(GENRES))}', '{rng.choice(list(GENRES))}')",
+        f"Genre = '{rng.choice(list(GENRES))}'",
+        f"Subgenre LIKE '{rng.choice(['house', 'rock', 'BOP'])}'",
+        f"Year = {rng.randint(1965, 2024)}",
+        f"Year BETWEEN {rng.randint(1965, 1995)} AND {rng.randint(1995, 2024)}",
+        "Loudness > 0.5",
+        "whatever the mood",
+    ]
+    return rng.sample(pool, rng.randint(0, 5))
+
+def step_by_step(df, where_conditions):
+    """
+    The filtering query_songs_with_features did before the compiled mask, without its prints
+    """
+    df = df.copy()
+    for condition in where_conditions:
+        try:
+            operator, column, value = parse_condition_string(condition)
+            if operator is None:
+                continue
+            column_mapping = {}
+            for col in df.columns:
+                if col not in column_mapping:
+                    column_mapping[col.lower()] = col
+            df_column = column_mapping.get(column.lower())
+            if df_column is None:
+                continue
+            if operator == 'IN':
+                df = df[df[df_column].isin(value)]
+            elif operator == 'BETWEEN':
+                df = df[(df[df_column] >= value[0]) & (df[df_column] <= value[1])]
+            elif operator == '>':
+                df = df[df[df_column] > value]
+            elif operator == '<':
+                df = df[df[df_column] < value]
+            elif operator == '>=':
+                df = df[df[df_column] >= value]
+            elif operator == '<=':
+                df = df[df[df_column] <= value]
+            elif operator == 'LIKE':
+                df = df[df[df_column].str.contains(value, case=False, na=False)]
+            elif operator == '=':
+                df = df[df[df_column] == value]
+        except Exception:
+            continue
+    return df
+
+def test_mask_matches_step_by_step_filtering():
+    rng = random.Random(7)
+    df = catalog(rng)
+    for _ in range(300):
+        conditions = random_conditions(rng)
+        expected = step_by_step(df, conditions).index
+        assert df.index[ColumnarTrackStore(df).mask(conditions)].equals(expected), conditions
+
+def test_like_wildcards_and_numeric_in_are_fixed_on_purpose():
+    df = pd.DataFrame({'subgenre': ['Deep House', 'Techno', None], 'year': [1994, 1995, np.nan]})
+    store = ColumnarTrackStore(df)
+    # The old filter searched for the literal '%house%', and compared '1994' (a string) with numbers
+    assert store.mask(["Subgenre LIKE '%house%'"]).tolist() == [True, False, False]
+    assert store.mask(["Year IN ('1994', '1996')"]).tolist() == [True, False, False]
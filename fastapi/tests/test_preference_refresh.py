@@ -0,0 +1,95 @@
+"""
+Every uvicorn worker runs the scheduler; the job lease must let only one of them refresh preferences at a time.
+
+The first run happens here and is held mid-batch; a second worker process is started against the same
+(file-backed SQLite) database and must skip its run.
+"""
+import datetime
+import json
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import crud, main, models
+
+WORKER_SCRIPT = '''
+import json, sys
+from sqlalchemy import event
+from sql_app import database
+
+@event.listens_for(database.engine, 'connect')
+def attach_schemas(connection, _):
+    connection.execute("ATTACH DATABASE '{user_data}' AS user_data")
+
+from sql_app import main
+main.refresh_stale_user_preferences()
+print(json.dumps(main.get_preference_refresh_stats(), default=str))
+'''
+
+@pytest.fixture
+def database_files(tmp_path):
+    primary, user_data = tmp_path / 'primary.db', tmp_path / 'user_data.db'
+    engine = create_engine(f'sqlite:///{primary}')
+
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(connection, _):
+        connection.execute(f"ATTACH DATABASE '{user_data}' AS user_data")
+
+    user_tables = [table for table in models.Base.metadata.sorted_tables if table.schema == 'user_data']
+    models.Base.metadata.create_all(engine, tables=user_tables)
+    yield engine, primary, user_data
+    engine.dispose()
+
+def run_other_worker(primary: Path, user_data: Path) -> dict:
+    result = subprocess.run([sys.executable, '-c', WORKER_SCRIPT.format(user_data=user_data)],
+                            env={'DATABASE_URL': f'sqlite:///{primary}', 'PATH': ''},
+                            cwd=Path(main.__file__).resolve().parent.parent, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_second_concurrent_run_is_skipped(database_files, monkeypatch):
+    engine, primary, user_data = database_files
+    monkeypatch.setattr(main, 'SessionLocal', sessionmaker(bind=engine))
+    monkeypatch.setattr(crud, 'iter_active_stale_user_batches', lambda db, batch_size: iter([[models.UserToken(api_key='user', music_user_token='token')]]))
+    in_batch, finish_batch = threading.Event(), threading.Event()
+
+    def compute_user_preferences(api_key, music_user_token):
+        in_batch.set()
+        finish_batch.wait(30)
+        return None
+
+    monkeypatch.setattr(main, '_compute_user_preferences', compute_user_preferences)
+    runs_before = main.get_preference_refresh_stats()['runs']
+    first_run = threading.Thread(target=main.refresh_stale_user_preferences)
+    first_run.start()
+    try:
+        assert in_batch.wait(10)
+        other = run_other_worker(primary, user_data)
+        assert other['skipped_runs'] == 1 and other['runs'] == 0
+    finally:
+        finish_batch.set()
+        first_run.join(30)
+    assert main.get_preference_refresh_stats()['runs'] == runs_before + 1
+    with sessionmaker(bind=engine)() as db:
+        assert db.query(models.JobLease).count() == 0
+
+    # Once the lease is released the next worker runs
+    other = run_other_worker(primary, user_data)
+    assert other['skipped_runs'] == 0 and other['runs'] == 1
+
+def test_expired_lease_is_taken_over(make_engine):
+    with sessionmaker(bind=make_engine(models.JobLease))() as db:
+        assert crud.try_acquire_job_lease(db, 'job', 'a', ttl_seconds=60)
+        assert not crud.try_acquire_job_lease(db, 'job', 'b', ttl_seconds=60)
+        # A crashed holder's lease lapses and the next run takes it over
+        db.query(models.JobLease).update({'expires_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+        db.commit()
+        assert crud.try_acquire_job_lease(db, 'job', 'b', ttl_seconds=60)
+        assert not crud.renew_job_lease(db, 'job', 'a', ttl_seconds=60)
+        crud.release_job_lease(db, 'job', 'a')
+        assert db.query(models.JobLease).one().holder == 'b'
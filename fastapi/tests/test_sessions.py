@@ -0,0 +1,68 @@
+"""
+Sessions and API keys live in user_data: create one through the endpoint, look it up past the per-worker
+cache, expire it and sweep it.
+"""
+import asyncio
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from sql_app import models
+from sql_app.database import get_db
+from sql_app.routes import session_utils, web
+
+@pytest.fixture
+def db(make_engine):
+    session = sessionmaker(bind=make_engine(models.UserSession, models.UserApiKey))()
+    session_utils.sessions.clear()
+    session_utils.api_keys.clear()
+    yield session
+    session.close()
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setenv('API_KEY', 'admin')
+    app = FastAPI()
+    app.include_router(web.router)
+    app.dependency_overrides[get_db] = lambda: db
+    return TestClient(app)
+
+def test_db_only_routes_run_in_the_threadpool():
+    assert not asyncio.iscoroutinefunction(web.create_session_endpoint)
+    assert not asyncio.iscoroutinefunction(web.get_all_api_keys)
+
+def test_session_create_lookup_expire_sweep(db, client):
+    response = client.post('/web/create_session_endpoint/', json={'user_token': 'music-user-token'})
+    assert response.status_code == 200
+    api_key = parse_qs(urlparse(response.json()['redirect_url']).query)['api_key'][0]
+    cookie = response.cookies[session_utils.SESSION_COOKIE_NAME]
+
+    # Another worker has nothing cached and reads through to user_data
+    session_utils.sessions.clear()
+    session_utils.api_keys.clear()
+    api_key_data = session_utils.get_api_key(x_api_key=api_key, db=db)
+    assert session_utils.get_session(db, api_key_data['session_id'])['user_token'] == 'music-user-token'
+    assert session_utils.get_current_session(session_cookie=cookie, db=db)['user_token'] == 'music-user-token'
+    all_sessions, all_api_keys = client.get('/web/get_all_api_keys/', headers={'X-API-Key': 'admin'}).json()
+    assert list(all_sessions) == [api_key_data['session_id']] and list(all_api_keys) == [api_key]
+
+    past = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    db.query(models.UserSession).update({'expires_at': past})
+    db.query(models.UserApiKey).update({'expires_at': past})
+    db.commit()
+    # The DB read-through ignores expired rows
+    session_utils.sessions.clear()
+    session_utils.api_keys.clear()
+    assert session_utils.get_session(db, api_key_data['session_id']) is None
+    with pytest.raises(HTTPException) as error:
+        session_utils.get_api_key(x_api_key=api_key, db=db)
+    assert error.value.status_code == 401
+    assert session_utils.return_all_sessions_api_keys(db) == ({}, {})
+
+    assert session_utils.sweep_expired_sessions(db) == (1, 1)
+    assert db.query(models.UserSession).count() == 0 and db.query(models.UserApiKey).count() == 0
+    assert session_utils.sweep_expired_sessions(db) == (0, 0)